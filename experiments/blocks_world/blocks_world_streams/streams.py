@@ -3,12 +3,12 @@ This module contains functions that assist with grasping and placing
 in the kitchen environment
 """
 from panda_station.grasping_and_placing import DROP_HEIGHT
+from panda_station.ik_templates import ik_program
 import random
 import numpy as np
 from numpy import random
 from pydrake.all import (
     Solve,
-    InverseKinematics,
     Box,
     Cylinder,
     Sphere,
@@ -29,6 +29,12 @@ Q_NOMINAL = np.array([0.0, 0.55, 0.0, -1.45, 0.0, 1.58, 0.0])
 HAND_FRAME_NAME = "panda_hand"
 THETA_TOL = np.pi * 0.01
 DROP_HEIGHT = 0.02
+# the panda's maximum reach from its shoulder (see the panda datasheet)
+MAX_ARM_REACH = 0.855
+SHOULDER_HEIGHT = 0.333
+# placements about this far from the shoulder are the easiest to reach
+COMFORTABLE_REACH = 0.55
+NUM_CANDIDATES = 256
 np.random.seed(0)
 random.seed(0)
 
@@ -92,6 +98,141 @@ def find_block_place(station, station_context, shape_info, surface):
     R_WI = RotationMatrix.MakeZRotation(np.random.uniform(0, 2*np.pi)) #RotationMatrix()
     return RigidTransform(R_WI, p_WI_W)
 
+def footprint_radius(shape):
+    """
+    Radius of the circle (in the xy plane of the shape) containing shape
+    """
+    if isinstance(shape, Box):
+        return np.hypot(shape.width(), shape.depth())/2
+    if isinstance(shape, Cylinder):
+        return shape.radius()
+    return 0
+
+def object_footprints(station, station_context, shape_infos):
+    """
+    Returns (centers, radii): the xy positions (N, 2) in the world and
+    footprint radii (N,) of the shapes in shape_infos
+    """
+    plant, plant_context = get_plant_and_context(station, station_context)
+    centers = np.array([
+        shape_info.offset_frame.CalcPoseInWorld(plant_context).translation()[:2]
+        for shape_info in shape_infos
+    ]).reshape(-1, 2)
+    radii = np.array([footprint_radius(shape_info.shape) for shape_info in shape_infos])
+    return centers, radii
+
+def arm_shoulders(station):
+    """
+    Returns the positions (N, 3) of the shoulders of the arms in station
+    """
+    return np.array([
+        panda_info.X_WB.multiply(np.array([0, 0, SHOULDER_HEIGHT]))
+        for panda_info in station.panda_infos.values()
+    ])
+
+def grasp_height(shape_info):
+    """
+    Height of the hand above the frame of `shape_info` when grasping
+    it from above (see find_grasp)
+    """
+    if isinstance(shape_info.shape, Box):
+        return HAND_HEIGHT + shape_info.shape.height() - FINGER_WIDTH / 2
+    if isinstance(shape_info.shape, Cylinder):
+        return HAND_HEIGHT + shape_info.shape.length() - FINGER_WIDTH / 2
+    return HAND_HEIGHT
+
+def table_place_candidates(
+    station,
+    station_context,
+    shape_info,
+    surface,
+    footprints = None,
+    reachability = None,
+    num_candidates = NUM_CANDIDATES
+):
+    """
+    Sample num_candidates placements of `shape_info` on `surface` at once,
+    and return the worldposes X_WI of those that are on the surface's
+    bounding box, within reach of an arm (by distance, and by the arms'
+    reachability maps if given, see panda_station.reachability) and clear
+    of footprints (see object_footprints), easiest to reach first
+    """
+    radius = footprint_radius(shape_info.shape)
+    border = np.ones(3)*radius
+    lower = surface.bb_min + border
+    upper = surface.bb_max - border
+    if np.any(lower[:2] > upper[:2]):
+        return []
+    plant, plant_context = get_plant_and_context(station, station_context)
+    S = surface.shape_info.offset_frame
+    p_SI_S = np.random.uniform(lower, upper, size = (num_candidates, 3))
+    p_SI_S[:, 2] = surface.bb_min[2] + 1e-3
+    X_WS = plant.CalcRelativeTransform(plant_context, plant.world_frame(), S)
+    p_WI_W = X_WS.translation() + p_SI_S.dot(X_WS.rotation().matrix().T)
+    reach = np.min(
+        np.linalg.norm(p_WI_W[:, None] - arm_shoulders(station)[None], axis = 2),
+        axis = 1
+    )
+    keep = reach <= MAX_ARM_REACH
+    if reachability:
+        p_WH_W = p_WI_W + np.array([0, 0, grasp_height(shape_info)])
+        rates = np.max([arm.success_rates(p_WH_W) for arm in reachability], axis = 0)
+        keep &= rates > 0
+    if footprints is not None and len(footprints[1]) > 0:
+        centers, radii = footprints
+        dists = np.linalg.norm(p_WI_W[:, None, :2] - centers[None], axis = 2)
+        keep &= np.all(dists >= radii[None] + radius, axis = 1)
+    order = np.argsort(np.abs(reach - COMFORTABLE_REACH))
+    yaws = np.random.uniform(0, 2*np.pi, size = num_candidates)
+    return [
+        RigidTransform(RotationMatrix.MakeZRotation(yaws[i]), p_WI_W[i])
+        for i in order if keep[i]
+    ]
+
+def table_place_batch(
+    station, station_context, shape_info, surface, footprints = None, reachability = None
+):
+    """
+    Returns a batch of placements of `shape_info` on `surface` from
+    table_place_candidates, falling back to find_table_place when the whole
+    batch is filtered out
+    """
+    candidates = table_place_candidates(
+        station,
+        station_context,
+        shape_info,
+        surface,
+        footprints = footprints,
+        reachability = reachability
+    )
+    if len(candidates) == 0:
+        return [find_table_place(station, station_context, shape_info, surface)]
+    return candidates
+
+def grasp_candidates(shape_info, num_candidates = NUM_CANDIDATES):
+    """
+    Returns distinct grasp handposes X_HI for `shape_info` (see find_grasp)
+    in random order: the four top down grasps of a box, or num_candidates
+    evenly spaced ones around a cylinder
+    """
+    if isinstance(shape_info.shape, Box):
+        length = shape_info.shape.height()
+        z_rots = (np.pi/2)*np.random.permutation(4)
+    elif isinstance(shape_info.shape, Cylinder):
+        length = shape_info.shape.length()
+        offset = np.random.uniform(0, 2*np.pi/num_candidates)
+        z_rots = offset + 2*np.pi*np.random.permutation(num_candidates)/num_candidates
+    else:
+        return []
+    h = HAND_HEIGHT + length - FINGER_WIDTH / 2
+    return [
+        RigidTransform(
+            RotationMatrix.MakeXRotation(np.pi).multiply(RotationMatrix.MakeZRotation(z_rot)),
+            [0, 0, h]
+        )
+        for z_rot in z_rots
+    ]
+
 def find_ik_with_relaxed(
     station,
     station_context,
@@ -155,9 +296,8 @@ def find_ik_with_handpose(
     H = plant.GetFrameByName(HAND_FRAME_NAME, panda_info.hand)  # hand frame
     G = object_info.get_frame() #shape_info.offset_frame  # geometry frasinkme
     W = plant.world_frame()
-    ik = InverseKinematics(plant, plant_context)
-    if not relax:
-        ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+    min_distance = None if relax else (COL_MARGIN, CONSIDER_MARGIN)
+    ik = ik_program(plant, plant_context, q_nominal, min_distance=min_distance)
     lower = X_HI.translation() - np.array([0.001, 0.001, 0.01])
     upper = X_HI.translation() + np.array([0.001, 0.001, 0.01])
     ik.AddPositionConstraint(
@@ -177,7 +317,6 @@ def find_ik_with_handpose(
     )
     prog = ik.prog()
     q = ik.q()
-    prog.AddQuadraticErrorCost(np.identity(len(q)), q_nominal, q)
     prog.SetInitialGuess(q, q_initial)
     result = Solve(prog)
     cost = result.get_optimal_cost()
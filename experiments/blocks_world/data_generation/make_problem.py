@@ -1,10 +1,14 @@
 import os
 import time
 import itertools
+from functools import lru_cache
 from learning.poisson_disc_sampling import PoissonSampler, GridSampler
 import numpy as np
 import yaml
 import xml.etree.ElementTree as ET
+from pydrake.all import RigidTransform
+from panda_station.grasping_and_placing import HAND_HEIGHT
+from panda_station.reachability import load_reachability
 
 np.random.seed(seed=int(time.time()))
 
@@ -21,6 +25,27 @@ BLOCKER_DIMS = np.array([0.045, 0.045, 0.1])
 ARM_POS = np.array([0,0])
 MAX_ARM_REACH = 0.7 # Note: the actual limit is 0.855, https://www.generationrobots.com/media/panda-franka-emika-datasheet.pdf
 
+@lru_cache(maxsize=None)
+def arm_reachability():
+    """
+    Returns the reachability map of the arm if it has been built
+    (see panda_station.reachability), loaded on first use
+    """
+    return load_reachability(RigidTransform([ARM_POS[0], ARM_POS[1], 0]))
+
+def out_of_reach(p):
+    """
+    Returns True if a block at the xy position p on a table can not be
+    grasped from above (by distance, and by the reachability map if there is one)
+    """
+    if np.linalg.norm(p - ARM_POS) > MAX_ARM_REACH:
+        return True
+    reachability = arm_reachability()
+    if reachability is None:
+        return False
+    p_H = np.array([p[0], p[1], TABLE_HEIGHT + BLOCK_DIMS[2] + HAND_HEIGHT])
+    return reachability.success_rates(p_H)[0] == 0
+
 
 # table_name: (center point, extent)
 TABLES = {
@@ -161,7 +186,7 @@ def make_random_problem(num_blocks, num_blockers, colorize=False, buffer_radius=
     between two objects (which is currently ~1cm).
     """
     
-    filter = lambda point: np.linalg.norm((point + item[0]) - ARM_POS) > MAX_ARM_REACH
+    filter = lambda point: out_of_reach(point + item[0])
 
     if grid:
         rand_rotation = False
@@ -319,7 +344,7 @@ def make_clutter_problem(num_blocks, num_blockers = None, tighten_clumping = Fal
 def make_non_monotonic_problem(num_blocks, clump = False, buffer_radius = 0, prioritize_grouping = False, colorize = False, max_goal_stack = 1):
 
     num_blockers = num_blocks
-    filter = lambda point: np.linalg.norm((point + item[0]) - ARM_POS) > MAX_ARM_REACH
+    filter = lambda point: out_of_reach(point + item[0])
 
     positions = {}
     samplers= {}
@@ -451,7 +476,7 @@ def make_sorting_problem(num_blocks, num_blockers = None, buffer_radius=0, max_s
     num_green = num_blocks-num_red
 
 
-    filter = lambda point: np.linalg.norm((point + item[0]) - ARM_POS) > MAX_ARM_REACH
+    filter = lambda point: out_of_reach(point + item[0])
 
     if grid:
         rand_rotation = False
@@ -609,7 +634,7 @@ def make_distractor_problem(num_blocks, num_blockers, colorize=False, buffer_rad
     def pick_random_table_blocker():
         return np.random.choice(list(TABLES.keys())[2:])
 
-    filter = lambda point: np.linalg.norm((point + item[0]) - ARM_POS) > MAX_ARM_REACH
+    filter = lambda point: out_of_reach(point + item[0])
 
     if grid:
         rand_rotation = False
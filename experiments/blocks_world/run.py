@@ -5,6 +5,7 @@ See `problem 2` at this link for details:
 http://tampbenchmark.aass.oru.se/index.php?title=Problems
 """
 from copy import deepcopy
+import atexit
 import time
 import psutil
 import numpy as np
@@ -35,9 +36,11 @@ from pddlstream.algorithms.meta import solve
 from pddlstream.algorithms.algorithm import reset_globals
 from learning import visualization
 from learning import oracle as ora
+from learning import profiling
 from panda_station import (
     rt_to_xyzrpy,
     ProblemInfo,
+    StationPool,
     parse_start_poses,
     parse_config,
     update_station,
@@ -45,6 +48,19 @@ from panda_station import (
     PlanToTrajectory,
     TrajectoryDirector,
     find_traj,
+    start_planner_race,
+    start_ik_executor,
+    start_stream_executor,
+    ik_seed,
+    learn_ik_solution,
+    get_reachability,
+    solve_variants,
+    seed_variants,
+    station_object,
+    station_panda,
+    STATION,
+    STATION_CONTEXT,
+    MotionCache,
     Colors,
     RigidTransformWrapper,
     update_graspable_shapes,
@@ -106,7 +122,7 @@ def retrieve_model_poses(
 
     return res
 
-def construct_problem_from_sim(simulator, stations, problem_info, planning_objects=None):
+def construct_problem_from_sim(simulator, stations, problem_info, planning_objects=None, motion_planner="lbkpiece1", motion_cache=None, path_simplify="ompl", prefetch_stations=False, single_plant=False, ik_seeds=1, reachability=False, stream_executor=None):
     """
     Construct pddlstream problem from simulator
     """
@@ -116,9 +132,18 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
     main_station = stations["main"]
     simulator_context = simulator.get_context()
     main_station_context = main_station.GetMyContextFromRoot(simulator_context)
-    station_contexts = {}
-    for name in stations:
-        station_contexts[name] = stations[name].CreateDefaultContext()
+    station_pool = StationPool(problem_info, stations, single_plant=single_plant)
+    station_contexts = {name: station_pool.get(name)[1] for name in stations}
+    if prefetch_stations:
+        station_pool.prefetch()
+    # reachability maps of the arms, built on the first run for each base pose
+    arm_reachability = {}
+    if reachability:
+        station, station_context = station_pool.get("move_free")
+        for arm_name, panda_info in station.panda_infos.items():
+            arm_reachability[arm_name] = get_reachability(station, station_context, panda_info)
+            # keep the IK outcomes recorded during the run (see find_ik)
+            atexit.register(arm_reachability[arm_name].save)
     # start poses of all manipulands
     start_poses = parse_start_poses(main_station, main_station_context)
 
@@ -222,27 +247,9 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
         }
     )
 
-    def get_station(name, arm_name=None):
-        if arm_name is None:
-            return stations[name], station_contexts[name]  # ie. move_free
-
-        if arm_name not in stations:
-            stations[arm_name] = {}
-            station_contexts[arm_name] = {}
-        if name in stations[arm_name]:
-            return stations[arm_name][name], station_contexts[arm_name][name]
-
-        stations[arm_name][name] = problem_info.make_holding_station(
-            name, arm_name=arm_name
-        )
-        station_contexts[arm_name][name] = stations[arm_name][
-            name
-        ].CreateDefaultContext()
-        return stations[arm_name][name], station_contexts[arm_name][name]
-
     def find_motion(arm_name, q1, q2, fluents=[]):
         lprint(f"{Colors.BLUE}Starting trajectory stream{Colors.RESET}")
-        station, station_context = get_station("move_free")
+        station_key = ("move_free",)
         holding_block = None
         other_name = None
         q_other = None
@@ -259,30 +266,32 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
                 continue
             if fluent[0] == "athandpose":
                 holding_block = fluent[2]
-                station, station_context = get_station(holding_block, arm_name=arm_name)
+                station_key = (holding_block, arm_name)
                 fluents[i] = ("athandpose", holding_block, fluent[3])
             i += 1
 
-        update_station(station, station_context, fluents)
-        if other_name is not None:
-            update_arm(station, station_context, other_name, q_other)
-        panda = station.panda_infos[arm_name].panda
+        plan = find_traj if motion_cache is None else motion_cache.find_traj
         while True:
-            traj = find_traj(
-                station,
-                station_context,
-                q1,
-                q2,
-                ignore_endpoint_collisions=False,
-                panda=panda,
-                verbose=VERBOSE,
-            )
+            with station_pool.context(*station_key) as (station, station_context):
+                update_station(station, station_context, fluents)
+                if other_name is not None:
+                    update_arm(station, station_context, other_name, q_other)
+                traj = plan(
+                    station,
+                    station_context,
+                    q1,
+                    q2,
+                    ignore_endpoint_collisions=False,
+                    panda=station.panda_infos[arm_name].panda,
+                    verbose=VERBOSE,
+                    planner=motion_planner,
+                    simplify=path_simplify,
+                )
             if traj is None:
                 return
             yield traj,
-            update_station(station, station_context, fluents)
-            if other_name is not None:
-                update_arm(station, station_context, other_name, q_other)
+            # the next trajectory for this query should be a new one
+            plan = find_traj
 
     def find_grasp(block):
         lprint(f"{Colors.BLUE}Starting grasp stream for {block}{Colors.RESET}")
@@ -290,20 +299,13 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
         object_info = station.object_infos[block][0]
         shape_info = update_graspable_shapes(object_info)[0]
         while True:
-            lprint(f"{Colors.REVERSE}Yielding X_H{block}{Colors.RESET}")
-            yield RigidTransformWrapper(
-                blocks_world_streams.find_grasp(shape_info), name=f"X_H{block}"
-            ),
+            for X_HB in blocks_world_streams.grasp_candidates(shape_info):
+                lprint(f"{Colors.REVERSE}Yielding X_H{block}{Colors.RESET}")
+                yield RigidTransformWrapper(X_HB, name=f"X_H{block}"),
 
     def find_ik(arm_name, block, X_WB, X_HB):
         lprint(f"{Colors.BLUE}Starting ik stream for {block} at {X_WB}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", block, X_WB)],
-            set_to_inf=planning_objects,
-        )
+        station = station_pool["move_free"]
         object_info = station.object_infos[block][0]
         panda_info = station.panda_infos[arm_name]
         p_WB = X_WB.get_rt().translation()
@@ -311,95 +313,121 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
         dy = p_WB[1] - X_WP.translation()[1]
         dx = p_WB[0] - X_WP.translation()[0]
         q0 = np.arctan2(dy, dx) - pydrake.math.RollPitchYaw(X_WP.rotation()).yaw_angle()
-        q_initial = Q_NOMINAL[:]
-        q_initial[0] = q0
+        q_guess = Q_NOMINAL[:]
+        q_guess[0] = q0
+        X_WH = X_WB.get_rt().multiply(X_HB.get_rt())
+        arm = arm_reachability.get(arm_name)
+        if arm is not None and arm.success_rate(X_WH) == 0:
+            lprint(f"{Colors.RED}{block} is out of reach of {arm_name}{Colors.RESET}")
+            return
+        q_initial = None
         while True:
-            lprint(f"{Colors.GREEN}Finding ik for {block}{Colors.RESET}")
-            q, cost = blocks_world_streams.find_ik_with_relaxed(
-                station,
-                station_context,
-                object_info,
-                X_HB.get_rt(),
-                panda_info,
-                q_initial=q_initial,
-            )
-            if not np.isfinite(cost):
-                print(f"{Colors.RED}Failed ik for {block}{Colors.RESET}")
-                return
-            pre_q = find_pregrasp(
-                station, station_context, q, 0.07, panda_info=panda_info
-            )
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", block, X_WB)],
+                    set_to_inf=planning_objects,
+                )
+                if q_initial is None:
+                    q_initial = ik_seed(station, station_context, panda_info, X_WH, q_guess)
+                lprint(f"{Colors.GREEN}Finding ik for {block}{Colors.RESET}")
+                q, cost = solve_variants(
+                    station,
+                    station_context,
+                    blocks_world_streams.find_ik_with_relaxed,
+                    seed_variants(
+                        station,
+                        (STATION, STATION_CONTEXT, station_object(object_info), X_HB.get_rt(), station_panda(panda_info)),
+                        {},
+                        q_initial,
+                        ik_seeds,
+                    ),
+                    panda=panda_info.panda,
+                )
+                if arm is not None:
+                    arm.record(X_WH, np.isfinite(cost))
+                if not np.isfinite(cost):
+                    print(f"{Colors.RED}Failed ik for {block}{Colors.RESET}")
+                    return
+                learn_ik_solution(station, station_context, panda_info, q)
+                pre_q = find_pregrasp(
+                    station, station_context, q, 0.07, panda_info=panda_info
+                )
             lprint(f"{Colors.REVERSE}Yielding ik for {block}{Colors.RESET}")
             yield pre_q, q
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", block, X_WB)],
-                set_to_inf=planning_objects,
-            )
 
     def find_table_place(block, table):
         lprint(
             f"{Colors.BLUE}Starting place stream for {block} on {table}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[block][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
+        object_name, link_name = table
+        target_object_info = station.object_infos[object_name][0]
+        # objects left out of planning stay where they started
+        static_shapes = [
+            update_placeable_shapes(object_info)[0]
+            for name, (object_info, Xinit_WO) in station.object_infos.items()
+            if Xinit_WO is not None and planning_objects is not None and name not in planning_objects
+        ]
+        footprints = None
         while True:
-            object_name, link_name = table
-            target_object_info = station.object_infos[object_name][0]
-            surface = update_surfaces(
-                target_object_info, link_name, station, station_context
-            )[0]
-            yield RigidTransformWrapper(
-                blocks_world_streams.find_table_place(
-                    station, station_context, shape_info, surface
-                ),
-                name=f"X_W{block}",
-            ),
+            with station_pool.context("move_free") as (station, station_context):
+                surface = update_surfaces(
+                    target_object_info, link_name, station, station_context
+                )[0]
+                if footprints is None:
+                    footprints = blocks_world_streams.object_footprints(
+                        station, station_context, static_shapes
+                    )
+                batch = blocks_world_streams.table_place_batch(
+                    station,
+                    station_context,
+                    shape_info,
+                    surface,
+                    footprints=footprints,
+                    reachability=list(arm_reachability.values()),
+                )
+            for X_WB in batch:
+                yield RigidTransformWrapper(X_WB, name=f"X_W{block}"),
 
     def find_block_place(block, lowerblock, X_WL):
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", lowerblock, X_WL)],
-            set_to_inf=planning_objects,
-        )
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[block][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
         target_object_info = station.object_infos[lowerblock][0]
-        surface = update_surfaces(
-            target_object_info, "base_link", station, station_context
-        )[0]
         while True:
-            yield RigidTransformWrapper(
-                blocks_world_streams.find_block_place(
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", lowerblock, X_WL)],
+                    set_to_inf=planning_objects,
+                )
+                surface = update_surfaces(
+                    target_object_info, "base_link", station, station_context
+                )[0]
+                X_WB = blocks_world_streams.find_block_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{block}_on_{lowerblock}",
-            ),
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", lowerblock, X_WL)],
-                set_to_inf=planning_objects,
-            )
+                )
+            yield RigidTransformWrapper(X_WB, name=f"X_W{block}_on_{lowerblock}"),
 
     def check_colfree_block(arm_name, q, block, X_WB):
         lprint(
             f"{Colors.BLUE}Checking for collisions between {arm_name} and {block}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("atpose", block, X_WB)], set_to_inf=planning_objects
-        )
-        free = blocks_world_streams.check_colfree_block(
-            station, station_context, arm_name, q
-        )
-        if not free:
-            print(f"{Colors.RED}Detected collisions between {arm_name} and {block}{Colors.RESET}")
-        return free
+        with station_pool.context("move_free") as (station, station_context):
+            update_station(
+                station, station_context, [("atpose", block, X_WB)], set_to_inf=planning_objects
+            )
+            free = blocks_world_streams.check_colfree_block(
+                station, station_context, arm_name, q
+            )
+            if not free:
+                print(f"{Colors.RED}Detected collisions between {arm_name} and {block}{Colors.RESET}")
+            return free
 
     stream_map = {
         "find-traj": from_gen_fn(find_motion),
@@ -409,10 +437,29 @@ def construct_problem_from_sim(simulator, stations, problem_info, planning_objec
         "find-block-place": from_gen_fn(find_block_place),
         "check-colfree-block": from_test(check_colfree_block),
     }
+    if stream_executor is not None:
+        # evaluate the generator streams' instances in the executor's worker
+        # processes (the test stays here, see StreamExecutor.wrap_stream_map)
+        stream_map = stream_executor.wrap_stream_map(
+            stream_map,
+            names=["find-traj", "find-ik", "find-grasp", "find-table-place", "find-block-place"],
+            planning_objects=planning_objects,
+        )
+    stream_map = profiling.profile_stream_map(stream_map)
 
     return PDDLProblem(domain_pddl, {}, stream_pddl, stream_map, init, goal), model_poses
 
 
+def make_stream_map(problem_file, **kwargs):
+    """
+    Build the stream map for problem_file from scratch, as the workers
+    of a StreamExecutor do. kwargs are passed to construct_problem_from_sim
+    """
+    sim, station_dict, _, _, prob_info = make_and_init_simulation(None, problem_file)
+    problem, _ = construct_problem_from_sim(sim, station_dict, prob_info, **kwargs)
+    return problem.stream_map
+
+
 def make_and_init_simulation(zmq_url, prob):
     """
     Make the simulation, and let it run for 0.2 s to let all the objects
@@ -588,6 +635,16 @@ def run_blocks_world(
     eager_mode=False,
     path=None,  
     max_planner_time = 10,
+    motion_planner = "lbkpiece1",
+    motion_cache = False,
+    motion_cache_path = None,
+    path_simplify = "ompl",
+    prefetch_stations = False,
+    single_plant = False,
+    ik_workers = 0,
+    ik_seeds = 1,
+    reachability = False,
+    stream_workers = 0,
 ):
 
     memory_percent = psutil.virtual_memory().percent
@@ -627,7 +684,41 @@ def run_blocks_world(
         meshcat_vis,
         prob_info,
     ) = make_and_init_simulation(url, problem_file)
-    problem, model_poses = construct_problem_from_sim(sim, station_dict, prob_info)
+    if motion_planner == "race":
+        start_planner_race(problem_file)
+    if ik_workers:
+        start_ik_executor(problem_file, processes=ik_workers)
+    stream_executor = None
+    if stream_workers:
+        # the workers plan with a single planner, rather than racing them
+        stream_executor = start_stream_executor(
+            "experiments.blocks_world.run:make_stream_map",
+            problem_file,
+            processes=stream_workers,
+            motion_planner="lbkpiece1" if motion_planner == "race" else motion_planner,
+            path_simplify=path_simplify,
+            single_plant=single_plant,
+            ik_seeds=ik_seeds,
+            reachability=reachability,
+        )
+    motion_cache = (
+        MotionCache(path=motion_cache_path, problem_file=problem_file)
+        if motion_cache or motion_cache_path
+        else None
+    )
+    problem, model_poses = construct_problem_from_sim(
+        sim,
+        station_dict,
+        prob_info,
+        motion_planner=motion_planner,
+        motion_cache=motion_cache,
+        path_simplify=path_simplify,
+        prefetch_stations=prefetch_stations,
+        single_plant=single_plant,
+        ik_seeds=ik_seeds,
+        reachability=reachability,
+        stream_executor=stream_executor,
+    )
     oracle = construct_oracle(mode, problem, prob_info, model_poses, **oracle_kwargs)
 
     print("Initial:", str_from_object(problem.init))
@@ -653,6 +744,9 @@ def run_blocks_world(
     )
     print(f"\n\n{algorithm} solution:")
     print_solution(solution)
+    if motion_cache is not None:
+        for name, value in motion_cache.close().items():
+            profiling.count(f"motion_cache.{name}", value)
 
     plan, _, evaluations = solution
     if plan is None:
@@ -669,7 +763,9 @@ def run_blocks_world(
     if not algorithm.startswith("informed"):
         make_plot(path + "stats.json", save_path=path + "plots.png")
         visualization.stats_to_graph(
-            path + "stats.json", save_path=path + "preimage_graph.html"
+            path + "stats.json",
+            save_path=path + "preimage_graph.html",
+            json_path=path + "preimage_graph.json",
         )
 
     if simulate:
@@ -33,10 +33,12 @@ from pddlstream.algorithms.meta import solve
 from pddlstream.algorithms.algorithm import reset_globals
 from learning import visualization
 from learning import oracle as ora
+from learning import profiling
 from panda_station import (
     TrajType,
     rt_to_xyzrpy,
     ProblemInfo,
+    StationPool,
     parse_start_poses,
     parse_config,
     update_station,
@@ -113,9 +115,8 @@ def construct_problem_from_sim(simulator, stations, problem_info):
     main_station = stations["main"]
     simulator_context = simulator.get_context()
     main_station_context = main_station.GetMyContextFromRoot(simulator_context)
-    station_contexts = {}
-    for name in stations:
-        station_contexts[name] = stations[name].CreateDefaultContext()
+    station_pool = StationPool(problem_info, stations)
+    station_contexts = {name: station_pool.get(name)[1] for name in stations}
     # start poses of all manipulands
     start_poses = parse_start_poses(main_station, main_station_context)
 
@@ -228,30 +229,12 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         }
     )
 
-    def get_station(name, arm_name=None):
-        if arm_name is None:
-            return stations[name], station_contexts[name]  # ie. move_free
-
-        if arm_name not in stations:
-            stations[arm_name] = {}
-            station_contexts[arm_name] = {}
-        if name in stations[arm_name]:
-            return stations[arm_name][name], station_contexts[arm_name][name]
-
-        stations[arm_name][name] = problem_info.make_holding_station(
-            name, arm_name=arm_name
-        )
-        station_contexts[arm_name][name] = stations[arm_name][
-            name
-        ].CreateDefaultContext()
-        return stations[arm_name][name], station_contexts[arm_name][name]
-
     def find_motion(arm_name, q1, q2, fluents=[]):
         if DUMMY_STREAMS:
             while True:
                 yield "motion",
         lprint(f"{Colors.BLUE}Starting trajectory stream{Colors.RESET}")
-        station, station_context = get_station("move_free")
+        station_key = ("move_free",)
         holding_block = None
         other_name = None
         q_other = None
@@ -268,30 +251,27 @@ def construct_problem_from_sim(simulator, stations, problem_info):
                 continue
             if fluent[0] == "athandpose":
                 holding_block = fluent[2]
-                station, station_context = get_station(holding_block, arm_name=arm_name)
+                station_key = (holding_block, arm_name)
                 fluents[i] = ("athandpose", holding_block, fluent[3])
             i += 1
 
-        update_station(station, station_context, fluents)
-        if other_name is not None:
-            update_arm(station, station_context, other_name, q_other)
-        panda = station.panda_infos[arm_name].panda
         while True:
-            traj = find_traj(
-                station,
-                station_context,
-                q1,
-                q2,
-                ignore_endpoint_collisions=False,
-                panda=panda,
-                verbose=VERBOSE,
-            )
+            with station_pool.context(*station_key) as (station, station_context):
+                update_station(station, station_context, fluents)
+                if other_name is not None:
+                    update_arm(station, station_context, other_name, q_other)
+                traj = find_traj(
+                    station,
+                    station_context,
+                    q1,
+                    q2,
+                    ignore_endpoint_collisions=False,
+                    panda=station.panda_infos[arm_name].panda,
+                    verbose=VERBOSE,
+                )
             if traj is None:
                 return
             yield traj,
-            update_station(station, station_context, fluents)
-            if other_name is not None:
-                update_arm(station, station_context, other_name, q_other)
 
     def find_grasp(disc):
         if DUMMY_STREAMS:
@@ -312,13 +292,7 @@ def construct_problem_from_sim(simulator, stations, problem_info):
             while True:
                 yield "pre_q","q"
         lprint(f"{Colors.BLUE}Starting ik stream for {disc} at {X_WB}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", disc, X_WB)],
-            set_others_to_inf=True,
-        )
+        station = station_pool["move_free"]
         object_info = station.object_infos[disc][0]
         panda_info = station.panda_infos[arm_name]
         p_WB = X_WB.get_rt().translation()
@@ -329,29 +303,30 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         q_initial = Q_NOMINAL[:]
         q_initial[0] = q0
         while True:
-            lprint(f"{Colors.GREEN}Finding ik for {disc}{Colors.RESET}")
-            q, cost = hanoi_streams.find_ik_with_relaxed(
-                station,
-                station_context,
-                object_info,
-                X_HB.get_rt(),
-                panda_info,
-                q_initial=q_initial,
-            )
-            if not np.isfinite(cost):
-                lprint(f"{Colors.RED}Failed ik for {disc}{Colors.RESET}")
-                return
-            pre_q = find_pregrasp(
-                station, station_context, q, 0.07, panda_info=panda_info
-            )
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", disc, X_WB)],
+                    set_others_to_inf=True,
+                )
+                lprint(f"{Colors.GREEN}Finding ik for {disc}{Colors.RESET}")
+                q, cost = hanoi_streams.find_ik_with_relaxed(
+                    station,
+                    station_context,
+                    object_info,
+                    X_HB.get_rt(),
+                    panda_info,
+                    q_initial=q_initial,
+                )
+                if not np.isfinite(cost):
+                    lprint(f"{Colors.RED}Failed ik for {disc}{Colors.RESET}")
+                    return
+                pre_q = find_pregrasp(
+                    station, station_context, q, 0.07, panda_info=panda_info
+                )
             lprint(f"{Colors.REVERSE}Yielding ik for {disc}{Colors.RESET}")
             yield pre_q, q
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", disc, X_WB)],
-                set_others_to_inf=True,
-            )
 
     def find_peg_place(disc, peg):
         if DUMMY_STREAMS:
@@ -360,52 +335,44 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         lprint(
             f"{Colors.BLUE}Starting place stream for {disc} on {peg}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[disc][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
+        object_name, link_name = peg
+        target_object_info = station.object_infos[object_name][0]
         while True:
-            object_name, link_name =peg 
-            target_object_info = station.object_infos[object_name][0]
-            surface = update_surfaces(
-                target_object_info, link_name, station, station_context
-            )[0]
-            yield RigidTransformWrapper(
-                hanoi_streams.find_peg_place(
+            with station_pool.context("move_free") as (station, station_context):
+                surface = update_surfaces(
+                    target_object_info, link_name, station, station_context
+                )[0]
+                X_WB = hanoi_streams.find_peg_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{disc}",
-            ),
+                )
+            yield RigidTransformWrapper(X_WB, name=f"X_W{disc}"),
 
     def find_disc_place(disc, lowerdisc, X_WL):
         if DUMMY_STREAMS:
             while True:
                 yield ("disc_place",)
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", lowerdisc, X_WL)],
-            set_others_to_inf=True,
-        )
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[disc][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
         target_object_info = station.object_infos[lowerdisc][0]
-        surface = update_surfaces(
-            target_object_info, "base_link", station, station_context
-        )[0]
         while True:
-            yield RigidTransformWrapper(
-                hanoi_streams.find_disc_place(
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", lowerdisc, X_WL)],
+                    set_others_to_inf=True,
+                )
+                surface = update_surfaces(
+                    target_object_info, "base_link", station, station_context
+                )[0]
+                X_WB = hanoi_streams.find_disc_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{disc}_on_{lowerdisc}",
-            ),
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", lowerdisc, X_WL)],
-                set_others_to_inf=True,
-            )
+                )
+            yield RigidTransformWrapper(X_WB, name=f"X_W{disc}_on_{lowerdisc}"),
 
     #def check_colfree_block(arm_name, q, disc, X_WB):
         #lprint(
@@ -419,14 +386,14 @@ def construct_problem_from_sim(simulator, stations, problem_info):
             #station, station_context, arm_name, q
         #)
 
-    stream_map = {
+    stream_map = profiling.profile_stream_map({
         "find-traj": from_gen_fn(find_motion),
         "find-ik": from_gen_fn(find_ik),
         "find-grasp": from_gen_fn(find_grasp),
         "find-peg-place": from_gen_fn(find_peg_place),
         "find-disc-place": from_gen_fn(find_disc_place),
         #"check-colfree-disc": from_test(check_colfree_block),
-    }
+    })
 
     return PDDLProblem(domain_pddl, {}, stream_pddl, stream_map, init, goal), model_poses
 
@@ -34,14 +34,27 @@ from pddlstream.utils import str_from_object
 from pddlstream.language.constants import PDDLProblem, print_solution
 from pddlstream.algorithms.meta import solve
 from learning import oracle as ora
+from learning import profiling
 from panda_station import (
     ProblemInfo,
+    StationPool,
     parse_start_poses,
     parse_config,
     update_station,
     PlanToTrajectory,
     TrajectoryDirector,
     find_traj,
+    start_planner_race,
+    start_ik_executor,
+    start_stream_executor,
+    ik_seed,
+    learn_ik_solution,
+    solve_variants,
+    seed_variants,
+    station_object,
+    STATION,
+    STATION_CONTEXT,
+    MotionCache,
     Colors,
     RigidTransformWrapper,
     update_graspable_shapes,
@@ -105,7 +118,7 @@ def retrieve_model_poses(
     return res
 
 
-def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal', planning_objects=None, **oracle_kwargs):
+def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal', planning_objects=None, motion_planner = "lbkpiece1", motion_cache = None, path_simplify = "ompl", prefetch_stations = False, single_plant = False, ik_seeds = 1, stream_executor = None, **oracle_kwargs):
     """
     Construct pddlstream problem from simulator
     """
@@ -114,9 +127,10 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
     main_station = stations["main"]
     simulator_context = simulator.get_context()
     main_station_context = main_station.GetMyContextFromRoot(simulator_context)
-    station_contexts = {}
-    for name in stations:
-        station_contexts[name] = stations[name].CreateDefaultContext()
+    station_pool = StationPool(problem_info, stations, single_plant=single_plant)
+    station_contexts = {name: station_pool.get(name)[1] for name in stations}
+    if prefetch_stations:
+        station_pool.prefetch()
     # start poses of all manipulands
     start_poses = parse_start_poses(main_station, main_station_context)
 
@@ -210,15 +224,6 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         #("in", "raddish5", ("tray", "base_link")),
     ]
     """
-    def get_station(name):
-        if name in stations:
-            return stations[name], station_contexts[name]
-        stations[name] = problem_info.make_holding_station(
-            name=name,
-        )
-        station_contexts[name] = stations[name].CreateDefaultContext()
-        return stations[name], station_contexts[name]
-
     def find_motion(q1, q2, fluents=[]):
         """
         Find a collision free trajectory from initial configuration
@@ -231,16 +236,16 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         while DUMMY_STREAMS:
             yield f"traj_{q1}_{q2}",
         lprint(f"{Colors.BLUE}Starting trajectory stream{Colors.RESET}")
-        station, station_context = get_station("move_free")
+        station_key = ("move_free",)
         # print(f"{Colors.BOLD}FLUENTS FOR MOTION{Colors.RESET}")
         holdingitem = None
         for fluent in fluents:
             # print(fluent[0], fluent[1], fluent[2])
             if fluent[0] == "holding":
                 holdingitem = fluent[1]
-                station, station_context = get_station(fluent[1])
-        update_station(station, station_context, fluents)
+                station_key = (fluent[1],)
         iter = 1
+        plan = find_traj if motion_cache is None else motion_cache.find_traj
         while True:
             if holdingitem:
                 lprint(
@@ -249,14 +254,18 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
             else:
                 lprint(f"{Colors.GREEN}Planning trajectory{Colors.RESET}")
             lprint(f"Try: {iter}")
-            traj = find_traj(
-                station,
-                station_context,
-                q1,
-                q2,
-                ignore_endpoint_collisions=False,
-                verbose=False,
-            )
+            with station_pool.context(*station_key) as (station, station_context):
+                update_station(station, station_context, fluents)
+                traj = plan(
+                    station,
+                    station_context,
+                    q1,
+                    q2,
+                    ignore_endpoint_collisions=False,
+                    verbose=False,
+                    planner=motion_planner,
+                    simplify=path_simplify,
+                )
             if traj is None:  # if a trajectory could not be found (invalid)
                 if holdingitem:
                     lprint(
@@ -273,7 +282,8 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
                 lprint(f"{Colors.GREEN}Yielding trajectory{Colors.RESET}")
             yield traj,
             iter += 1
-            update_station(station, station_context, fluents)
+            # the next trajectory for this query should be a new one
+            plan = find_traj
 
     def find_grasp(item):
         """
@@ -303,23 +313,22 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         lprint(
             f"{Colors.BLUE}Starting place stream for {holdingitem} on region {object_name}, {link_name}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
+        station = station_pool["move_free"]
         target_object_info = station.object_infos[object_name][0]
         holding_object_info = station.object_infos[holdingitem][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
-        surface = update_surfaces(
-            target_object_info, link_name, station, station_context
-        )[0]
         while True:
             lprint(
                 f"{Colors.GREEN}Finding place for {holdingitem} on {object_name}{Colors.RESET}"
             )
-            yield RigidTransformWrapper(
-                kitchen_streamsv2.find_place(
+            with station_pool.context("move_free") as (station, station_context):
+                surface = update_surfaces(
+                    target_object_info, link_name, station, station_context
+                )[0]
+                X_WI = kitchen_streamsv2.find_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{holdingitem}_in_{region}",
-            ),
+                )
+            yield RigidTransformWrapper(X_WI, name=f"X_W{holdingitem}_in_{region}"),
 
     def find_ik(item, X_WI, X_HI):
         """
@@ -329,47 +338,52 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         while DUMMY_STREAMS:
             yield "pre_q", "q"
         lprint(f"{Colors.BLUE}Starting ik stream for {item}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("aspose", item, X_WI)], set_to_inf=planning_objects
-        )
+        station = station_pool["move_free"]
         object_info = station.object_infos[item][0]
         # shape_info = update_graspable_shapes(object_info)[0]
-        q_initial = Q_NOMINAL
+        panda_info = list(station.panda_infos.values())[0]
+        X_WH = X_WI.get_rt().multiply(X_HI.get_rt())
+        q_initial = None
         while True:
             lprint(f"{Colors.GREEN}Finding ik for {item}{Colors.RESET}")
-            q, cost = kitchen_streamsv2.find_ik_with_relaxed(
-                station,
-                station_context,
-                object_info,
-                X_HI.get_rt(),
-                q_initial=q_initial,
-            )
-            if not np.isfinite(cost):
-                return
-            pre_q = find_pregrasp(station, station_context, q, 0.07)
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station, station_context, [("aspose", item, X_WI)], set_to_inf=planning_objects
+                )
+                if q_initial is None:
+                    q_initial = ik_seed(station, station_context, panda_info, X_WH, Q_NOMINAL)
+                q, cost = solve_variants(
+                    station,
+                    station_context,
+                    kitchen_streamsv2.find_ik_with_relaxed,
+                    seed_variants(
+                        station,
+                        (STATION, STATION_CONTEXT, station_object(object_info), X_HI.get_rt()),
+                        {},
+                        q_initial,
+                        ik_seeds,
+                    ),
+                )
+                if not np.isfinite(cost):
+                    return
+                learn_ik_solution(station, station_context, panda_info, q)
+                pre_q = find_pregrasp(station, station_context, q, 0.07)
             yield pre_q, q
-            update_station(
-                station,
-                station_context,
-                [("atpose", item, X_WI)],
-                set_to_inf=planning_objects,
-            )
 
     def check_safe(q, item, X_WI):
         if DUMMY_STREAMS:
             return True
         lprint(f"{Colors.BLUE}Checking for collisions with {item}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("atpose", item, X_WI)], set_to_inf=planning_objects
-        )
-        res = kitchen_streamsv2.check_safe_conf(station, station_context, q)
-        if res:
-            lprint(f"{Colors.GREEN}No collisions with {item}{Colors.RESET}")
-        else:
-            lprint(f"{Colors.RED}Found collisions with {item}{Colors.RESET}")
-        return res
+        with station_pool.context("move_free") as (station, station_context):
+            update_station(
+                station, station_context, [("atpose", item, X_WI)], set_to_inf=planning_objects
+            )
+            res = kitchen_streamsv2.check_safe_conf(station, station_context, q)
+            if res:
+                lprint(f"{Colors.GREEN}No collisions with {item}{Colors.RESET}")
+            else:
+                lprint(f"{Colors.RED}Found collisions with {item}{Colors.RESET}")
+            return res
 
     # def dist_fn(traj):
     #    res = 0
@@ -385,11 +399,30 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         "check-safe": from_test(check_safe),
         # "distance": dist_fn,
     }
+    if stream_executor is not None:
+        # evaluate the generator streams' instances in the executor's worker
+        # processes (the test stays here, see StreamExecutor.wrap_stream_map)
+        stream_map = stream_executor.wrap_stream_map(
+            stream_map,
+            names=["find-traj", "find-grasp", "find-place", "find-ik"],
+            planning_objects=planning_objects,
+        )
+    stream_map = profiling.profile_stream_map(stream_map)
     pddl_problem = PDDLProblem(domain_pddl, {}, stream_pddl, stream_map, init, goal)
 
     return pddl_problem, model_poses
 
 
+def make_stream_map(problem_file, **kwargs):
+    """
+    Build the stream map for problem_file from scratch, as the workers
+    of a StreamExecutor do. kwargs are passed to construct_problem_from_sim
+    """
+    sim, station_dict, _, _, prob_info = make_and_init_simulation(None, problem_file)
+    problem, _ = construct_problem_from_sim(sim, station_dict, prob_info, **kwargs)
+    return problem.stream_map
+
+
 def make_and_init_simulation(zmq_url, prob):
     """
     Make the simulation, and let it run for 0.2 s to let all the objects
@@ -562,7 +595,16 @@ def run_kitchen(
     oracle_kwargs = {},
     should_save = False,
     path = None,
-    max_planner_time = 10
+    max_planner_time = 10,
+    motion_planner = "lbkpiece1",
+    motion_cache = False,
+    motion_cache_path = None,
+    path_simplify = "ompl",
+    prefetch_stations = False,
+    single_plant = False,
+    ik_workers = 0,
+    ik_seeds = 1,
+    stream_workers = 0,
 ):
 
     time = datetime.today().strftime("%Y-%m-%d-%H:%M:%S")
@@ -591,7 +633,30 @@ def run_kitchen(
     sim, station_dict, traj_director, meshcat_vis, prob_info = make_and_init_simulation(
         url, problem_file
     )
-    problem, model_poses = construct_problem_from_sim(sim, station_dict, prob_info, algorithm = algorithm, mode = mode)
+    if motion_planner == "race":
+        start_planner_race(problem_file)
+    if ik_workers:
+        start_ik_executor(problem_file, processes=ik_workers)
+    stream_executor = None
+    if stream_workers:
+        # the workers plan with a single planner, rather than racing them
+        stream_executor = start_stream_executor(
+            "experiments.kitchen.run:make_stream_map", problem_file, processes = stream_workers,
+            algorithm = algorithm, mode = mode,
+            motion_planner = "lbkpiece1" if motion_planner == "race" else motion_planner,
+            path_simplify = path_simplify, single_plant = single_plant, ik_seeds = ik_seeds
+        )
+    motion_cache = (
+        MotionCache(path=motion_cache_path, problem_file=problem_file)
+        if motion_cache or motion_cache_path
+        else None
+    )
+    problem, model_poses = construct_problem_from_sim(
+        sim, station_dict, prob_info, algorithm = algorithm, mode = mode,
+        motion_planner = motion_planner, motion_cache = motion_cache, path_simplify = path_simplify,
+        prefetch_stations = prefetch_stations, single_plant = single_plant,
+        ik_seeds = ik_seeds, stream_executor = stream_executor
+    )
     oracle = construct_oracle(mode, problem, prob_info, model_poses, **oracle_kwargs)
 
     print("Initial:", str_from_object(problem.init))
@@ -615,6 +680,9 @@ def run_kitchen(
         max_planner_time = max_planner_time,
         problem_file_path = problem_file
     )
+    if motion_cache is not None:
+        for name, value in motion_cache.close().items():
+            profiling.count(f"motion_cache.{name}", value)
 
     print(f"\n\n{algorithm} solution:")
     print_solution(solution)
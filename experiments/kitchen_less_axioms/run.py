@@ -31,8 +31,10 @@ from pddlstream.utils import str_from_object
 from pddlstream.language.constants import PDDLProblem, print_solution
 from pddlstream.algorithms.meta import solve
 from learning import oracle as ora
+from learning import profiling
 from panda_station import (
     ProblemInfo,
+    StationPool,
     parse_start_poses,
     parse_config,
     update_station,
@@ -111,9 +113,8 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
     main_station = stations["main"]
     simulator_context = simulator.get_context()
     main_station_context = main_station.GetMyContextFromRoot(simulator_context)
-    station_contexts = {}
-    for name in stations:
-        station_contexts[name] = stations[name].CreateDefaultContext()
+    station_pool = StationPool(problem_info, stations)
+    station_contexts = {name: station_pool.get(name)[1] for name in stations}
     # start poses of all manipulands
     start_poses = parse_start_poses(main_station, main_station_context)
 
@@ -204,15 +205,6 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         #("in", "raddish5", ("tray", "base_link")),
     ]
     """
-    def get_station(name):
-        if name in stations:
-            return stations[name], station_contexts[name]
-        stations[name] = problem_info.make_holding_station(
-            name=name,
-        )
-        station_contexts[name] = stations[name].CreateDefaultContext()
-        return stations[name], station_contexts[name]
-
     def find_motion(q1, q2, fluents=[]):
         """
         Find a collision free trajectory from initial configuration
@@ -225,15 +217,14 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         while DUMMY_STREAMS:
             yield f"traj_{q1}_{q2}",
         lprint(f"{Colors.BLUE}Starting trajectory stream{Colors.RESET}")
-        station, station_context = get_station("move_free")
+        station_key = ("move_free",)
         # print(f"{Colors.BOLD}FLUENTS FOR MOTION{Colors.RESET}")
         holdingitem = None
         for fluent in fluents:
             # print(fluent[0], fluent[1], fluent[2])
             if fluent[0] == "holding":
                 holdingitem = fluent[1]
-                station, station_context = get_station(fluent[1])
-        update_station(station, station_context, fluents)
+                station_key = (fluent[1],)
         iter = 1
         while True:
             if holdingitem:
@@ -243,14 +234,16 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
             else:
                 lprint(f"{Colors.GREEN}Planning trajectory{Colors.RESET}")
             lprint(f"Try: {iter}")
-            traj = find_traj(
-                station,
-                station_context,
-                q1,
-                q2,
-                ignore_endpoint_collisions=False,
-                verbose=False,
-            )
+            with station_pool.context(*station_key) as (station, station_context):
+                update_station(station, station_context, fluents)
+                traj = find_traj(
+                    station,
+                    station_context,
+                    q1,
+                    q2,
+                    ignore_endpoint_collisions=False,
+                    verbose=False,
+                )
             if traj is None:  # if a trajectory could not be found (invalid)
                 if holdingitem:
                     lprint(
@@ -267,7 +260,6 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
                 lprint(f"{Colors.GREEN}Yielding trajectory{Colors.RESET}")
             yield traj,
             iter += 1
-            update_station(station, station_context, fluents)
 
     def find_grasp(item):
         """
@@ -297,23 +289,22 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         lprint(
             f"{Colors.BLUE}Starting place stream for {holdingitem} on region {object_name}, {link_name}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
+        station = station_pool["move_free"]
         target_object_info = station.object_infos[object_name][0]
         holding_object_info = station.object_infos[holdingitem][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
-        surface = update_surfaces(
-            target_object_info, link_name, station, station_context
-        )[0]
         while True:
             lprint(
                 f"{Colors.GREEN}Finding place for {holdingitem} on {object_name}{Colors.RESET}"
             )
-            yield RigidTransformWrapper(
-                kitchen_streamsv2.find_place(
+            with station_pool.context("move_free") as (station, station_context):
+                surface = update_surfaces(
+                    target_object_info, link_name, station, station_context
+                )[0]
+                X_WI = kitchen_streamsv2.find_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{holdingitem}_in_{region}",
-            ),
+                )
+            yield RigidTransformWrapper(X_WI, name=f"X_W{holdingitem}_in_{region}"),
 
     def find_ik(item, X_WI, X_HI):
         """
@@ -323,47 +314,42 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
         while DUMMY_STREAMS:
             yield "pre_q", "q"
         lprint(f"{Colors.BLUE}Starting ik stream for {item}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("aspose", item, X_WI)], set_others_to_inf=True
-        )
+        station = station_pool["move_free"]
         object_info = station.object_infos[item][0]
         # shape_info = update_graspable_shapes(object_info)[0]
         q_initial = Q_NOMINAL
         while True:
             lprint(f"{Colors.GREEN}Finding ik for {item}{Colors.RESET}")
-            q, cost = kitchen_streamsv2.find_ik_with_relaxed(
-                station,
-                station_context,
-                object_info,
-                X_HI.get_rt(),
-                q_initial=q_initial,
-            )
-            if not np.isfinite(cost):
-                return
-            pre_q = find_pregrasp(station, station_context, q, 0.07)
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station, station_context, [("aspose", item, X_WI)], set_others_to_inf=True
+                )
+                q, cost = kitchen_streamsv2.find_ik_with_relaxed(
+                    station,
+                    station_context,
+                    object_info,
+                    X_HI.get_rt(),
+                    q_initial=q_initial,
+                )
+                if not np.isfinite(cost):
+                    return
+                pre_q = find_pregrasp(station, station_context, q, 0.07)
             yield pre_q, q
-            update_station(
-                station,
-                station_context,
-                [("atpose", item, X_WI)],
-                set_others_to_inf=True,
-            )
 
     def check_safe(q, item, X_WI):
         if DUMMY_STREAMS:
             return True
         lprint(f"{Colors.BLUE}Checking for collisions with {item}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("atpose", item, X_WI)], set_others_to_inf=True
-        )
-        res = kitchen_streamsv2.check_safe_conf(station, station_context, q)
-        if res:
-            lprint(f"{Colors.GREEN}No collisions with {item}{Colors.RESET}")
-        else:
-            lprint(f"{Colors.RED}Found collisions with {item}{Colors.RESET}")
-        return res
+        with station_pool.context("move_free") as (station, station_context):
+            update_station(
+                station, station_context, [("atpose", item, X_WI)], set_others_to_inf=True
+            )
+            res = kitchen_streamsv2.check_safe_conf(station, station_context, q)
+            if res:
+                lprint(f"{Colors.GREEN}No collisions with {item}{Colors.RESET}")
+            else:
+                lprint(f"{Colors.RED}Found collisions with {item}{Colors.RESET}")
+            return res
 
     # def dist_fn(traj):
     #    res = 0
@@ -371,14 +357,14 @@ def construct_problem_from_sim(simulator, stations, problem_info, mode = 'normal
     #        res += np.dot(traj[i], traj[i+1])
     #    return 1+res
 
-    stream_map = {
+    stream_map = profiling.profile_stream_map({
         "find-traj": from_gen_fn(find_motion),
         "find-grasp": from_gen_fn(find_grasp),
         "find-place": from_gen_fn(find_place),
         "find-ik": from_gen_fn(find_ik),
         "check-safe": from_test(check_safe),
         # "distance": dist_fn,
-    }
+    })
     pddl_problem = PDDLProblem(domain_pddl, {}, stream_pddl, stream_map, init, goal)
 
     return pddl_problem, model_poses
@@ -4,6 +4,7 @@ from experiments.kitchen.run import run_kitchen, run_ploi as run_kitchen_ploi
 from experiments.kitchen_less_axioms.run import run_kitchen_less_axioms
 from experiments.hanoi.run import run_hanoi
 from experiments.basement_blocks_world.run import run_basement_blocks_world
+from learning import profiling
 import argparse
 import json
 import os
@@ -138,6 +139,13 @@ def make_argument_parser():
         required=False,
         help = "A path to (optionally) save a .profile file to (from CProfile)"
     )
+    parser.add_argument(
+        '--trace',
+        type=str,
+        default=None,
+        required=False,
+        help = "A path to (optionally) save a Chrome trace (.json) of the profiled stages to"
+    )
     parser.add_argument(
         '--url',
         type=str, required=False,
@@ -173,12 +181,16 @@ if __name__ == '__main__':
     if args.problem_file:
         domain_options['problem_file'] = args.problem_file
     if args.logpath:
+        # the runners append file names to the path (path + "stats.json")
+        args.logpath = os.path.join(args.logpath, "")
         if not os.path.isdir(args.logpath):
             os.mkdir(args.logpath)
     if args.profile:
         import cProfile, pstats, io
         pr = cProfile.Profile()
         pr.enable() 
+    if args.trace:
+        profiling.PROFILER.enable_trace()
 
     file = os.path.join(args.logpath, "run-params.txt")
     with open(file, "w") as f:
@@ -218,6 +230,9 @@ if __name__ == '__main__':
             max_planner_time = args.max_planner_time,
             **domain_options
         )
+    profiling.PROFILER.add_to_stats(os.path.join(args.logpath, "stats.json"))
+    if args.trace:
+        profiling.PROFILER.save_trace(args.trace)
     if args.profile:
         pr.disable()
         s = io.StringIO()
@@ -3,12 +3,12 @@ This module contains functions that assist with grasping and placing
 in the kitchen environment
 """
 from panda_station.grasping_and_placing import DROP_HEIGHT
+from panda_station.ik_templates import ik_program
 import random
 import numpy as np
 from numpy import random
 from pydrake.all import (
     Solve,
-    InverseKinematics,
     Box,
     Cylinder,
     Sphere,
@@ -166,9 +166,8 @@ def find_ik_with_handpose(
     H = plant.GetFrameByName(HAND_FRAME_NAME, panda_info.hand)  # hand frame
     G = object_info.get_frame() #shape_info.offset_frame  # geometry frasinkme
     W = plant.world_frame()
-    ik = InverseKinematics(plant, plant_context)
-    if not relax:
-        ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+    min_distance = None if relax else (COL_MARGIN, CONSIDER_MARGIN)
+    ik = ik_program(plant, plant_context, q_nominal, min_distance=min_distance)
     lower = X_HI.translation() - np.array([0.001, 0.001, 0.01])
     upper = X_HI.translation() + np.array([0.001, 0.001, 0.01])
     ik.AddPositionConstraint(
@@ -188,7 +187,6 @@ def find_ik_with_handpose(
     )
     prog = ik.prog()
     q = ik.q()
-    prog.AddQuadraticErrorCost(np.identity(len(q)), q_nominal, q)
     prog.SetInitialGuess(q, q_initial)
     result = Solve(prog)
     #print(result.GetInfeasibleConstraintNames(prog))
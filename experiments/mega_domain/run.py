@@ -33,9 +33,11 @@ from pddlstream.algorithms.meta import solve
 from pddlstream.algorithms.algorithm import reset_globals
 from learning import visualization
 from learning import oracle as ora
+from learning import profiling
 from panda_station import (
     rt_to_xyzrpy,
     ProblemInfo,
+    StationPool,
     parse_start_poses,
     parse_config,
     update_station,
@@ -114,9 +116,8 @@ def construct_problem_from_sim(simulator, stations, problem_info):
     main_station = stations["main"]
     simulator_context = simulator.get_context()
     main_station_context = main_station.GetMyContextFromRoot(simulator_context)
-    station_contexts = {}
-    for name in stations:
-        station_contexts[name] = stations[name].CreateDefaultContext()
+    station_pool = StationPool(problem_info, stations)
+    station_contexts = {name: station_pool.get(name)[1] for name in stations}
     start_poses = parse_start_poses(main_station, main_station_context)
 
     # this needs to be done first so all of the RTs are updated
@@ -210,27 +211,9 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         }
     )
 
-    def get_station(name, arm_name=None):
-        if arm_name is None:
-            return stations[name], station_contexts[name]  # ie. move_free
-
-        if arm_name not in stations:
-            stations[arm_name] = {}
-            station_contexts[arm_name] = {}
-        if name in stations[arm_name]:
-            return stations[arm_name][name], station_contexts[arm_name][name]
-
-        stations[arm_name][name] = problem_info.make_holding_station(
-            name, arm_name=arm_name
-        )
-        station_contexts[arm_name][name] = stations[arm_name][
-            name
-        ].CreateDefaultContext()
-        return stations[arm_name][name], station_contexts[arm_name][name]
-
     def find_motion(arm_name, q1, q2, fluents=[]):
         lprint(f"{Colors.BLUE}Starting trajectory stream{Colors.RESET}")
-        station, station_context = get_station("move_free")
+        station_key = ("move_free",)
         holding_block = None
         other_name = None
         q_other = None
@@ -247,30 +230,27 @@ def construct_problem_from_sim(simulator, stations, problem_info):
                 continue
             if fluent[0] == "athandpose":
                 holding_block = fluent[2]
-                station, station_context = get_station(holding_block, arm_name=arm_name)
+                station_key = (holding_block, arm_name)
                 fluents[i] = ("athandpose", holding_block, fluent[3])
             i += 1
 
-        update_station(station, station_context, fluents)
-        if other_name is not None:
-            update_arm(station, station_context, other_name, q_other)
-        panda = station.panda_infos[arm_name].panda
         while True:
-            traj = find_traj(
-                station,
-                station_context,
-                q1,
-                q2,
-                ignore_endpoint_collisions=False,
-                panda=panda,
-                verbose=VERBOSE,
-            )
+            with station_pool.context(*station_key) as (station, station_context):
+                update_station(station, station_context, fluents)
+                if other_name is not None:
+                    update_arm(station, station_context, other_name, q_other)
+                traj = find_traj(
+                    station,
+                    station_context,
+                    q1,
+                    q2,
+                    ignore_endpoint_collisions=False,
+                    panda=station.panda_infos[arm_name].panda,
+                    verbose=VERBOSE,
+                )
             if traj is None:
                 return
             yield traj,
-            update_station(station, station_context, fluents)
-            if other_name is not None:
-                update_arm(station, station_context, other_name, q_other)
 
     def find_grasp(item):
         lprint(f"{Colors.BLUE}Starting grasp stream for {item}{Colors.RESET}")
@@ -285,13 +265,7 @@ def construct_problem_from_sim(simulator, stations, problem_info):
 
     def find_ik(arm_name, item, X_WB, X_HB):
         lprint(f"{Colors.BLUE}Starting ik stream for {item} at {X_WB}{Colors.RESET}")
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", item, X_WB)],
-            set_others_to_inf=True,
-        )
+        station = station_pool["move_free"]
         object_info = station.object_infos[item][0]
         panda_info = station.panda_infos[arm_name]
         p_WB = X_WB.get_rt().translation()
@@ -302,68 +276,69 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         q_initial = Q_NOMINAL[:]
         q_initial[0] = q0
         while True:
-            lprint(f"{Colors.GREEN}Finding ik for {item}{Colors.RESET}")
-            q, cost = mega_streams.find_ik_with_relaxed(
-                station,
-                station_context,
-                object_info,
-                X_HB.get_rt(),
-                panda_info,
-                q_initial=q_initial,
-            )
-            if not np.isfinite(cost):
-                lprint(f"{Colors.RED}Failed ik for {item}{Colors.RESET}")
-                return
-            pre_q = find_pregrasp(
-                station, station_context, q, 0.07, panda_info=panda_info
-            )
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", item, X_WB)],
+                    set_others_to_inf=True,
+                )
+                lprint(f"{Colors.GREEN}Finding ik for {item}{Colors.RESET}")
+                q, cost = mega_streams.find_ik_with_relaxed(
+                    station,
+                    station_context,
+                    object_info,
+                    X_HB.get_rt(),
+                    panda_info,
+                    q_initial=q_initial,
+                )
+                if not np.isfinite(cost):
+                    lprint(f"{Colors.RED}Failed ik for {item}{Colors.RESET}")
+                    return
+                pre_q = find_pregrasp(
+                    station, station_context, q, 0.07, panda_info=panda_info
+                )
             lprint(f"{Colors.REVERSE}Yielding ik for {item}{Colors.RESET}")
             yield pre_q, q
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", item, X_WB)],
-                set_others_to_inf=True,
-            )
 
     def find_region_place(item, region):
         lprint(
             f"{Colors.BLUE}Starting place stream for {item} on {region}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[item][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
+        object_name, link_name = region
+        target_object_info = station.object_infos[object_name][0]
         while True:
-            object_name, link_name =region 
-            target_object_info = station.object_infos[object_name][0]
-            surface = update_surfaces(
-                target_object_info, link_name, station, station_context
-            )[0]
-            yield RigidTransformWrapper(
-                mega_streams.find_table_place(
+            with station_pool.context("move_free") as (station, station_context):
+                surface = update_surfaces(
+                    target_object_info, link_name, station, station_context
+                )[0]
+                X_WB = mega_streams.find_table_place(
                     station, station_context, shape_info, surface
-                ),
-                name=f"X_W{item}",
-            ),
+                )
+            yield RigidTransformWrapper(X_WB, name=f"X_W{item}"),
 
     def find_item_place(item, loweritem, X_WL):
-        station, station_context = get_station("move_free")
-        update_station(
-            station,
-            station_context,
-            [("atworldpose", loweritem, X_WL)],
-            set_others_to_inf=True,
-        )
+        station = station_pool["move_free"]
         holding_object_info = station.object_infos[item][0]
         shape_info = update_placeable_shapes(holding_object_info)[0]
         target_object_info = station.object_infos[loweritem][0]
-        surface = update_surfaces(
-            target_object_info, "base_link", station, station_context
-        )[0]
         while True:
-            res = mega_streams.find_block_place(
-                    station, station_context, shape_info, surface
+            with station_pool.context("move_free") as (station, station_context):
+                update_station(
+                    station,
+                    station_context,
+                    [("atworldpose", loweritem, X_WL)],
+                    set_others_to_inf=True,
                 )
+                surface = update_surfaces(
+                    target_object_info, "base_link", station, station_context
+                )[0]
+                res = mega_streams.find_block_place(
+                        station, station_context, shape_info, surface
+                    )
             if res is None:
                 return
             res = RigidTransformWrapper(
@@ -371,40 +346,34 @@ def construct_problem_from_sim(simulator, stations, problem_info):
                 name=f"X_W{item}_on_{loweritem}",
             )
             yield (res,)
-            update_station(
-                station,
-                station_context,
-                [("atworldpose", loweritem, X_WL)],
-                set_others_to_inf=True,
-            )
 
     def check_colfree_empty(arm_name, q, item, X_WB):
         lprint(
             f"{Colors.BLUE}Checking for collisions between {arm_name} and {item}{Colors.RESET}"
         )
-        station, station_context = get_station("move_free")
-        update_station(
-            station, station_context, [("atpose", item, X_WB)], set_others_to_inf=True
-        )
-        res =  mega_streams.check_colfree_block(
-            station, station_context, arm_name, q
-        )
-        return res
+        with station_pool.context("move_free") as (station, station_context):
+            update_station(
+                station, station_context, [("atpose", item, X_WB)], set_others_to_inf=True
+            )
+            res =  mega_streams.check_colfree_block(
+                station, station_context, arm_name, q
+            )
+            return res
 
     def check_colfree_holding(arm_name, q, item, X_WB):
         lprint(
             f"{Colors.BLUE}Checking for collisions between {arm_name} and {item}{Colors.RESET}"
         )
-        station, station_context = get_station("blocked")
-        update_station(
-            station, station_context, [("atpose", item, X_WB)], set_others_to_inf=True
-        )
-        res =  mega_streams.check_colfree_block(
-            station, station_context, arm_name, q
-        )
-        return res
+        with station_pool.context("blocked") as (station, station_context):
+            update_station(
+                station, station_context, [("atpose", item, X_WB)], set_others_to_inf=True
+            )
+            res =  mega_streams.check_colfree_block(
+                station, station_context, arm_name, q
+            )
+            return res
 
-    stream_map = {
+    stream_map = profiling.profile_stream_map({
         "find-traj": from_gen_fn(find_motion),
         "find-ik": from_gen_fn(find_ik),
         "find-grasp": from_gen_fn(find_grasp),
@@ -412,7 +381,7 @@ def construct_problem_from_sim(simulator, stations, problem_info):
         "find-item-place": from_gen_fn(find_item_place),
         "check-colfree-empty": from_test(check_colfree_empty),
         "check-colfree-holding": from_test(check_colfree_holding),
-    }
+    })
 
     return (
         PDDLProblem(domain_pddl, {}, stream_pddl, stream_map, init, goal),
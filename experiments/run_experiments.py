@@ -0,0 +1,331 @@
+"""
+Run experiments/main.py on every problem in a directory, for each
+(domain, mode), in a bounded pool of worker processes.
+
+Each job runs in its own process (so a crash or memory blowup only takes
+down that job) with a wall clock and memory (RSS) limit. Jobs whose
+stats.json already exists are skipped (like run.sh), and the outcome of
+every job is appended to jobs.jsonl as it finishes, so an interrupted
+sweep can be restarted with the same command. When all jobs are done, a
+table of the results is written to results.csv.
+
+Example:
+    python experiments/run_experiments.py ~/exps/blocks problems/ \
+        --domain blocks_world --mode normal oracle --timeout 130 -- --max_planner_time 30
+"""
+import argparse
+import csv
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from glob import glob
+
+import psutil
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+SUMMARY_KEYS = ["solved", "run_time", "search_time", "sample_time", "iterations", "evaluations"]
+
+
+class Job:
+    """
+    One run of main.py: a problem file in a domain and mode
+    """
+
+    def __init__(self, problem_file, domain, mode, directory):
+        self.problem_file = problem_file
+        self.domain = domain
+        self.mode = mode
+        self.run = os.path.basename(problem_file)
+        # laid out like run.sh: <directory>/<run>.log and <directory>/<run>_logs/
+        self.log_file = os.path.join(directory, f"{self.run}.log")
+        # with a trailing separator, since the runners append file names to --logpath
+        self.log_dir = os.path.join(directory, f"{self.run}_logs", "")
+
+    @property
+    def key(self):
+        return f"{self.domain}/{self.mode}/{self.run}"
+
+    @property
+    def stats_file(self):
+        return os.path.join(self.log_dir, "stats.json")
+
+    def command(self, main_args):
+        command = [sys.executable, "-O", MAIN]
+        if self.domain is not None:
+            command.append(f"--domain={self.domain}")
+        if self.mode is not None:
+            command.append(f"--mode={self.mode}")
+        return command + ["--logpath", self.log_dir, "--problem-file", self.problem_file] + main_args
+
+
+def make_jobs(exp_dir, problem_files, domains, modes):
+    """
+    Returns a Job for each (domain, mode, problem). Results go in
+    exp_dir, in a subdirectory per domain and per mode when there is
+    more than one of them
+    """
+    jobs = []
+    for domain in domains:
+        for mode in modes:
+            directory = exp_dir
+            if len(domains) > 1:
+                directory = os.path.join(directory, domain)
+            if len(modes) > 1:
+                directory = os.path.join(directory, mode)
+            jobs += [Job(problem_file, domain, mode, directory) for problem_file in problem_files]
+    return jobs
+
+
+def tree_rss(process):
+    """
+    Returns the resident memory (bytes) of process and its children
+    """
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    rss = 0
+    for p in processes:
+        try:
+            rss += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+def kill_tree(process, sig):
+    try:
+        processes = process.children(recursive=True) + [process]
+    except psutil.NoSuchProcess:
+        return
+    for p in processes:
+        try:
+            p.send_signal(sig)
+        except psutil.NoSuchProcess:
+            pass
+
+
+def run_job(job, main_args, timeout, max_rss, grace=30.0, poll=1.0):
+    """
+    Run job, interrupting it (like `timeout --signal 2`) once it runs for
+    longer than timeout (s), and killing it if it uses more than max_rss
+    bytes or does not stop within grace (s) of the interrupt.
+    Returns a record of the outcome
+    """
+    os.makedirs(job.log_dir, exist_ok=True)
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="")
+    # the jobs run side by side, so each gets one thread for numerical libraries
+    env.setdefault("OMP_NUM_THREADS", "1")
+    start = time.time()
+    status = "finished"
+    peak_rss = 0
+    interrupted = None
+    with open(job.log_file, "w") as log:
+        popen = subprocess.Popen(
+            job.command(main_args), cwd=job.log_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        process = psutil.Process(popen.pid)
+        while popen.poll() is None:
+            time.sleep(poll)
+            rss = tree_rss(process)
+            peak_rss = max(peak_rss, rss)
+            elapsed = time.time() - start
+            if max_rss is not None and rss > max_rss:
+                status = "memory"
+                kill_tree(process, signal.SIGKILL)
+            elif interrupted is None and timeout is not None and elapsed > timeout:
+                status = "timeout"
+                interrupted = time.time()
+                kill_tree(process, signal.SIGINT)
+            elif interrupted is not None and time.time() - interrupted > grace:
+                kill_tree(process, signal.SIGKILL)
+        popen.wait()
+    if status == "finished" and popen.returncode != 0:
+        status = "failed"
+    return {
+        "key": job.key,
+        "domain": job.domain,
+        "mode": job.mode,
+        "problem_file": job.problem_file,
+        "status": status,
+        "returncode": popen.returncode,
+        "wall_time": time.time() - start,
+        "peak_rss_mb": peak_rss / 2 ** 20,
+        "has_stats": os.path.isfile(job.stats_file),
+    }
+
+
+def load_journal(path):
+    """
+    Returns {job key: record} of the jobs in the journal at path
+    (the last record of each job wins)
+    """
+    records = {}
+    if os.path.isfile(path):
+        with open(path, "r") as stream:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    records[record["key"]] = record
+    return records
+
+
+def default_workers(max_rss):
+    """
+    As many workers as there are cpus, or as fit in the available memory
+    """
+    workers = os.cpu_count()
+    if max_rss is not None:
+        workers = min(workers, int(psutil.virtual_memory().available // max_rss))
+    return max(workers, 1)
+
+
+def job_summary(job, record):
+    row = {
+        "domain": job.domain,
+        "mode": job.mode,
+        "run": job.run,
+        "status": record.get("status") if record else None,
+        "wall_time": record.get("wall_time") if record else None,
+        "peak_rss_mb": record.get("peak_rss_mb") if record else None,
+    }
+    if os.path.isfile(job.stats_file):
+        with open(job.stats_file, "r") as stream:
+            summary = json.load(stream).get("summary", {})
+        if row["status"] is None:
+            row["status"] = "finished"
+        for key in SUMMARY_KEYS:
+            row[key] = summary.get(key)
+    return row
+
+
+def write_results(path, jobs, records):
+    rows = [job_summary(job, records.get(job.key)) for job in jobs]
+    fields = ["domain", "mode", "run", "status", "wall_time", "peak_rss_mb"] + SUMMARY_KEYS
+    with open(path, "w", newline="") as stream:
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def run_experiments(
+    exp_dir,
+    problem_files,
+    domains=(None,),
+    modes=(None,),
+    main_args=(),
+    workers=None,
+    timeout=None,
+    max_rss_gb=None,
+    skip_failed=False,
+):
+    """
+    Run main.py on each problem file in each domain and mode
+    (None uses main.py's default), skipping the jobs that have a stats.json
+    (and, if skip_failed, the jobs that failed before).
+    Returns the rows of the results table
+    """
+    exp_dir = os.path.abspath(exp_dir)
+    os.makedirs(exp_dir, exist_ok=True)
+    journal_path = os.path.join(exp_dir, "jobs.jsonl")
+    records = load_journal(journal_path)
+    max_rss = None if max_rss_gb is None else max_rss_gb * 2 ** 30
+    if workers is None:
+        workers = default_workers(max_rss)
+
+    jobs = make_jobs(exp_dir, [os.path.abspath(f) for f in problem_files], list(domains), list(modes))
+    todo = []
+    for job in jobs:
+        if os.path.isfile(job.stats_file):
+            print(f"{job.key} exists")
+            continue
+        if skip_failed and records.get(job.key, {}).get("status") in ("timeout", "memory", "failed"):
+            print(f"{job.key} {records[job.key]['status']} before, skipping")
+            continue
+        todo.append(job)
+    print(f"Running {len(todo)} of {len(jobs)} jobs with {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(journal_path, "a") as journal:
+        futures = {
+            executor.submit(run_job, job, list(main_args), timeout, max_rss): job for job in todo
+        }
+        for i, future in enumerate(as_completed(futures)):
+            record = future.result()
+            records[record["key"]] = record
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            print(
+                f"[{i + 1}/{len(todo)}] {record['key']}: {record['status']} "
+                f"in {record['wall_time']:.1f} s, {record['peak_rss_mb']:.0f} MB"
+            )
+
+    rows = write_results(os.path.join(exp_dir, "results.csv"), jobs, records)
+    solved = sum(1 for row in rows if row.get("solved"))
+    print(f"Solved {solved} of {len(rows)}, results in {os.path.join(exp_dir, 'results.csv')}")
+    return rows
+
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Run experiments/main.py on a directory of problems in parallel. "
+        "Arguments after -- are passed to main.py"
+    )
+    parser.add_argument("exp_dir", type=str, help="The directory to save the logs and results in")
+    parser.add_argument(
+        "problems", type=str, help="A directory of .yaml problem files (or a glob pattern)"
+    )
+    parser.add_argument(
+        "--domain", type=str, nargs="+", default=[None], help="The domain(s) to run the problems in"
+    )
+    parser.add_argument(
+        "--mode", type=str, nargs="+", default=[None], help="The mode(s) to run the problems in"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of jobs run at once (defaults to the number of cpus, "
+        "or the number of jobs that fit in memory with --max-rss-gb)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="Wall clock limit (s) of each job"
+    )
+    parser.add_argument(
+        "--max-rss-gb", type=float, default=None, help="Memory limit (GB) of each job"
+    )
+    parser.add_argument(
+        "--skip-failed",
+        action="store_true",
+        help="Don't rerun the jobs that timed out, ran out of memory or crashed before",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    main_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, main_args = argv[:split], argv[split + 1 :]
+    args = make_argument_parser().parse_args(argv)
+    if os.path.isdir(args.problems):
+        problem_files = sorted(glob(os.path.join(args.problems, "*.yaml")))
+    else:
+        problem_files = sorted(glob(args.problems))
+    run_experiments(
+        args.exp_dir,
+        problem_files,
+        domains=args.domain,
+        modes=args.mode,
+        main_args=main_args,
+        workers=args.workers,
+        timeout=args.timeout,
+        max_rss_gb=args.max_rss_gb,
+        skip_failed=args.skip_failed,
+    )
@@ -1,3 +1,14 @@
-from . import oracle
-from . import visualization
-from . import poisson_disc_sampling
+"""
+The submodules are imported on first use (eg. learning.oracle), so that
+the parts of the package that don't need torch, like pddlstream_utils,
+can be imported without it
+"""
+import importlib
+
+SUBMODULES = ("oracle", "visualization", "poisson_disc_sampling")
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
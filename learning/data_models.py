@@ -1,14 +1,17 @@
 from collections import namedtuple
 
-from numpy.lib.arraysetops import isin
 from learning.pddlstream_utils import make_atom_map, make_stream_map, fact_to_pddl, obj_to_pddl
 from dataclasses import dataclass
-from torch_geometric.data import Data
+from typing import TYPE_CHECKING
 from pddlstream.algorithms.downward import Domain
 import numpy as np
 
 from pddlstream.language.constants import Evaluation
 
+if TYPE_CHECKING:
+    # only for annotations, so that this module can be used without torch
+    from torch_geometric.data import Data
+
 @dataclass
 class ModelInfo:
     """This class is intended to keep all the information that should remain constant for a single model"""
@@ -105,7 +108,7 @@ class ProblemInfo:
     goal_facts: list
     initial_facts: list
     model_poses: list
-    problem_graph: Data = None
+    problem_graph: "Data" = None
     object_mapping: dict = None
 
     def __eq__(self, other):
@@ -25,6 +25,7 @@ from learning.data_models import (
     ProblemInfo,
     StreamInstanceClassifierInfo,
 )
+from learning.profiling import timed
 from learning.pddlstream_utils import dep_elders, get_siblings_from_map, make_sibling_map, objects_from_facts, ancestors, siblings, elders, objects_from_fact
 from torch_geometric.data import Data
 from tqdm import tqdm
@@ -74,6 +75,7 @@ def get_stream_schedule(invocation, roots):
     stream_schedule.append(candidate)
     return stream_schedule #, roots
 
+@timed("featurize.stream_classifier_input_v2")
 def construct_stream_classifier_input_v2(invocation, problem_info, model_info):
     data = Data(x=torch.tensor([1]))
     roots = objects_from_facts(problem_info.initial_facts)
@@ -190,6 +192,7 @@ def num_edges_from_fact(fact):
 
 
 #@profile
+@timed("featurize.hypermodel_input")
 def construct_hypermodel_input_faster(
     label: InvocationInfo,
     problem_info: ProblemInfo,
@@ -401,6 +404,7 @@ def construct_fact_graph(goal_facts, atom_map, stream_map):
     return nodes, node_attributes_list, edges, edge_attributes_list
 
 
+@timed("featurize.problem_graph")
 def construct_problem_graph(problem_info: ProblemInfo):
     """
     Construct an object graph where nodes are pddl objects and edges are facts.
@@ -493,6 +497,7 @@ def construct_geometric_scene_graph_input(problem_info: ProblemInfo):
         edge_index=edge_index
     )
 
+@timed("featurize.problem_graph_input")
 def construct_problem_graph_input(problem_info: ProblemInfo, model_info: ModelInfo):
     nodes, node_attr, edges, edge_attr = problem_info.problem_graph
     # construct_problem_graph(problem_info)
@@ -10,6 +10,8 @@ from torch_geometric.data import Batch
 from torch_geometric.nn import GCNConv, MetaLayer
 from torch_scatter import scatter_mean
 
+from learning.profiling import timed
+
 
 def nPr(n, r):
     assert isinstance(n, int), "n must be an int"
@@ -35,6 +37,7 @@ class PLOIAblationModel(nn.Module):
         self.pg_mlp = MLP([hidden_size, 1], hidden_size, dropout=0.5)
 
 
+    @timed("model.forward.PLOIAblationModel")
     def forward(self, data, object_reps=None, score=False, update_reps=False):
         rep_x = self.problem_graph_network(data, return_x=True)
         prob_x = self.pg_mlp(rep_x)
@@ -119,6 +122,7 @@ class HyperClassifier(nn.Module):
                 "Currently using problem graph is not supported without GNN's"
             )
 
+    @timed("model.forward.HyperClassifier")
     def forward(self, data, score = False):
         # first get node and edge embeddings from GNN
         x, edge_attr = data.x, data.edge_attr
@@ -239,6 +243,7 @@ class StreamInstanceClassifierV2(nn.Module):
         object_reps = {name: {"rep": rep_x[i], "logit": prob_x[i]} for i,name in enumerate(problem_graph.nodes[0])}
         return object_reps
 
+    @timed("model.forward.StreamInstanceClassifierV2")
     def forward(self, data, object_reps=None, score=False, update_reps=False):
         stream_schedule = data.stream_schedule
         if object_reps is None:
@@ -302,6 +307,7 @@ class StreamInstanceClassifier(nn.Module):
             setattr(self, f'mlp{i}', mlp)
 
 
+    @timed("model.forward.StreamInstanceClassifier")
     def forward(self, data, score=False):
         if self.use_object_model:
             object_representations = self.object_network(data.objects_data)
@@ -1,8 +1,11 @@
 from collections import defaultdict
+from contextlib import contextmanager
+import fcntl
 import sys
 import json
 import os
 import pickle
+import tempfile
 from datetime import datetime
 import numpy as np
 
@@ -13,6 +16,7 @@ from learning.data_models import HyperModelInfo, InvocationInfo, ModelInfo, Prob
 from learning.gnn.data import construct_hypermodel_input_faster, construct_input, construct_problem_graph, construct_problem_graph_input, construct_with_problem_graph, fact_level
 from learning.gnn.models import HyperClassifier, PLOIAblationModel, StreamInstanceClassifier, StreamInstanceClassifierV2
 from learning.pddlstream_utils import *
+from learning.profiling import count, timed
 from pddlstream.language.conversion import evaluation_from_fact, fact_from_evaluation
 from torch_geometric.data.batch import Batch
 
@@ -23,6 +27,30 @@ RED   = "\033[1;31m"
 RESET = "\033[0;0m"
 FILEPATH, _ = os.path.split(os.path.realpath(__file__))
 
+@contextmanager
+def locked_json(path):
+    """
+    Read-modify-write the json file at `path`: yields its contents ({} if
+    it does not exist) to be modified in place, while holding an exclusive
+    lock on path + ".lock", so that runs in parallel (see
+    experiments/run_experiments.py) do not lose each other's entries.
+    The file is replaced atomically, so readers never need the lock
+    """
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = {}
+        if os.path.isfile(path):
+            with open(path) as stream:
+                data = json.load(stream)
+        yield data
+        directory, name = os.path.split(path)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, prefix=name, suffix=".tmp", delete=False
+        ) as stream:
+            json.dump(data, stream, indent=4, sort_keys=True)
+        os.replace(stream.name, path)
+
+
 def instance_caching(predict_fn):
   instance_history = {}
   def cached_predict(self, result, *args, **kwargs):
@@ -32,6 +60,7 @@ def instance_caching(predict_fn):
         score, num_visits, was_refined = instance_history[instance]
         if was_refined == is_refined:
             instance_history[instance] = (score, num_visits + 1, was_refined)
+            count("oracle.predict.cache_hit")
             return score
         else:
             assert not was_refined and is_refined, "Somehow the instance got unrefined"
@@ -170,16 +199,8 @@ class Oracle:
         )
 
     def save_labeled(self, stats_path, path=None, save_data_info = False):
-        if not os.path.isdir(f"{FILEPATH}/data"):
-            os.mkdir(f"{FILEPATH}/data")
-        if not os.path.isdir(f"{FILEPATH}/data/labeled"):
-            os.mkdir(f"{FILEPATH}/data/labeled")
-        if save_data_info:
-            info_path = f"{FILEPATH}/data/labeled/data_info.json"
-            data_info = {}
-            if os.path.isfile(info_path):
-                with open(info_path, "r") as f:
-                    data_info = json.load(f)
+        os.makedirs(f"{FILEPATH}/data/labeled", exist_ok=True)
+        info_path = f"{FILEPATH}/data/labeled/data_info.json"
         if path is None:
             path = self.save_path
 
@@ -200,12 +221,11 @@ class Oracle:
             self.run_attr["stats_path"] = stats_path
             pddl = self.domain_pddl + self.stream_pddl 
             if save_data_info:
-                if pddl not in data_info:
-                    # only save name of pkl file
-                    data_info[pddl] = []
-                data_info[pddl].append((self.run_attr, datafile, len(self.labels)))
-                with open(info_path, "w") as f:
-                    json.dump(data_info, f, indent = 4, sort_keys = True)
+                with locked_json(info_path) as data_info:
+                    if pddl not in data_info:
+                        # only save name of pkl file
+                        data_info[pddl] = []
+                    data_info[pddl].append((self.run_attr, datafile, len(self.labels)))
 
         data = {}
         data["stats_path"] = stats_path
@@ -230,23 +250,14 @@ class Oracle:
         index.json, with the key being the unique identifier
         string for that problem
         """
-        if not os.path.isdir(f"{FILEPATH}/data"):
-            os.mkdir(f"{FILEPATH}/data")
-        index = {}
-        exists = os.path.isfile(f"{FILEPATH}/data/index.json")
-        if exists:
-            with open(f"{FILEPATH}/data/index.json") as stream:
-                index = json.load(stream)
-
+        os.makedirs(f"{FILEPATH}/data", exist_ok=True)
         pddl = self.domain_pddl + self.stream_pddl
         str_index = self.str_init + self.str_goal
 
-        if pddl not in index:
-            index[pddl] = {}
-
-        index[pddl][str_index] = stats_path
-        with open(f"{FILEPATH}/data/index.json", "w") as stream:
-            json.dump(index, stream, indent=4, sort_keys=True)
+        with locked_json(f"{FILEPATH}/data/index.json") as index:
+            if pddl not in index:
+                index[pddl] = {}
+            index[pddl][str_index] = stats_path
 
     def get_stats(self):
         """
@@ -344,6 +355,7 @@ class Oracle:
 
         return unique_is_relevant
 
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         facts = [fact_to_pddl(f) for f in result.get_certified()]
         domain = [fact_to_pddl(f) for f in result.domain]
@@ -406,6 +418,7 @@ class OracleModel(Oracle):
 
         return unique_is_relevant
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, **kwargs):
         if not hasattr(self, 'relevant_checker'):
@@ -474,6 +487,7 @@ class Model(Oracle):
 
         return checker
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, **kwargs):
         if not result.is_refined() or not all([d in node_from_atom for d in result.domain]):
@@ -500,6 +514,7 @@ class CachingModel(Model):
         self.logits = {}
         self.init_objects = objects_from_facts(self.problem_info.initial_facts)
 
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         facts = [fact_to_pddl(f) for f in result.get_certified()]
         domain = [fact_to_pddl(f) for f in result.domain]
@@ -509,6 +524,7 @@ class CachingModel(Model):
             result_key += standardize_facts(ancestors_tuple(fact, atom_map=atom_map), self.init_objects)
         return result_key
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, levels, atom_map, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1  + result.call_index
@@ -531,6 +547,7 @@ class CachingModel(Model):
 
 
 class ComplexityModelV3(Oracle):
+    @timed("oracle.predict")
     def predict(self, result, node_from_atom, levels, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1  + result.call_index
         return 1  / l
@@ -544,6 +561,7 @@ class StatsAblation(Oracle):
         self.model_path = model_path
         with open(model_path, 'r') as f:
             self.stats = json.load(f)
+    @timed("oracle.predict")
     def predict(self, result, node_from_atom, levels, **kwargs):
         return self.stats[result.name]
 
@@ -553,6 +571,7 @@ class ComplexityModelV3StructureAware(Oracle):
         super().__init__(*args, **kwargs)
         self.counts = {}
 
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         if not hasattr(self, 'init_objects'):
             self.init_objects = objects_from_facts(self.problem_info.initial_facts)
@@ -564,6 +583,7 @@ class ComplexityModelV3StructureAware(Oracle):
             result_key += standardize_facts(ancestors_tuple(fact, atom_map=atom_map), self.init_objects)
         return result_key
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, levels, atom_map, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1  + result.call_index
@@ -587,6 +607,7 @@ class OracleModelExpansion(OracleModel):
 
         self.last_preimage = preimage_no_leaves
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, **kwargs):
         if not hasattr(self, 'relevant_checker'):
@@ -603,6 +624,7 @@ class OracleModelExpansion(OracleModel):
 
 class OracleAndComplexityModelExpansion(OracleModelExpansion):
     """Uses an oracle + complexity for refined facts and just complexity for unrefined""" 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, levels,**kwargs):
         if not hasattr(self, 'relevant_checker'):
@@ -639,6 +661,7 @@ class OracleDAggerModel(OracleModel):
 
         return is_match, match
 
+    @timed("oracle.predict")
     @instance_caching
     def predict(self, result, node_from_atom, levels, **kwargs):
         if not hasattr(self, 'relevant_checker'):
@@ -821,6 +844,7 @@ class MultiHeadModel(Oracle):
         self.running_average = 0.1
         self.N = 10
     
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         facts = [fact_to_pddl(f) for f in result.get_certified()]
         domain = [fact_to_pddl(f) for f in result.domain]
@@ -830,6 +854,7 @@ class MultiHeadModel(Oracle):
             result_key += standardize_facts(ancestors_tuple(fact, atom_map=atom_map), self.init_objects)
         return result_key
 
+    @timed("oracle.predict")
     def predict(self, result, node_from_atom, levels, atom_map, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1
         if not all([d in node_from_atom for d in result.domain]):
@@ -877,6 +902,7 @@ class PLOIAblation(MultiHeadModel):
         self.counts = {}
         self.init_objects = objects_from_facts(self.problem_info.initial_facts)
     
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         facts = [fact_to_pddl(f) for f in result.get_certified()]
         domain = [fact_to_pddl(f) for f in result.domain]
@@ -889,6 +915,7 @@ class PLOIAblation(MultiHeadModel):
             result_key += standardize_facts(anc, self.init_objects)
         return result_key, objs
 
+    @timed("oracle.predict")
     def predict(self, result, node_from_atom, levels, atom_map, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1
         assert l > 0
@@ -934,6 +961,7 @@ class PLOIAblation(MultiHeadModel):
         self.counts = {}
         self.init_objects = objects_from_facts(self.problem_info.initial_facts)
     
+    @timed("oracle.calculate_result_key")
     def calculate_result_key(self, result, atom_map):
         facts = [fact_to_pddl(f) for f in result.get_certified()]
         domain = [fact_to_pddl(f) for f in result.domain]
@@ -946,6 +974,7 @@ class PLOIAblation(MultiHeadModel):
             result_key += standardize_facts(anc, self.init_objects)
         return result_key, objs
 
+    @timed("oracle.predict")
     def predict(self, result, node_from_atom, levels, atom_map, **kwargs):
         l = max(levels[evaluation_from_fact(f)] for f in result.domain) + 1  + result.call_index
         assert l > 0
@@ -0,0 +1,194 @@
+"""
+Lightweight, always-on profiling of named stages.
+
+Timers and counters are aggregated in-process and can be added
+to a run's stats.json (as the "profile" section) or saved as a
+Chrome trace (load it in chrome://tracing or https://ui.perfetto.dev).
+
+Basic Usage:
+
+    from learning import profiling
+
+    with profiling.timer("my-stage"):
+        ...
+
+    @profiling.timed("my-function")
+    def my_function():
+        ...
+
+    profiling.count("cache-hit")
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Profiler:
+    def __init__(self, max_trace_events=1000000):
+        self.max_trace_events = max_trace_events
+        # streams, planner races and path smoothing time from several threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # name -> [calls, total time, max time]
+        self.timers = {}
+        self.counters = {}
+        self.trace = None
+        self.start_time = time.perf_counter()
+
+    def enable_trace(self):
+        """
+        Start recording every timed event (for save_trace)
+        """
+        self.trace = []
+
+    def add(self, name, start, duration):
+        with self.lock:
+            stat = self.timers.get(name)
+            if stat is None:
+                self.timers[name] = [1, duration, duration]
+            else:
+                stat[0] += 1
+                stat[1] += duration
+                if duration > stat[2]:
+                    stat[2] = duration
+            if self.trace is not None and len(self.trace) < self.max_trace_events:
+                self.trace.append((name, start, duration, threading.get_ident()))
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start)
+
+    def timed(self, name):
+        """
+        Decorator that times every call to the decorated function
+        """
+
+        def decorator(fn):
+            @wraps(fn)
+            def timed_fn(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.add(name, start, time.perf_counter() - start)
+
+            return timed_fn
+
+        return decorator
+
+    def timed_iterator(self, name, iterator):
+        """
+        Generator of the values of iterator, timing each call to next().
+        Time spent while the generator is suspended is not counted.
+        """
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(name, start, time.perf_counter() - start)
+            yield value
+
+    def timed_generator(self, name, gen_fn):
+        """
+        Wrap a generator function (or any function returning an iterator)
+        so that the call and each call to next() are timed.
+        A pddlstream BoundedGenerator (from from_fn, from_test, ...) is
+        returned as is, with only its underlying generator timed, so that
+        its max_calls (and so when the planner considers it enumerated)
+        does not change.
+        """
+
+        @wraps(gen_fn)
+        def timed_gen_fn(*args, **kwargs):
+            start = time.perf_counter()
+            res = gen_fn(*args, **kwargs)
+            self.add(name, start, time.perf_counter() - start)
+            if hasattr(res, "max_calls"):
+                res.generator = self.timed_iterator(name, res.generator)
+                return res
+            return self.timed_iterator(name, iter(res))
+
+        return timed_gen_fn
+
+    def summary(self):
+        with self.lock:
+            timers = {name: list(stat) for name, stat in self.timers.items()}
+            counters = dict(self.counters)
+        return {
+            "timers": {
+                name: {
+                    "calls": calls,
+                    "total": total,
+                    "mean": total / calls,
+                    "max": max_time,
+                }
+                for name, (calls, total, max_time) in sorted(timers.items())
+            },
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def save_trace(self, path):
+        """
+        Save the recorded events in the Chrome trace event format
+        """
+        assert self.trace is not None, "Call enable_trace() before running"
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start_time) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, duration, tid in self.trace
+        ]
+        with open(path, "w") as stream:
+            json.dump({"traceEvents": events}, stream)
+
+    def add_to_stats(self, stats_path):
+        """
+        Add the summary as the "profile" section of the stats.json
+        at `stats_path`. Does nothing if it does not exist.
+        """
+        if not os.path.isfile(stats_path):
+            return
+        with open(stats_path, "r") as stream:
+            data = json.load(stream)
+        data["profile"] = self.summary()
+        with open(stats_path, "w") as stream:
+            json.dump(data, stream, indent=4, sort_keys=True)
+
+
+PROFILER = Profiler()
+timer = PROFILER.timer
+timed = PROFILER.timed
+timed_generator = PROFILER.timed_generator
+count = PROFILER.count
+
+
+def profile_stream_map(stream_map):
+    """
+    Time the evaluation of every stream in a pddlstream stream_map
+    """
+    return {
+        name: timed_generator(f"stream.{name}", gen_fn)
+        for name, gen_fn in stream_map.items()
+    }
@@ -0,0 +1,557 @@
+"""
+Synthetic problem generators for benchmarking the learning code
+without running Drake, OMPL or FastDownward.
+
+A synthetic problem mimics the data recorded during a real run:
+an atom_map, a stream_map, an object_stream_map, the stream results
+that certified every fact, a node_from_atom and a ProblemInfo.
+
+make_synthetic_problem uses a small fixed toy signature, while
+make_problem_from_pddl grounds the streams of any domain's stream.pddl.
+"""
+import pickle
+import random
+from types import SimpleNamespace
+
+import numpy as np
+
+from learning.data_models import (
+    HyperModelInfo,
+    InvocationInfo,
+    ModelInfo,
+    ProblemInfo,
+    RuntimeInvocationInfo,
+    SerializedResult,
+)
+from learning.pddlstream_utils import ancestors
+from pddlstream.algorithms.downward import parse_lisp, parse_sequential_domain
+
+
+class SyntheticPose:
+    """
+    Stands in for a pydrake RigidTransform in ProblemInfo.model_poses
+    """
+
+    def __init__(self, p):
+        self.p = np.array(p, dtype=float)
+
+    def translation(self):
+        return self.p.copy()
+
+    def GetAsMatrix34(self):
+        return np.hstack([np.eye(3), self.p.reshape(3, 1)])
+
+    def __str__(self):
+        return f"SyntheticPose({self.p})"
+
+
+class SyntheticResult(SerializedResult):
+    """
+    A SerializedResult that also has the parts of the
+    pddlstream StreamResult interface used by the oracles
+    """
+
+    __slots__ = ()
+
+    @property
+    def external(self):
+        return SimpleNamespace(name=self.name)
+
+    def get_certified(self):
+        return self.certified
+
+    def is_refined(self):
+        return True
+
+    def is_input_refined_recursive(self):
+        return True
+
+
+# predicate name -> parameters
+TOY_PREDICATES = {
+    "item": ("?a",),
+    "rel": ("?a", "?b"),
+    "value": ("?a", "?x"),
+    "joint": ("?x", "?y", "?z"),
+    "goalrel": ("?a", "?b"),
+}
+
+# stream name -> (inputs, domain, outputs, certified)
+TOY_STREAMS = {
+    "sample": (("?a",), (("item", "?a"),), ("?x",), (("value", "?a", "?x"),)),
+    "extend": (
+        ("?a", "?x"),
+        (("value", "?a", "?x"),),
+        ("?y",),
+        (("value", "?a", "?y"),),
+    ),
+    "combine": (
+        ("?a", "?b", "?x", "?y"),
+        (("value", "?a", "?x"), ("value", "?b", "?y"), ("rel", "?a", "?b")),
+        ("?z",),
+        (("joint", "?x", "?y", "?z"),),
+    ),
+}
+
+# action name -> (precondition predicates, effect predicates)
+TOY_ACTIONS = {
+    "connect": (("value", "rel"), ("goalrel",)),
+    "finish": (("joint",), ("goalrel",)),
+}
+
+
+def make_domain(predicates, actions):
+    """
+    Make an object with the parts of the
+    pddlstream.algorithms.downward.Domain interface
+    used by ModelInfo and the featurizers
+    """
+    return SimpleNamespace(
+        predicates=[
+            SimpleNamespace(name=name, arguments=list(params))
+            for name, params in predicates.items()
+        ],
+        actions=[
+            SimpleNamespace(
+                name=name,
+                precondition=SimpleNamespace(
+                    parts=[SimpleNamespace(predicate=p) for p in pre]
+                ),
+                effects=[
+                    SimpleNamespace(literal=SimpleNamespace(predicate=p)) for p in eff
+                ],
+            )
+            for name, (pre, eff) in actions.items()
+        ],
+    )
+
+
+def parse_stream_signatures(stream_pddl):
+    """
+    Parse a stream.pddl into a dictionary of the form
+    {
+        <stream_name>: (<inputs>, <domain>, <outputs>, <certified>),
+        "find-grasp": (("?block",), (("block", "?block"),), ("?X_HB",), (("handpose", "?block", "?X_HB"),)),
+    }
+    Only :stream entries are parsed (not :function or :predicate).
+    """
+
+    def conjunction(lisp):
+        if not lisp:
+            return ()
+        if lisp[0] == "and":
+            return tuple(tuple(f) for f in lisp[1:])
+        return (tuple(lisp),)
+
+    signatures = {}
+    for entry in parse_lisp(stream_pddl)[2:]:
+        if entry[0] != ":stream":
+            continue
+        name = entry[1]
+        values = dict(zip(entry[2::2], entry[3::2]))
+        signatures[name] = (
+            tuple(values.get(":inputs", ())),
+            conjunction(values.get(":domain", ())),
+            tuple(values.get(":outputs", ())),
+            conjunction(values.get(":certified", ())),
+        )
+    return signatures
+
+
+class SyntheticProblem:
+    def __init__(self, predicates, streams, actions=None, domain=None):
+        self.predicates = predicates
+        self.streams = streams
+        self.domain = make_domain(predicates, actions) if domain is None else domain
+        self.domain_pddl = None
+        self.stream_pddl = None
+        # result -> (atom_map, object_stream_map) before that result was found
+        self.snapshots = {}
+        self.atom_map = {}
+        self.stream_map = {}
+        self.object_stream_map = {}
+        self.results = []
+        self.initial_facts = []
+        self.goal_facts = []
+        self.problem_info = None
+        self.num_objects = 0
+
+    def new_object(self):
+        obj = f"v{self.num_objects}"
+        self.num_objects += 1
+        return obj
+
+    def add_initial(self, fact):
+        self.initial_facts.append(fact)
+        self.atom_map[fact] = []
+        self.stream_map[fact] = None
+
+    def add_result(self, name, input_objects):
+        """
+        Ground stream `name` on `input_objects`, create fresh output objects
+        and add the certified facts. Returns the new SyntheticResult.
+        """
+        inputs, domain, outputs, certified = self.streams[name]
+        output_objects = tuple(self.new_object() for _ in outputs)
+        sub = dict(zip(inputs, input_objects))
+        sub.update(zip(outputs, output_objects))
+        ground = lambda fact: (fact[0],) + tuple(sub[p] for p in fact[1:])
+        result = SyntheticResult(
+            name=name,
+            certified=tuple(ground(f) for f in certified),
+            domain=tuple(ground(f) for f in domain),
+            input_objects=tuple(input_objects),
+            output_objects=output_objects,
+        )
+        for fact in result.certified:
+            self.atom_map[fact] = list(result.domain)
+            self.stream_map[fact] = name
+        for obj in output_objects:
+            self.object_stream_map[obj] = {
+                "name": name,
+                "input_objects": list(result.input_objects),
+                "output_objects": list(output_objects),
+            }
+        self.results.append(result)
+        return result
+
+    @property
+    def node_from_atom(self):
+        """
+        A node_from_atom like the one pddlstream keeps
+        (only the `result` attribute of each node is populated)
+        """
+        res = {fact: SimpleNamespace(result=None) for fact in self.initial_facts}
+        for result in self.results:
+            for fact in result.certified:
+                res[fact] = SimpleNamespace(result=result)
+        return res
+
+    def make_model_info(self, model_info_class=HyperModelInfo):
+        names = list(self.streams)
+        return model_info_class(
+            predicates=list(self.predicates),
+            streams=[None] + names,
+            stream_num_domain_facts=[None] + [len(self.streams[n][1]) for n in names],
+            stream_num_inputs=[None] + [len(self.streams[n][0]) for n in names],
+            stream_num_outputs=[None] + [len(self.streams[n][2]) for n in names],
+            stream_domains=[None] + [list(self.streams[n][1]) for n in names],
+            domain=self.domain,
+        )
+
+    def maps_for(self, result):
+        """
+        Return the atom_map and object_stream_map as they were
+        when `result` was found
+        """
+        return self.snapshots.get(result, (self.atom_map, self.object_stream_map))
+
+    def make_invocation(self, result, label=None):
+        invocation = RuntimeInvocationInfo(
+            result, self.atom_map, self.stream_map, self.object_stream_map
+        )
+        invocation.label = label
+        return invocation
+
+    def preimage_of(self, facts):
+        """
+        Return the facts and all of their ancestors
+        (ie. what would be the last_preimage of a plan using `facts`)
+        """
+        res = set(facts)
+        for fact in facts:
+            res |= ancestors(fact, self.atom_map)
+        return res
+
+    def make_labels(self, label_ratio=0.2, seed=0):
+        """
+        Return a list of labeled InvocationInfos, one per result,
+        like the ones saved by Oracle.after_run.
+
+        About `label_ratio` of the results are labeled relevant. Random
+        results are chosen along with every result they depend on, so
+        the relevant results are closed under ancestry like a real preimage.
+        """
+        rng = random.Random(seed)
+        result_of_fact = {f: r for r in self.results for f in r.certified}
+        positive = set()
+        candidates = self.results[:]
+        rng.shuffle(candidates)
+        for result in candidates:
+            if len(positive) >= label_ratio * len(self.results):
+                break
+            stack = [result]
+            while stack:
+                r = stack.pop()
+                if r in positive:
+                    continue
+                positive.add(r)
+                stack.extend(result_of_fact[f] for f in r.domain if f in result_of_fact)
+        labels = []
+        for result in self.results:
+            atom_map, object_stream_map = self.maps_for(result)
+            labels.append(
+                InvocationInfo(
+                    result,
+                    None,
+                    label=result in positive,
+                    atom_map=atom_map,
+                    object_stream_map=object_stream_map,
+                )
+            )
+        return labels
+
+    def save_labels(self, path, labels):
+        """
+        Save `labels` in the same format as Oracle.save_labeled,
+        so they can be loaded with learning.gnn.data.Dataset
+        """
+        # the rest of this module doesn't need torch
+        from learning.gnn.data import construct_problem_graph
+
+        self.problem_info.problem_graph = construct_problem_graph(self.problem_info)
+        data = {
+            "stats_path": None,
+            "domain_pddl": self.domain_pddl,
+            "stream_pddl": self.stream_pddl,
+            "model_info": self.make_model_info(ModelInfo),
+            "problem_info": self.problem_info,
+            "num_labels": len(labels),
+            "data_info": None,
+            "labels": labels,
+        }
+        with open(path, "wb") as stream:
+            pickle.dump(data, stream)
+
+
+def make_synthetic_problem(depth=3, branching=2, num_objects=4, seed=0):
+    """
+    Make a SyntheticProblem with the toy signature above.
+
+    depth: the number of stream levels above the initial facts
+    branching: the number of results per stream instance
+    num_objects: the number of initial (item) objects
+
+    The number of facts grows like num_objects * branching ** depth
+    """
+    assert num_objects >= 2, "Need at least two initial objects"
+    rng = random.Random(seed)
+    problem = SyntheticProblem(TOY_PREDICATES, TOY_STREAMS, TOY_ACTIONS)
+    items = [problem.new_object() for _ in range(num_objects)]
+    for item in items:
+        problem.add_initial(("item", item))
+    for a, b in zip(items[:-1], items[1:]):
+        problem.add_initial(("rel", a, b))
+    problem.goal_facts = [("goalrel", items[0], items[-1])]
+
+    values = {item: [] for item in items}
+    frontier = []
+    for item in items:
+        for _ in range(branching):
+            result = problem.add_result("sample", (item,))
+            frontier.extend(result.certified)
+    for _ in range(depth - 1):
+        new_frontier = []
+        for _, a, x in frontier:
+            values[a].append(x)
+            for _ in range(branching):
+                result = problem.add_result("extend", (a, x))
+                new_frontier.extend(result.certified)
+        frontier = new_frontier
+    for _, a, x in frontier:
+        values[a].append(x)
+    for a, b in zip(items[:-1], items[1:]):
+        for _ in range(branching):
+            problem.add_result("combine", (a, b, rng.choice(values[a]), rng.choice(values[b])))
+
+    problem.problem_info = ProblemInfo(
+        goal_facts=tuple(problem.goal_facts),
+        initial_facts=tuple(problem.initial_facts),
+        model_poses=[
+            {
+                "name": f"block{i}",
+                "X": SyntheticPose([rng.uniform(-1, 1), rng.uniform(-1, 1), 0]),
+                "static": False,
+            }
+            for i in range(num_objects)
+        ],
+        object_mapping={item: f"block{i}" for i, item in enumerate(items)},
+    )
+    return problem
+
+
+class FactIndex:
+    """
+    Facts indexed by predicate and by (predicate, argument position, object)
+    """
+
+    def __init__(self):
+        self.by_predicate = {}
+        self.by_argument = {}
+
+    def add(self, fact):
+        self.by_predicate.setdefault(fact[0], []).append(fact)
+        for i, obj in enumerate(fact[1:]):
+            self.by_argument.setdefault((fact[0], i, obj), []).append(fact)
+
+    def candidates(self, pattern, sub):
+        """
+        Return the facts that could match `pattern`
+        given the partial substitution `sub`
+        """
+        best = self.by_predicate.get(pattern[0], [])
+        for i, param in enumerate(pattern[1:]):
+            if param in sub:
+                facts = self.by_argument.get((pattern[0], i, sub[param]), [])
+                if len(facts) < len(best):
+                    best = facts
+        return best
+
+
+def ground_stream(signature, new_facts, old_facts, rng, max_instances, used):
+    """
+    Find up to `max_instances` new groundings of the inputs of a
+    stream such that all of its domain facts are in `new_facts`
+    or `old_facts`. Facts from `new_facts` are tried first so that
+    the stream builds on the previous level. Every parameter
+    is bound to a different object. Groundings in `used` are skipped
+    and the new ones are added to it.
+    """
+    inputs, domain, _, _ = signature
+
+    def extend(i, sub):
+        if i == len(domain):
+            yield sub
+            return
+        pattern = domain[i]
+        for index in (new_facts, old_facts):
+            candidates = list(index.candidates(pattern, sub))
+            rng.shuffle(candidates)
+            for fact in candidates:
+                if len(fact) != len(pattern):
+                    continue
+                new_sub = dict(sub)
+                for param, obj in zip(pattern[1:], fact[1:]):
+                    if new_sub.setdefault(param, obj) != obj:
+                        break
+                else:
+                    if len(set(new_sub.values())) == len(new_sub):
+                        yield from extend(i + 1, new_sub)
+
+    groundings = []
+    if not domain or any(p not in {q for f in domain for q in f[1:]} for p in inputs):
+        return groundings
+    for sub in extend(0, {}):
+        key = tuple(sub[p] for p in inputs)
+        if key in used:
+            continue
+        used.add(key)
+        groundings.append(key)
+        if len(groundings) >= max_instances:
+            break
+    return groundings
+
+
+def make_problem_from_pddl(
+    domain_pddl,
+    stream_pddl,
+    depth=3,
+    fan_out=2,
+    num_objects=8,
+    max_instances=None,
+    goal_facts=(),
+    seed=0,
+):
+    """
+    Make a SyntheticProblem by grounding the streams in `stream_pddl`.
+
+    depth: the number of rounds of stream evaluation
+    fan_out: the number of results per stream instance (ie. the number
+        of times each generator is called). Test streams are called once.
+    num_objects: the number of initial objects. Every static predicate
+        (one that no stream certifies) gets initial facts over these objects.
+    max_instances: the maximum number of new instances of each stream
+        per round (defaults to num_objects)
+    goal_facts: the goal facts for the ProblemInfo
+    """
+    rng = random.Random(seed)
+    if max_instances is None:
+        max_instances = num_objects
+    domain = parse_sequential_domain(domain_pddl)
+    streams = parse_stream_signatures(stream_pddl)
+    predicates = {p.name: tuple(a.name for a in p.arguments) for p in domain.predicates}
+    problem = SyntheticProblem(predicates, streams, domain=domain)
+    problem.domain_pddl = domain_pddl
+    problem.stream_pddl = stream_pddl
+
+    certified = {f[0] for s in streams.values() for f in s[3]}
+    static = sorted(
+        {f[0] for s in streams.values() for f in s[1]} - certified,
+        key=lambda p: (len(predicates.get(p, ())), p),
+    )
+    static_unary = [p for p in static if len(predicates.get(p, ("?x",))) == 1]
+    objects = [problem.new_object() for _ in range(num_objects)]
+    names = {}
+    for i, obj in enumerate(objects):
+        if static_unary:
+            predicate = static_unary[i % len(static_unary)]
+            names[obj] = f"{predicate}{i}"
+            problem.add_initial((predicate, obj))
+        else:
+            names[obj] = f"object{i}"
+    for predicate in static:
+        arity = len(predicates.get(predicate, ()))
+        if arity < 2 or arity > len(objects):
+            continue
+        for _ in range(num_objects):
+            fact = (predicate,) + tuple(rng.sample(objects, arity))
+            if fact not in problem.atom_map:
+                problem.add_initial(fact)
+    problem.goal_facts = list(goal_facts)
+
+    new_facts, old_facts = FactIndex(), FactIndex()
+    for fact in problem.initial_facts:
+        new_facts.add(fact)
+    used = {name: set() for name in streams}
+    for _ in range(depth):
+        snapshot = (dict(problem.atom_map), dict(problem.object_stream_map))
+        found = []
+        for name, signature in streams.items():
+            for input_objects in ground_stream(
+                signature, new_facts, old_facts, rng, max_instances, used[name]
+            ):
+                for _ in range(fan_out if signature[2] else 1):
+                    result = problem.add_result(name, input_objects)
+                    problem.snapshots[result] = snapshot
+                    found.extend(result.certified)
+        for fact in new_facts.by_predicate.values():
+            for f in fact:
+                old_facts.add(f)
+        new_facts = FactIndex()
+        for fact in found:
+            new_facts.add(fact)
+
+    problem.problem_info = ProblemInfo(
+        goal_facts=tuple(problem.goal_facts),
+        initial_facts=tuple(problem.initial_facts),
+        model_poses=[
+            {
+                "name": names[obj],
+                "X": SyntheticPose([rng.uniform(-1, 1), rng.uniform(-1, 1), 0]),
+                "static": False,
+            }
+            for obj in objects
+        ],
+        object_mapping=names,
+    )
+    return problem
+
+
+def make_problems_from_pddl(domain_pddl, stream_pddl, num_problems, seed=0, **kwargs):
+    """
+    Make `num_problems` SyntheticProblems (see make_problem_from_pddl)
+    """
+    return [
+        make_problem_from_pddl(domain_pddl, stream_pddl, seed=seed + i, **kwargs)
+        for i in range(num_problems)
+    ]
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+
+import pytest
+
+FILEPATH, _ = os.path.split(os.path.realpath(__file__))
+INDEX_PATH = os.path.join(FILEPATH, "..", "..", "data", "index.json")
+
+# name -> (depth, branching, num_objects)
+SIZES = {
+    "small": (2, 2, 4),
+    "medium": (3, 3, 8),
+    "large": (4, 3, 16),
+}
+MAX_RECORDED = 5
+DOMAINS = ["blocks_world", "kitchen"]
+# name -> (depth, fan_out, num_objects)
+PDDL_SIZES = {
+    "small": (3, 2, 8),
+    "large": (4, 3, 32),
+}
+EXPERIMENTS_PATH = os.path.join(FILEPATH, "..", "..", "..", "experiments")
+
+
+def recorded_stats_paths():
+    """
+    stats.json files to replay. These are the files matching the
+    (os.pathsep separated) globs in $BENCHMARK_STATS and any
+    stats.json listed in learning/data/index.json that exists on this machine
+    """
+    paths = set()
+    for pattern in os.environ.get("BENCHMARK_STATS", "").split(os.pathsep):
+        if pattern:
+            paths |= set(glob.glob(pattern))
+    if os.path.isfile(INDEX_PATH):
+        with open(INDEX_PATH) as stream:
+            index = json.load(stream)
+        for problems in index.values():
+            paths |= {p for p in problems.values() if os.path.isfile(p)}
+    return sorted(paths)[:MAX_RECORDED]
+
+
+@pytest.fixture(scope="module", params=list(SIZES))
+def problem(request):
+    from learning.synthetic import make_synthetic_problem
+
+    depth, branching, num_objects = SIZES[request.param]
+    return make_synthetic_problem(
+        depth=depth, branching=branching, num_objects=num_objects
+    )
+
+
+@pytest.fixture(
+    scope="module",
+    params=[(d, s) for d in DOMAINS for s in PDDL_SIZES],
+    ids=[f"{d}-{s}" for d in DOMAINS for s in PDDL_SIZES],
+)
+def pddl_problem(request):
+    """
+    A synthetic problem grounded from a domain's stream.pddl
+    """
+    from learning.synthetic import make_problem_from_pddl
+
+    domain, size = request.param
+    depth, fan_out, num_objects = PDDL_SIZES[size]
+    with open(os.path.join(EXPERIMENTS_PATH, domain, "domain.pddl")) as f:
+        domain_pddl = f.read()
+    with open(os.path.join(EXPERIMENTS_PATH, domain, "stream.pddl")) as f:
+        stream_pddl = f.read()
+    return make_problem_from_pddl(
+        domain_pddl,
+        stream_pddl,
+        depth=depth,
+        fan_out=fan_out,
+        num_objects=num_objects,
+    )
+
+
+@pytest.fixture(scope="module")
+def oracle(problem):
+    """
+    An Oracle whose preimage is the ancestors of half of the
+    "combine" results of `problem`
+    """
+    from learning.oracle import Oracle
+    from learning.pddlstream_utils import sub_map_from_init
+
+    oracle = Oracle("", "", problem.initial_facts, problem.goal_facts)
+    combines = [r for r in problem.results if r.name == "combine"]
+    plan_facts = [f for r in combines[::2] for f in r.certified]
+    oracle.atom_map = problem.atom_map
+    oracle.init = set(problem.initial_facts)
+    oracle.init_sub = sub_map_from_init(oracle.init)
+    oracle.last_preimage = list(problem.preimage_of(plan_facts))
+    return oracle
+
+
+@pytest.fixture(
+    scope="module",
+    params=recorded_stats_paths()
+    or [pytest.param(None, marks=pytest.mark.skip(reason="No recorded stats.json"))],
+)
+def recorded_stats(request):
+    from learning.pddlstream_utils import item_to_dict
+
+    with open(request.param) as stream:
+        data = json.load(stream)
+    atom_map = item_to_dict(data["atom_map"])
+    last_preimage = [tuple(f) for f in data["last_preimage"] if tuple(f) in atom_map]
+    return atom_map, last_preimage
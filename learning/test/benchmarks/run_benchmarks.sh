@@ -0,0 +1,17 @@
+#!/bin/bash
+# Run the learning benchmarks and save the results as json in
+# learning/test/benchmarks/.benchmarks (one file per run).
+# Compare runs with: pytest-benchmark --storage <that dir> compare
+# Extra arguments are passed to pytest. Set BENCHMARK_STATS to a
+# glob of stats.json files to also replay recorded runs.
+set -e
+DIR=$(dirname $(realpath $0))
+ROOT=$(realpath $DIR/../../..)
+export CUDA_VISIBLE_DEVICES=""
+
+cd $ROOT
+PYTHONPATH=pddlstream:. python -m pytest $DIR \
+  --benchmark-only \
+  --benchmark-autosave \
+  --benchmark-storage=$DIR/.benchmarks \
+  "${@}"
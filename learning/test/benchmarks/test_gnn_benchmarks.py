@@ -0,0 +1,107 @@
+"""
+Benchmarks for the featurizers, models and oracle, which need torch.
+
+Run with learning/test/benchmarks/run_benchmarks.sh to save the results as json.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+torch = pytest.importorskip("torch")
+
+from torch_geometric.data import Batch
+
+from learning.data_models import HyperModelInfo, StreamInstanceClassifierV2Info
+from learning.gnn.data import (
+    construct_hypermodel_input_faster,
+    construct_problem_graph,
+    construct_stream_classifier_input_v2,
+    construct_with_problem_graph,
+)
+from learning.gnn.models import HyperClassifier, StreamInstanceClassifierV2
+from learning.oracle import is_matching
+from learning.pddlstream_utils import ancestors_tuple, sub_map_from_init
+
+BATCH_SIZE = 32
+NUM_RELEVANCE_CHECKS = 64
+
+
+def test_construct_hypermodel_input_faster(benchmark, problem):
+    model_info = problem.make_model_info(HyperModelInfo)
+    invocation = problem.make_invocation(problem.results[-1])
+    benchmark(
+        construct_hypermodel_input_faster,
+        invocation,
+        problem.problem_info,
+        model_info,
+    )
+
+
+def test_hyperclassifier_forward(benchmark, problem):
+    torch.manual_seed(0)
+    model_info = problem.make_model_info(HyperModelInfo)
+    model = HyperClassifier(model_info, with_problem_graph=True)
+    model.eval()
+    input_fn = construct_with_problem_graph(construct_hypermodel_input_faster)
+    batch = Batch().from_data_list(
+        [
+            input_fn(problem.make_invocation(r), problem.problem_info, model_info)
+            for r in problem.results[-BATCH_SIZE:]
+        ]
+    )
+    with torch.no_grad():
+        benchmark(model, batch, score=True)
+
+
+def test_stream_classifier_v2_forward(benchmark, problem):
+    torch.manual_seed(0)
+    model_info = problem.make_model_info(StreamInstanceClassifierV2Info)
+    problem.problem_info.problem_graph = construct_problem_graph(problem.problem_info)
+    model = StreamInstanceClassifierV2(model_info)
+    model.eval()
+    data = construct_stream_classifier_input_v2(
+        problem.make_invocation(problem.results[-1]), problem.problem_info, model_info
+    )
+    batch = Batch().from_data_list([data])
+    with torch.no_grad():
+        benchmark(model, batch, score=True)
+
+
+def test_pddl_construct_hypermodel_input_faster(benchmark, pddl_problem):
+    model_info = pddl_problem.make_model_info(HyperModelInfo)
+    invocations = [
+        pddl_problem.make_invocation(r)
+        for r in pddl_problem.results[-NUM_RELEVANCE_CHECKS:]
+        if r.domain
+    ]
+    benchmark(
+        lambda: [
+            construct_hypermodel_input_faster(
+                invocation, pddl_problem.problem_info, model_info
+            )
+            for invocation in invocations
+        ]
+    )
+
+
+def test_oracle_is_relevant(benchmark, problem, oracle):
+    results = problem.results[-NUM_RELEVANCE_CHECKS:]
+    preimage = list(oracle.last_preimage)
+    benchmark(
+        lambda: [
+            oracle.is_relevant(r, None, preimage, can_atom_map=problem.atom_map)
+            for r in results
+        ]
+    )
+
+
+def test_recorded_is_matching(benchmark, recorded_stats):
+    atom_map, preimage = recorded_stats
+    init_sub = sub_map_from_init({f for f in atom_map if not atom_map[f]})
+    facts = preimage[:NUM_RELEVANCE_CHECKS]
+    branches = [ancestors_tuple(f, atom_map) for f in facts]
+    benchmark(
+        lambda: [
+            is_matching(f, b, preimage, atom_map, init_sub)
+            for f, b in zip(facts, branches)
+        ]
+    )
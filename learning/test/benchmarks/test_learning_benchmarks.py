@@ -0,0 +1,45 @@
+"""
+Benchmarks for the hot paths of model guided planning and training
+that don't need torch (see test_gnn_benchmarks.py for the rest).
+
+Run with learning/test/benchmarks/run_benchmarks.sh to save the results as json.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from learning.data_models import InvocationInfo
+from learning.pddlstream_utils import (
+    ancestors_tuple,
+    objects_from_facts,
+    standardize_facts,
+)
+
+
+def certified_facts(problem):
+    return [f for r in problem.results for f in r.certified]
+
+
+def test_ancestors_tuple(benchmark, problem):
+    facts = certified_facts(problem)
+    benchmark(lambda: [ancestors_tuple(f, problem.atom_map) for f in facts])
+
+
+def test_standardize_facts(benchmark, problem):
+    init_objects = objects_from_facts(problem.initial_facts)
+    branches = [ancestors_tuple(f, problem.atom_map) for f in certified_facts(problem)]
+    benchmark(lambda: [standardize_facts(b, init_objects) for b in branches])
+
+
+def test_invocation_info(benchmark, problem):
+    node_from_atom = problem.node_from_atom
+    benchmark(InvocationInfo, problem.results[-1], node_from_atom)
+
+
+def test_pddl_make_labels(benchmark, pddl_problem):
+    benchmark(pddl_problem.make_labels, label_ratio=0.2)
+
+
+def test_recorded_ancestors_tuple(benchmark, recorded_stats):
+    atom_map, _ = recorded_stats
+    benchmark(lambda: [ancestors_tuple(f, atom_map) for f in atom_map])
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+pytest.importorskip("pddlstream")
+
+from learning.synthetic import make_problem_from_pddl, make_synthetic_problem
+
+FILEPATH, _ = os.path.split(os.path.realpath(__file__))
+EXPERIMENTS_PATH = os.path.join(FILEPATH, "..", "..", "experiments")
+
+
+def read_pddl(domain):
+    with open(os.path.join(EXPERIMENTS_PATH, domain, "domain.pddl")) as f:
+        domain_pddl = f.read()
+    with open(os.path.join(EXPERIMENTS_PATH, domain, "stream.pddl")) as f:
+        stream_pddl = f.read()
+    return domain_pddl, stream_pddl
+
+
+@pytest.fixture(
+    scope="module",
+    params=["toy", "blocks_world", "kitchen"],
+)
+def problem(request):
+    if request.param == "toy":
+        return make_synthetic_problem(depth=3, branching=2, num_objects=4)
+    return make_problem_from_pddl(
+        *read_pddl(request.param), depth=3, fan_out=2, num_objects=6
+    )
+
+
+def closure(problem, result):
+    """
+    The results that `result` depends on, including itself
+    """
+    result_of_fact = {f: r for r in problem.results for f in r.certified}
+    res = set()
+    stack = [result]
+    while stack:
+        r = stack.pop()
+        if r in res:
+            continue
+        res.add(r)
+        stack.extend(result_of_fact[f] for f in r.domain if f in result_of_fact)
+    return res
+
+
+@pytest.mark.parametrize("label_ratio", [0.1, 0.3, 0.6])
+def test_make_labels_ratio(problem, label_ratio):
+    labels = problem.make_labels(label_ratio=label_ratio)
+    assert len(labels) == len(problem.results)
+    num_positive = sum(label.label for label in labels)
+    # results are added with everything they depend on, so the ratio can
+    # only be overshot by the last closure added
+    max_closure = max(len(closure(problem, r)) for r in problem.results)
+    assert label_ratio * len(labels) <= num_positive
+    assert num_positive < label_ratio * len(labels) + max_closure
+
+
+def test_make_labels_closed_under_ancestry(problem):
+    labels = problem.make_labels(label_ratio=0.3)
+    positive = {result for result, label in zip(problem.results, labels) if label.label}
+    assert positive
+    for result in positive:
+        assert closure(problem, result) <= positive
+
+
+def test_make_labels_is_seeded(problem):
+    first = [label.label for label in problem.make_labels(label_ratio=0.3, seed=1)]
+    second = [label.label for label in problem.make_labels(label_ratio=0.3, seed=1)]
+    assert first == second
+
+
+def test_save_labels_loads_as_dataset(problem, tmp_path):
+    torch = pytest.importorskip("torch")
+    from learning.data_models import HyperModelInfo
+    from learning.gnn.data import (
+        Dataset,
+        construct_hypermodel_input_faster,
+        construct_with_problem_graph,
+    )
+
+    labels = problem.make_labels(label_ratio=0.3)
+    path = os.path.join(tmp_path, "labels.pkl")
+    problem.save_labels(path, labels)
+    dataset = Dataset(
+        construct_with_problem_graph(construct_hypermodel_input_faster),
+        HyperModelInfo,
+        preprocess_all=True,
+    )
+    dataset.from_pkl_files(path)
+    dataset.prepare()
+    assert len(dataset) == len(labels)
+    assert dataset.model_info.stream_pddl == problem.stream_pddl
+    for i, label in enumerate(labels):
+        assert dataset[(0, i)].y == torch.tensor([float(label.label)])
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+visualization = pytest.importorskip("learning.visualization")
+
+# a -> c, a -> d, b -> d, c -> e, d -> e, and a loner l
+ATOM_MAP = {
+    ("a",): [],
+    ("b",): [],
+    ("l",): [],
+    ("c", "x"): [("a",)],
+    ("d", "x"): [("a",), ("b",)],
+    ("e", "x"): [("c", "x"), ("d", "x")],
+}
+LEVELS = {
+    ("a",): 0,
+    ("b",): 0,
+    ("l",): 0,
+    ("c", "x"): 1,
+    ("d", "x"): 1,
+    ("e", "x"): 2,
+}
+
+
+@pytest.fixture
+def graph():
+    graph = visualization.DirectedGraph(ATOM_MAP)
+    for fact in ATOM_MAP:
+        graph.add_node(fact)
+    return graph
+
+
+def test_compute_levels(graph):
+    assert graph.compute_levels() == LEVELS
+    assert graph.max_level == 2
+
+
+def test_add_node_adds_ancestors():
+    graph = visualization.DirectedGraph(ATOM_MAP)
+    graph.add_node(("e", "x"))
+    assert set(graph.adjaceny_list) == set(ATOM_MAP) - {("l",)}
+    assert sorted(graph.adjaceny_list[("a",)]) == [("c", "x"), ("d", "x")]
+
+
+def test_select_nodes(graph):
+    assert graph.select_nodes() == set(ATOM_MAP)
+    assert graph.select_nodes(add_loners=False) == set(ATOM_MAP) - {("l",)}
+    assert graph.select_nodes(focus=[("c", "x")]) == {("a",), ("c", "x")}
+    assert graph.select_nodes(focus=[("e", "x")], max_level=1) == {
+        ("a",),
+        ("b",),
+        ("c", "x"),
+        ("d", "x"),
+    }
+    assert graph.select_nodes(max_level=0) == {("a",), ("b",), ("l",)}
+
+
+def test_to_json(graph, tmp_path):
+    path = os.path.join(tmp_path, "graph.json")
+    graph.to_json(path)
+    with open(path) as stream:
+        data = json.load(stream)
+    assert data["level_offsets"] == [0, 3, 5, 6]
+    assert len(data["nodes"]) == len(data["colors"]) == len(ATOM_MAP)
+    assert len(data["edges"]) == 5
+    for parent, child in data["edges"]:
+        assert parent < child
+    levels = {str(f): l for f, l in LEVELS.items()}
+    offsets = data["level_offsets"]
+    for level in range(len(offsets) - 1):
+        for node in data["nodes"][offsets[level]:offsets[level + 1]]:
+            assert levels[node] == level
+
+
+def test_save_graph_falls_back_to_json(graph, tmp_path):
+    save_path = os.path.join(tmp_path, "graph.html")
+    visualization.save_graph(graph, save_path, graph.select_nodes(), max_html_nodes=3)
+    assert not os.path.exists(save_path)
+    with open(os.path.join(tmp_path, "graph.json")) as stream:
+        assert len(json.load(stream)["nodes"]) == len(ATOM_MAP)
+
+
+def test_stats_to_graph_focus(tmp_path):
+    stats_path = os.path.join(tmp_path, "stats.json")
+    with open(stats_path, "w") as stream:
+        json.dump(
+            {
+                "atom_map": [[list(f), [list(p) for p in ps]] for f, ps in ATOM_MAP.items()],
+                "last_preimage": [["e", "x"]],
+            },
+            stream,
+        )
+    json_path = os.path.join(tmp_path, "graph.json")
+    visualization.stats_to_graph(
+        stats_path,
+        os.path.join(tmp_path, "graph.html"),
+        focus=[["c", "x"]],
+        json_path=json_path,
+        max_html_nodes=0,
+    )
+    with open(json_path) as stream:
+        data = json.load(stream)
+    assert sorted(data["nodes"]) == sorted([str(("a",)), str(("c", "x"))])
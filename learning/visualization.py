@@ -1,4 +1,6 @@
 import json
+import os
+from collections import deque
 import numpy as np
 from pyvis.network import Network
 from . import oracle as ora
@@ -20,24 +22,32 @@ class DirectedGraph:
         self.max_level = 0
         self.max_children = 0
         self.verbose = verbose
+        self.levels = None
 
     def add_node(self, fact):
         """
         Adds a node and all of its parents
         """
-        if fact not in self.atom_map:
-            if self.verbose:
-                print(f"Failed to add {fact}, not in atom_map")
-            return
-        if fact in self.adjaceny_list:
-            return
-        self.adjaceny_list[fact] = []
-        parents = self.atom_map[fact]
-        for p in parents:
-            if p not in self.adjaceny_list:
-                self.add_node(p)
-            self.adjaceny_list[p].append(fact)
-            self.max_children = max(self.num_children(p), self.max_children)
+        added = []
+        stack = [fact]
+        while stack:
+            f = stack.pop()
+            if f in self.adjaceny_list:
+                continue
+            if f not in self.atom_map:
+                if self.verbose:
+                    print(f"Failed to add {f}, not in atom_map")
+                continue
+            self.adjaceny_list[f] = []
+            self.levels = None
+            added.append(f)
+            stack.extend(self.atom_map[f])
+        for f in reversed(added):
+            for p in self.atom_map[f]:
+                if p not in self.adjaceny_list:
+                    continue
+                self.adjaceny_list[p].append(f)
+                self.max_children = max(self.num_children(p), self.max_children)
 
     def num_children(self, fact):
         assert fact in self.adjaceny_list, "Fact not in this graph"
@@ -63,6 +73,62 @@ class DirectedGraph:
             self.ans_cache[fact] = ora.ancestors(fact, self.atom_map)
         return len(self.ans_cache[fact])
 
+    def compute_levels(self):
+        """
+        Compute the level of every node in one topological pass
+        (Kahn's algorithm). A node with no parents is at level 0,
+        otherwise it is one more than its deepest parent.
+        """
+        if self.levels is not None:
+            return self.levels
+        in_degree = {}
+        for fact in self.adjaceny_list:
+            in_degree[fact] = sum(
+                1 for p in self.atom_map[fact] if p in self.adjaceny_list
+            )
+        levels = {fact: 0 for fact, d in in_degree.items() if d == 0}
+        queue = deque(levels)
+        while queue:
+            fact = queue.popleft()
+            for child in self.adjaceny_list[fact]:
+                levels[child] = max(levels.get(child, 0), levels[fact] + 1)
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+        self.levels = levels
+        self.max_level = max(levels.values(), default=0)
+        return levels
+
+    def is_loner(self, fact):
+        return len(self.adjaceny_list[fact]) == 0 and len(self.atom_map[fact]) == 0
+
+    def select_nodes(self, focus=None, max_level=None, add_loners=True):
+        """
+        Return the set of nodes to render.
+
+        focus: an optional iterable of facts. If given, only these
+            facts and their ancestors are kept (ie. the preimage neighbourhood)
+        max_level: if given, drop every node deeper than this level
+        add_loners: keep nodes with no parents and no children
+        """
+        levels = self.compute_levels()
+        if focus is None:
+            nodes = set(self.adjaceny_list)
+        else:
+            nodes = set()
+            stack = [f for f in focus if f in self.adjaceny_list]
+            while stack:
+                fact = stack.pop()
+                if fact in nodes:
+                    continue
+                nodes.add(fact)
+                stack.extend(p for p in self.atom_map[fact] if p in self.adjaceny_list)
+        if max_level is not None:
+            nodes = {f for f in nodes if levels.get(f, 0) <= max_level}
+        if not add_loners:
+            nodes = {f for f in nodes if not self.is_loner(f)}
+        return nodes
+
     def fact_to_color(self, fact):
         # TODO(agro): do this better
         max_children = self.max_children
@@ -71,45 +137,84 @@ class DirectedGraph:
         r = 200*(max_children - self.num_children(fact))/max_children
         g = 0
         b = 100*(max_children - self.num_children(fact))/max_children
-        if (self.num_children(fact) == 0) and (self.num_ans(fact) == 0):
+        if self.is_loner(fact):
             r = 0
             b = 200
         color = f"rgba({r},{g},{b},1)"
         return color
 
-    def make_pyvis_net(self, net, add_loners=True, node_repulsion=True):
-        added = []
-        level_x = {}
+    def make_pyvis_net(self, net, add_loners=True, node_repulsion=True, nodes=None):
+        """
+        Add the graph to the pyvis network `net`. If `nodes` is given,
+        only those nodes (and the edges between them) are added.
+        """
+        levels = self.compute_levels()
+        if nodes is None:
+            nodes = self.select_nodes(add_loners=add_loners)
+        elif not add_loners:
+            nodes = {f for f in nodes if not self.is_loner(f)}
+        if self.verbose:
+            for fact in self.adjaceny_list:
+                if fact not in nodes:
+                    print(f"Not adding {fact} to network visualization")
         for fact in self.adjaceny_list:
-            if (len(self.adjaceny_list[fact]) == 0 and self.num_ans(fact) == 0) and not add_loners:
-                if self.verbose:
-                    print(f"Not adding {fact} to network visualization: No children")
+            if fact not in nodes:
+                continue
+            net.add_node(
+                str(fact),
+                label=str(fact),
+                level=levels.get(fact, 0),
+                physics=node_repulsion,
+                shape="box",
+                color=self.fact_to_color(fact),
+            )
+        for fact in self.adjaceny_list:
+            if fact not in nodes:
                 continue
-            if fact not in added:
-                # print(str(fact))
-                level = self.num_ans(fact)
-                net.add_node(
-                    str(fact),
-                    label=str(fact),
-                    level=level,
-                    physics=node_repulsion,
-                    shape="box",
-                    color=self.fact_to_color(fact),
-                )
-                added.append(fact)
             for child in self.adjaceny_list[fact]:
-                if child not in added:
-                    added.append(fact)
-                    level = self.num_ans(child)
-                    net.add_node(
-                        str(child),
-                        label=str(child),
-                        level=level,
-                        physics=node_repulsion,
-                        shape="box",
-                        color = self.fact_to_color(child),
-                    )
-                net.add_edge(str(fact), str(child), physics=False)
+                if child in nodes:
+                    net.add_edge(str(fact), str(child), physics=False)
+
+    def to_json(self, save_path, nodes=None):
+        """
+        Save the graph in a compact json format that a static viewer can
+        load lazily:
+        {
+            "nodes": [<fact_string>, ...],  # sorted by level
+            "colors": [<rgba_string>, ...],
+            "level_offsets": [0, n_0, n_0 + n_1, ...],
+            "edges": [[<parent_index>, <child_index>], ...],
+        }
+        The nodes of level l are nodes[level_offsets[l]:level_offsets[l + 1]],
+        and every edge points to a node of a deeper level, so a viewer can
+        stop reading at any level.
+        """
+        levels = self.compute_levels()
+        if nodes is None:
+            nodes = set(self.adjaceny_list)
+        order = sorted(
+            (f for f in self.adjaceny_list if f in nodes), key=lambda f: levels.get(f, 0)
+        )
+        index = {fact: i for i, fact in enumerate(order)}
+        level_offsets = [0]
+        for i, fact in enumerate(order):
+            while len(level_offsets) <= levels.get(fact, 0):
+                level_offsets.append(i)
+        level_offsets.append(len(order))
+        edges = sorted(
+            (index[fact], index[child])
+            for fact in order
+            for child in self.adjaceny_list[fact]
+            if child in index
+        )
+        data = {
+            "nodes": [str(f) for f in order],
+            "colors": [self.fact_to_color(f) for f in order],
+            "level_offsets": level_offsets,
+            "edges": [list(e) for e in edges],
+        }
+        with open(save_path, "w") as stream:
+            json.dump(data, stream, separators=(",", ":"))
 
 
 def ancestors(fact, atom_map):
@@ -140,17 +245,16 @@ def tuplize_preimage(preimage):
         res.append(tuple(f))
     return res
 
-def visualize_atom_map(atom_map, save_path):
+MAX_HTML_NODES = 2000
+
+
+def make_hierarchy_net():
     net = Network(
         directed=True, width="100%", height="100%", layout="hierarchy", font_color="white"
     )
     net.repulsion(
         node_distance=300, spring_strength=0, spring_length=400, central_gravity=0
     )
-    graph = DirectedGraph(atom_map, verbose = False)
-    for fact in atom_map:
-        graph.add_node(fact)
-    graph.make_pyvis_net(net)
     net.set_options(
         """
         var options = {
@@ -164,46 +268,80 @@ def visualize_atom_map(atom_map, save_path):
         }
         """ 
     )
+    return net
+
+
+def save_graph(graph, save_path, nodes, json_path=None, max_html_nodes=MAX_HTML_NODES):
+    """
+    Save `nodes` of `graph` as a pyvis html file at `save_path`.
+    If there are more than `max_html_nodes` nodes, the html page
+    would be unusable, so only the json graph is written (to `json_path`,
+    or next to `save_path` if it is not given).
+    """
+    if max_html_nodes is not None and len(nodes) > max_html_nodes:
+        if json_path is None:
+            json_path = os.path.splitext(save_path)[0] + ".json"
+        print(
+            f"Graph has {len(nodes)} nodes (> {max_html_nodes}), "
+            f"saving json graph to {json_path} instead of html"
+        )
+        graph.to_json(json_path, nodes=nodes)
+        return
+    if json_path is not None:
+        graph.to_json(json_path, nodes=nodes)
+    net = make_hierarchy_net()
+    graph.make_pyvis_net(net, nodes=nodes)
     # net.show(name = "graph.html")
     #net.show_buttons(filter_ = ["layout"])
     net.save_graph(save_path)
 
 
-def stats_to_graph(path_to_stats, save_path, verbose = False):
+def visualize_atom_map(
+    atom_map,
+    save_path,
+    focus=None,
+    max_level=None,
+    json_path=None,
+    max_html_nodes=MAX_HTML_NODES,
+):
+    graph = DirectedGraph(atom_map, verbose = False)
+    for fact in atom_map:
+        graph.add_node(fact)
+    nodes = graph.select_nodes(focus=focus, max_level=max_level)
+    save_graph(graph, save_path, nodes, json_path=json_path, max_html_nodes=max_html_nodes)
+
+
+def stats_to_graph(
+    path_to_stats,
+    save_path,
+    verbose = False,
+    focus=None,
+    max_level=None,
+    json_path=None,
+    max_html_nodes=MAX_HTML_NODES,
+):
     """
     Given the path to the `stats.json` file for
     a particular trial, create the graph for that
     run and save it at `save_path`
+
+    focus: only render these facts and their ancestors
+    max_level: only render facts up to this level
+    json_path: also save the compact json graph (see DirectedGraph.to_json)
+    max_html_nodes: above this many nodes only the json graph is saved
     """
     stream = open(path_to_stats)
     data = json.load(stream)
     stream.close()
-    net = Network(directed=True, width="100%", height="100%", layout="hierarchy", font_color="white")
-    net.repulsion(
-        node_distance=300, spring_strength=0, spring_length=400, central_gravity=0
-    )
     last_preimage = tuplize_preimage(data["last_preimage"])
     atom_map = tuplize_atom_map(data["atom_map"])
     graph = DirectedGraph(atom_map, verbose = verbose)
     for fact in last_preimage:
         graph.add_node(fact)
-    graph.make_pyvis_net(net)
-    net.set_options(
-        """
-        var options = {
-            "layout": {
-                "hierarchical": {
-                "enabled": true,
-                "nodeSpacing": 250,
-                "treeSpacing": 225
-                }
-            }
-        }
-        """ 
-    )
-    # net.show(name = "graph.html")
-    #net.show_buttons(filter_ = ["layout"])
-    net.save_graph(save_path)
+    if focus is not None:
+        focus = tuplize_preimage(focus)
+    nodes = graph.select_nodes(focus=focus, max_level=max_level)
+    save_graph(graph, save_path, nodes, json_path=json_path, max_html_nodes=max_html_nodes)
 
 
 def plot_simple_graph(nodes, edges, save_path, edge_names = None, levels = None):
@@ -4,6 +4,18 @@ from .panda_hand_position_controller import *
 from .planning_utils import *
 from .plan_to_trajectory import *
 from .trajectory_director import *
+from .clearance import *
+from .collision_checking import *
+from .path_smoothing import *
+from .roadmap import *
+from .planner_racing import *
+from .ik_executor import *
+from .stream_executor import *
 from .stream_utils import *
+from .motion_cache import *
+from .ik_seeds import *
+from .shape_analysis import *
+from .ik_templates import *
+from .reachability import *
 from .grasping_and_placing import *
 from .utils import *
@@ -0,0 +1,260 @@
+"""
+This module contains a fast, approximate clearance computation for a panda
+arm: the static geometry in a station is precomputed into a voxel grid of
+signed distances, and the arm (with anything it holds) is approximated by
+spheres, so that the clearance of a configuration is a vectorized lookup.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from pydrake.all import Box, BodyIndex, Capsule, Convex, Cylinder, HalfSpace, Mesh, Sphere
+
+# clearance fields are kept for the most recent scenes
+MAX_FIELDS = 8
+FIELDS = OrderedDict()
+
+
+def arm_bodies(plant, panda):
+    """
+    Return the bodies that move with the arm `panda`: its links, and
+    everything welded to its hand (fingers, held objects)
+    """
+    # the base of the arm is welded to the world, like all the static geometry
+    anchored = set(body.index() for body in plant.GetBodiesWeldedTo(plant.world_body()))
+    bodies = {}
+    for i in plant.GetBodyIndices(panda):
+        if i in anchored:
+            continue
+        for welded in plant.GetBodiesWeldedTo(plant.get_body(i)):
+            bodies[welded.index()] = welded
+    return list(bodies.values())
+
+
+def arm_geometry_ids(plant, panda):
+    return set(
+        geom_id
+        for body in arm_bodies(plant, panda)
+        for geom_id in plant.GetCollisionGeometriesForBody(body)
+    )
+
+
+def mesh_vertices(shape):
+    """
+    Read the vertices of a Mesh or Convex shape from its .obj file
+    """
+    vertices = []
+    with open(shape.filename(), "r") as stream:
+        for line in stream:
+            if line.startswith("v "):
+                vertices.append([float(v) for v in line.split()[1:4]])
+    return np.array(vertices) * shape.scale()
+
+
+def shape_bounds(shape):
+    """
+    Return the axis aligned bounds (lower, upper) of shape in its own frame,
+    or None if the shape is not supported
+    """
+    if isinstance(shape, Box):
+        half = np.array([shape.width(), shape.depth(), shape.height()]) / 2
+    elif isinstance(shape, Cylinder):
+        half = np.array([shape.radius(), shape.radius(), shape.length() / 2])
+    elif isinstance(shape, Capsule):
+        half = np.array([shape.radius(), shape.radius(), shape.length() / 2 + shape.radius()])
+    elif isinstance(shape, Sphere):
+        half = np.full(3, shape.radius())
+    elif isinstance(shape, (Mesh, Convex)):
+        vertices = mesh_vertices(shape)
+        return vertices.min(axis=0), vertices.max(axis=0)
+    else:
+        return None
+    return -half, half
+
+
+def signed_distance(shape, points):
+    """
+    Signed distance from points (N, 3), expressed in the frame of shape, to
+    shape. Returns (distances, exact) where exact is False if the distances
+    are only lower bounds (meshes are replaced by their bounding box)
+    """
+    if isinstance(shape, Sphere):
+        return np.linalg.norm(points, axis=1) - shape.radius(), True
+    if isinstance(shape, HalfSpace):
+        return points[:, 2], True
+    if isinstance(shape, Cylinder):
+        d = np.stack(
+            (
+                np.linalg.norm(points[:, :2], axis=1) - shape.radius(),
+                np.abs(points[:, 2]) - shape.length() / 2,
+            ),
+            axis=1,
+        )
+        outside = np.linalg.norm(np.maximum(d, 0), axis=1)
+        return outside + np.minimum(d.max(axis=1), 0), True
+    if isinstance(shape, Capsule):
+        closest = np.zeros_like(points)
+        closest[:, 2] = np.clip(points[:, 2], -shape.length() / 2, shape.length() / 2)
+        return np.linalg.norm(points - closest, axis=1) - shape.radius(), True
+    bounds = shape_bounds(shape)
+    assert bounds is not None, f"Unsupported shape {type(shape)}"
+    lower, upper = bounds
+    center, half = (lower + upper) / 2, (upper - lower) / 2
+    d = np.abs(points - center) - half
+    outside = np.linalg.norm(np.maximum(d, 0), axis=1)
+    return outside + np.minimum(d.max(axis=1), 0), isinstance(shape, Box)
+
+
+def covering_spheres(shape, max_spheres=4):
+    """
+    Return (centers, radii) of spheres, in the frame of shape,
+    that together contain shape
+    """
+    if isinstance(shape, Sphere):
+        return np.zeros((1, 3)), np.array([shape.radius()])
+    lower, upper = shape_bounds(shape)
+    extent = upper - lower
+    axis = np.argmax(extent)
+    n = int(np.clip(np.ceil(extent[axis] / max(np.min(extent), 1e-3)), 1, max_spheres))
+    slab = extent.copy()
+    slab[axis] /= n
+    centers = np.repeat(((lower + upper) / 2)[None], n, axis=0)
+    centers[:, axis] = lower[axis] + slab[axis] * (np.arange(n) + 0.5)
+    return centers, np.full(n, np.linalg.norm(slab) / 2)
+
+
+class ClearanceField:
+    """
+    Approximate clearance between a panda arm (and anything welded to its
+    hand) and the rest of a station, in the station's current state.
+    """
+
+    def __init__(self, station, station_context, panda, resolution=0.03, reach=1.2):
+        """
+        Construct a ClearanceField
+
+        Args:
+            station: PandaStation
+            station_context: the Context for station
+            panda: the panda model instance
+            resolution: the voxel size (m) of the signed distance grid
+            reach: the grid covers the box within `reach` (m) of the arm's base
+        """
+        self.plant, scene_graph = station.get_plant_and_scene_graph()
+        self.plant_context = station.GetSubsystemContext(self.plant, station_context)
+        self.panda = panda
+        self.resolution = resolution
+        inspector = scene_graph.model_inspector()
+
+        self.bodies = arm_bodies(self.plant, panda)
+        self.sphere_centers, self.sphere_radii = [], []
+        # whether each sphere's center is known to be inside the arm's
+        # geometry (the centers of the covering spheres of a mesh may not be)
+        inside = []
+        for body in self.bodies:
+            centers, radii = [], []
+            for geom_id in self.plant.GetCollisionGeometriesForBody(body):
+                shape = inspector.GetShape(geom_id)
+                c, r = covering_spheres(shape)
+                X_BG = inspector.GetPoseInFrame(geom_id)
+                centers.append((X_BG.rotation().matrix() @ c.T).T + X_BG.translation())
+                radii.append(r)
+                inside.append(np.full(len(r), isinstance(shape, (Box, Cylinder, Sphere))))
+            self.sphere_centers.append(np.vstack(centers) if centers else np.empty((0, 3)))
+            self.sphere_radii.append(np.concatenate(radii) if radii else np.empty(0))
+        self.radii = np.concatenate(self.sphere_radii)
+        self.inside = np.concatenate(inside) if inside else np.empty(0, dtype=bool)
+
+        # objects left out of collision queries are left out of the field
+        ignored_ids = arm_geometry_ids(self.plant, panda) | station.get_inactive_geometry_ids(
+            station_context
+        )
+        base = self.plant.EvalBodyPoseInWorld(
+            self.plant_context, self.plant.get_body(self.plant.GetBodyIndices(panda)[0])
+        ).translation()
+        self.origin = base - reach
+        axes = [np.arange(lo, lo + 2 * reach + resolution, resolution) for lo in self.origin]
+        self.shape = tuple(len(a) for a in axes)
+        points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        self.field = np.full(len(points), np.inf)
+        self.exact = True
+        for i in range(self.plant.num_bodies()):
+            body = self.plant.get_body(BodyIndex(i))
+            X_WB = self.plant.EvalBodyPoseInWorld(self.plant_context, body)
+            for geom_id in self.plant.GetCollisionGeometriesForBody(body):
+                if geom_id in ignored_ids:
+                    continue
+                X_WG = X_WB.multiply(inspector.GetPoseInFrame(geom_id))
+                R = X_WG.rotation().matrix()
+                points_G = (points - X_WG.translation()) @ R
+                d, exact = signed_distance(inspector.GetShape(geom_id), points_G)
+                self.field = np.minimum(self.field, d)
+                self.exact = self.exact and exact
+        self.field = self.field.reshape(self.shape)
+        # nearest voxel lookups of a 1-Lipschitz function are off by at most this
+        self.error = np.sqrt(3) * resolution / 2
+
+    def spheres_in_world(self, q):
+        self.plant.SetPositions(self.plant_context, self.panda, q)
+        centers = []
+        for body, c in zip(self.bodies, self.sphere_centers):
+            X_WB = self.plant.EvalBodyPoseInWorld(self.plant_context, body)
+            centers.append((X_WB.rotation().matrix() @ c.T).T + X_WB.translation())
+        return np.vstack(centers)
+
+    def clearance_bounds(self, q):
+        """
+        Returns (lower, upper) bounds on the clearance between the arm in
+        configuration q and the rest of the station
+        (upper is inf if it cannot be bounded)
+        """
+        centers = self.spheres_in_world(q)
+        index = np.round((centers - self.origin) / self.resolution).astype(int)
+        if np.any(index < 0) or np.any(index >= self.shape):
+            return -np.inf, np.inf
+        d = self.field[index[:, 0], index[:, 1], index[:, 2]]
+        lower = np.min(d - self.radii) - self.error
+        # the arm is no further from the environment than any
+        # point inside it
+        upper = np.inf
+        if self.exact and np.any(self.inside):
+            upper = np.min(d[self.inside]) + self.error
+        return lower, upper
+
+
+def scene_fingerprint(plant, plant_context, panda, resolution=1e-4):
+    """
+    Quantized world poses of all bodies that do not move with the arm
+    """
+    arm = set(body.index() for body in arm_bodies(plant, panda))
+    poses = []
+    for i in range(plant.num_bodies()):
+        body = plant.get_body(BodyIndex(i))
+        if body.index() in arm:
+            continue
+        X = plant.EvalBodyPoseInWorld(plant_context, body).GetAsMatrix4()
+        poses.append(tuple(np.round(X / resolution).astype(int).flatten()))
+    return tuple(poses)
+
+
+def get_clearance_field(station, station_context, panda, **kwargs):
+    """
+    Return the ClearanceField for the panda in the station's current
+    state, reusing it if the scene has not changed.
+    kwargs are passed to ClearanceField on construction
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    key = (
+        id(station),
+        int(panda),
+        station.get_inactive_objects(station_context),
+        scene_fingerprint(plant, plant_context, panda),
+    )
+    if key in FIELDS:
+        FIELDS.move_to_end(key)
+        return FIELDS[key]
+    field = ClearanceField(station, station_context, panda, **kwargs)
+    FIELDS[key] = field
+    while len(FIELDS) > MAX_FIELDS:
+        FIELDS.popitem(last=False)
+    return field
@@ -0,0 +1,347 @@
+"""
+This module contains the collision checking used by the motion planner.
+Whole motion segments are validated in one call to drake
+(SceneGraphCollisionChecker) where possible, instead of one
+python callback per interpolated state.
+"""
+import threading
+import weakref
+
+import numpy as np
+from ompl import base as ob
+
+try:
+    from pydrake.planning import SceneGraphCollisionChecker
+except ImportError:
+    # older drake, every check goes through CollisionChecker.query_object
+    SceneGraphCollisionChecker = None
+
+from .clearance import arm_geometry_ids, get_clearance_field
+
+NUM_Q = 7
+# motion validation resolution, as a fraction of the joint space extent
+RESOLUTION = 0.005
+# {station: {panda: NativeChecker or None}} (see get_native_checker)
+NATIVE_CHECKERS = weakref.WeakKeyDictionary()
+NATIVE_CHECKERS_LOCK = threading.Lock()
+
+
+def state_to_q(state):
+    """
+    Parses ompl RealVectorStateSpae::StateType into a numpy array
+    """
+    return np.array([state[i] for i in range(NUM_Q)])
+
+
+def bisection_order(n):
+    """
+    Return the indices 0, ..., n - 1 in the order they would be visited
+    by recursively bisecting the segment (coarse to fine),
+    so that collisions are found early
+    """
+    indices = np.arange(1, n + 1)
+    # the lowest set bit of each index is its "level" in the bisection
+    return np.argsort(-(indices & -indices), kind="stable")
+
+
+class NativeChecker:
+    """
+    A drake SceneGraphCollisionChecker for a panda arm, on a copy of
+    a PandaStation's plant (see PandaStation.make_robot_diagram).
+    Each station context gets its own model context, which `sync`
+    brings up to date with it.
+    """
+
+    def __init__(self, station, panda):
+        diagram, self.mirror = station.make_robot_diagram()
+        num_positions = diagram.plant().num_positions()
+        assert num_positions == station.get_multibody_plant().num_positions()
+        panda_name = next(
+            name for name, info in station.panda_infos.items() if info.panda == panda
+        )
+        info = self.mirror.panda_infos[panda_name]
+        # anything welded to the hand (e.g. the held object in a holding
+        # station) moves with the arm, so it is checked as part of it
+        self.checker = SceneGraphCollisionChecker(
+            model=diagram,
+            robot_model_instances=[info.panda, info.hand],
+            distance_function_weights=np.ones(num_positions),
+            edge_step_size=RESOLUTION,
+        )
+        self.plant = self.checker.plant()
+        self.scene_graph = self.checker.model().scene_graph()
+        # {station_context: [model context, {name: 4x4 X_PO}, (inactive names, filter_id)]}
+        self.model_contexts = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def sync(self, station, station_context):
+        """
+        Return the model context mirroring station_context: the poses of
+        the welded objects and the inactive objects. The positions are
+        given with each check
+        """
+        with self.lock:
+            entry = self.model_contexts.get(station_context)
+            if entry is None:
+                entry = [self.checker.MakeStandaloneModelContext(), {}, (frozenset(), None)]
+                self.model_contexts[station_context] = entry
+        model_context, poses, (inactive, filter_id) = entry
+        plant_context = station.GetSubsystemContext(
+            station.get_multibody_plant(), station_context
+        )
+        for name, (object_info, _) in station.object_infos.items():
+            frame = object_info.get_frame()
+            if frame is None:
+                continue
+            X_PO = frame.CalcPoseInBodyFrame(plant_context)
+            X = X_PO.GetAsMatrix4()
+            if name in poses and np.array_equal(poses[name], X):
+                continue
+            self.mirror.object_infos[name][0].get_frame().SetPoseInBodyFrame(
+                model_context.plant_context(), X_PO
+            )
+            poses[name] = X
+        names = station.get_inactive_objects(station_context)
+        if names != inactive:
+            manager = self.scene_graph.collision_filter_manager(
+                model_context.scene_graph_context()
+            )
+            if filter_id is not None:
+                manager.RemoveDeclaration(filter_id)
+                filter_id = None
+            if len(names) > 0:
+                filter_id = manager.ApplyTransient(self.mirror.inactive_declaration(names)[1])
+            entry[2] = (names, filter_id)
+        return model_context
+
+    def set_step(self, step):
+        if self.checker.edge_step_size() != step:
+            self.checker.set_edge_step_size(step)
+
+    def is_valid(self, model_context, q):
+        return self.checker.CheckContextConfigCollisionFree(model_context, q)
+
+    def is_valid_motion(self, model_context, q1, q2):
+        return self.checker.CheckContextEdgeCollisionFree(model_context, q1, q2)
+
+
+def get_native_checker(station, panda):
+    """
+    Return the NativeChecker for the panda in station (made once per
+    station and panda), or None if drake can not check it natively
+    """
+    if SceneGraphCollisionChecker is None or station.make_robot_diagram is None:
+        return None
+    with NATIVE_CHECKERS_LOCK:
+        checkers = NATIVE_CHECKERS.setdefault(station, {})
+        key = int(panda)
+        if key not in checkers:
+            checkers[key] = NativeChecker(station, panda)
+        return checkers[key]
+
+
+class CollisionChecker:
+    """
+    Checks configurations and straight line motions of a panda arm
+    in a PandaStation for collisions.
+    """
+
+    def __init__(
+        self,
+        station,
+        station_context,
+        panda=None,
+        ignore_qs=(),
+        use_min_clearance=None,
+    ):
+        """
+        Construct a CollisionChecker
+
+        Args:
+            station: PandaStation
+            station_context: the Context for station
+            panda: the panda model instance (defaults to station.get_panda())
+            ignore_qs: configurations that are always considered valid
+            (for ignoring endpoint collisions)
+            use_min_clearance: if not None, a configuration is valid iff its
+            clearance is less than use_min_clearance
+        """
+        self.station = station
+        self.station_context = station_context
+        self.plant, scene_graph = station.get_plant_and_scene_graph()
+        self.plant_context = station.GetSubsystemContext(self.plant, station_context)
+        self.scene_graph_context = station.GetSubsystemContext(
+            scene_graph, station_context
+        )
+        self.panda = station.get_panda() if panda is None else panda
+        self.query_output_port = scene_graph.GetOutputPort("query")
+        self.ignore_qs = [np.asarray(q) for q in ignore_qs]
+        self.use_min_clearance = use_min_clearance
+        self.num_checks = 0
+        self.num_exact_clearances = 0
+        # objects held in this context move with the arms (see PandaStation.hold)
+        self.held_objects = station.get_held_objects(station_context)
+        if use_min_clearance is not None:
+            self.arm_ids = arm_geometry_ids(self.plant, self.panda)
+            for panda_name, (name, _) in self.held_objects.items():
+                if station.panda_infos[panda_name].panda == self.panda:
+                    object_info = station.object_infos[name][0]
+                    for body_info in object_info.get_body_infos().values():
+                        self.arm_ids.update(self.plant.GetCollisionGeometriesForBody(body_info.get_body()))
+            # the clearance field treats everything not welded to the arm as static
+            self.field = None
+            if len(self.held_objects) == 0:
+                self.field = get_clearance_field(station, station_context, self.panda)
+        # configurations are checked by drake, on a copy of station_context
+        # as it is now, unless the held objects have to follow the arm in
+        # python, or clearances are needed
+        self.native = None
+        if use_min_clearance is None and len(self.held_objects) == 0:
+            self.native = get_native_checker(station, self.panda)
+        if self.native is not None:
+            self.model_context = self.native.sync(station, station_context)
+            self.q_base = self.plant.GetPositions(self.plant_context)
+
+    def full_q(self, q):
+        """
+        The positions of the whole plant with the panda in configuration q
+        """
+        res = self.q_base.copy()
+        self.plant.SetPositionsInArray(self.panda, q, res)
+        return res
+
+    def is_ignored(self, q):
+        return any(np.array_equal(q, q_ignore) for q_ignore in self.ignore_qs)
+
+    def query_object(self, q):
+        self.plant.SetPositions(self.plant_context, self.panda, q)
+        if self.held_objects:
+            self.station.update_held_objects(self.station_context)
+        return self.query_output_port.Eval(self.scene_graph_context)
+
+    def clearance(self, q):
+        """
+        Compute min clearance between the arm (and anything it holds) and
+        the rest of the station if the arm is in configuration `q`
+        """
+        self.num_exact_clearances += 1
+        sdps = self.query_object(q).ComputeSignedDistancePairwiseClosestPoints(1.0)
+        min_dist = np.inf
+        for sdp in sdps:
+            if (sdp.id_A in self.arm_ids) != (sdp.id_B in self.arm_ids):
+                min_dist = min(sdp.distance, min_dist)
+        return min_dist
+
+    def is_clear(self, q):
+        """
+        Check if the clearance at q is less than use_min_clearance,
+        only computing it exactly if the clearance field can not tell
+        """
+        if self.field is None:
+            return self.clearance(q) < self.use_min_clearance
+        lower, upper = self.field.clearance_bounds(q)
+        if lower >= self.use_min_clearance:
+            return False
+        if upper < self.use_min_clearance:
+            return True
+        return self.clearance(q) < self.use_min_clearance
+
+    def is_valid(self, q):
+        """
+        Check if the configuration q (np.array) is valid
+        """
+        if self.is_ignored(q):
+            return True
+        self.num_checks += 1
+        if self.use_min_clearance is not None:
+            return self.is_clear(q)
+        if self.native is not None:
+            return self.native.is_valid(self.model_context, self.full_q(q))
+        return not self.query_object(q).HasCollisions()
+
+    def interpolate(self, q1, q2, step):
+        """
+        Return the configurations (excluding q1, including q2) on the line
+        from q1 to q2 spaced at most `step` apart
+        """
+        n = max(1, int(np.ceil(np.linalg.norm(q2 - q1) / step)))
+        t = np.arange(1, n + 1) / n
+        qs = q1 + t[:, None] * (q2 - q1)
+        qs[-1] = q2
+        return t, qs
+
+    def first_collision(self, q1, q2, step):
+        """
+        Check the straight line motion from q1 to q2 (q1 is assumed valid).
+        Returns None if the motion is valid, otherwise the interpolation
+        parameter in (0, 1] of the first invalid configuration found
+        """
+        t, qs = self.interpolate(q1, q2, step)
+        if not self.is_valid(qs[-1]):
+            return t[-1]
+        for i in bisection_order(len(qs) - 1):
+            if not self.is_valid(qs[i]):
+                return t[i]
+        return None
+
+    def is_valid_motion(self, q1, q2, step):
+        """
+        Check the straight line motion from q1 to q2 (q1 is assumed valid),
+        in one call to drake if possible
+        """
+        if self.native is None or self.is_ignored(q1) or self.is_ignored(q2):
+            return self.first_collision(q1, q2, step) is None
+        self.native.set_step(step)
+        return self.native.is_valid_motion(
+            self.model_context, self.full_q(q1), self.full_q(q2)
+        )
+
+    def last_valid(self, q1, q2, step):
+        """
+        Return the interpolation parameter in [0, 1] of the last valid
+        configuration on the line from q1 to q2 (q1 is assumed valid)
+        """
+        t, qs = self.interpolate(q1, q2, step)
+        for i in range(len(qs)):
+            if not self.is_valid(qs[i]):
+                return t[i - 1] if i > 0 else 0.0
+        return 1.0
+
+    def is_valid_path(self, qs, step):
+        """
+        Check the piecewise linear path through the configurations `qs`
+        """
+        if not self.is_valid(qs[0]):
+            return False
+        return all(
+            self.is_valid_motion(q1, q2, step)
+            for q1, q2 in zip(qs[:-1], qs[1:])
+        )
+
+
+class BatchMotionValidator(ob.MotionValidator):
+    """
+    OMPL MotionValidator that checks a whole motion with a CollisionChecker
+    """
+
+    def __init__(self, si, checker):
+        super().__init__(si)
+        self.si = si
+        self.checker = checker
+
+    def step(self):
+        space = self.si.getStateSpace()
+        return self.si.getStateValidityCheckingResolution() * space.getMaximumExtent()
+
+    def checkMotion(self, s1, s2, last_valid=None):
+        q1, q2 = state_to_q(s1), state_to_q(s2)
+        if self.checker.is_valid_motion(q1, q2, self.step()):
+            return True
+        if last_valid is None:
+            return False
+        # only the invalid motions are walked in python, to find where
+        t = self.checker.last_valid(q1, q2, self.step())
+        if last_valid.first is not None:
+            self.si.getStateSpace().interpolate(s1, s2, t, last_valid.first)
+        last_valid.second = t
+        return False
@@ -9,13 +9,14 @@ import numpy as np
 from numpy import random
 from pydrake.all import (
     Solve,
-    InverseKinematics,
     Box,
     Cylinder,
     Sphere,
     RotationMatrix,
     RigidTransform,
 )
+from .ik_seeds import ik_seed, learn_ik_solution
+from .ik_templates import ik_program
 from .utils import *
 
 NUM_Q = 7  # DOF of panda arm
@@ -26,6 +27,8 @@ FINGER_WIDTH = 0.017
 HAND_HEIGHT = 0.1
 COL_MARGIN = 0.001  # acceptable margin of error for collisions
 CONSIDER_MARGIN = 0.1
+# the minimum distance constraint of the IK templates
+MIN_DISTANCE = (COL_MARGIN, CONSIDER_MARGIN)
 GRASP_MARGIN = 0.006  # margin for grasp planning
 Q_NOMINAL = np.array([0.0, 0.55, 0.0, -1.45, 0.0, 1.58, 0.0])
 HAND_FRAME_NAME = "panda_hand"
@@ -58,11 +61,35 @@ def check_specs(plant, q_nominal, initial_guess):
     """
     Ensures that plant has the correct number of positions,
     q_nominal is the right length,
-    and initial_guess is the right length
+    and initial_guess is the right length (or None)
     """
     assert NUM_Q == plant.num_positions(), "Too many positions in the plant"
     assert NUM_Q == len(q_nominal), "incorret length of q_nominal"
-    assert NUM_Q == len(initial_guess), "incorret length of initial_guess"
+    assert initial_guess is None or NUM_Q == len(initial_guess), "incorret length of initial_guess"
+
+
+def station_panda_info(station, panda_info=None):
+    """
+    Returns panda_info, or if it is None the PandaInfo of
+    the arm station.get_panda()
+    """
+    if panda_info is not None:
+        return panda_info
+    panda = station.get_panda()
+    return [info for info in station.panda_infos.values() if info.panda == panda][0]
+
+
+def seed_above(station, station_context, p_W, initial_guess, panda_info=None):
+    """
+    Returns initial_guess if it is given, otherwise the IK seed
+    (see ik_seeds) for the hand of panda_info (defaults to the arm
+    station.get_panda()) pointing down at the point p_W
+    """
+    if initial_guess is not None:
+        return initial_guess
+    panda_info = station_panda_info(station, panda_info)
+    X_WH = RigidTransform(RotationMatrix.MakeXRotation(np.pi), p_W + [0, 0, HAND_HEIGHT])
+    return ik_seed(station, station_context, panda_info, X_WH, Q_NOMINAL)
 
 
 def box_dim_from_axis(axis, box):
@@ -122,121 +149,72 @@ def is_placeable(holding_shape_info):
     return True
 
 
-def add_deviation_from_point_cost(prog, q, shape_info, p_WB, plant, weight=1):
+def add_deviation_from_point_cost(ik, shape_info, p_WB, weight=1):
     """
     Add a cost for the deviation of the base li of the placed object
     (shape_info) from the point p_WB
 
     Note if p_WB is of length 2, it is treated as a 2D point (x,y)
     """
-    plant_ad = plant.ToAutoDiffXd()
-    plant_context_ad = plant_ad.CreateDefaultContext()
+    n = len(p_WB)
+    C = np.zeros((3, 3))
+    C[:n, :n] = weight * np.identity(n)
+    p_WP = np.zeros(3)
+    p_WP[:n] = p_WB
+    ik.AddPositionCost(ik.plant.world_frame(), p_WP, shape_info.offset_frame, np.zeros(3), C)
 
-    def deviation_from_point_cost(q):
-        plant_ad.SetPositions(plant_context_ad, q)
-        G = plant_ad.GetFrameByName(shape_info.offset_frame.name())
-        X_WG = G.CalcPoseInWorld(plant_context_ad)
-        p_WG = X_WG.translation()[: len(p_WB)]
-        return (p_WB - p_WG).dot(p_WB - p_WG)
 
-    cost = lambda q: weight * deviation_from_point_cost(q)
-    prog.AddCost(cost, q)
-
-
-def add_deviation_from_vertical_cost(prog, q, plant, weight=1):
+def add_deviation_from_vertical_cost(ik, weight=1):
     """
     Add a cost for the deviation of the z axis in the gripper frame
     from the -z axis in the world frame
     """
-    plant_ad = plant.ToAutoDiffXd()
-    plant_context_ad = plant_ad.CreateDefaultContext()
-
-    def deviation_from_vertical_cost(q):
-        plant_ad.SetPositions(plant_context_ad, q)
-        hand_frame = plant_ad.GetFrameByName(HAND_FRAME_NAME)
-        X_WH = hand_frame.CalcPoseInWorld(plant_context_ad)
-        R_WH = X_WH.rotation()
-        z_H = R_WH.matrix().dot(np.array([0, 0, 1]))  # extract the z direction
-        return z_H.dot(np.array([0, 0, 1]))
-
-    cost = lambda q: weight * deviation_from_vertical_cost(q)
-    prog.AddCost(cost, q)
+    hand_frame = ik.plant.GetFrameByName(HAND_FRAME_NAME)
+    # weight * (1 - cos(angle)) = weight * (1 + z_H . z_W)
+    ik.AddAngleBetweenVectorsCost(
+        ik.plant.world_frame(), [0, 0, -1], hand_frame, [0, 0, 1], weight
+    )
 
 
-def add_theta_cost(prog, q, shape_info, v, theta, plant, weight=1):
+def add_theta_cost(ik, shape_info, v, theta, weight=1):
     """
     Add a cost for the angular deviation of the vector `v`
     in the shape of the frame from the vector given by
     x_hat * cos(theta) + y_hat *sin(theta) in the world
     frame
     """
-    plant_ad = plant.ToAutoDiffXd()
-    plant_context_ad = plant_ad.CreateDefaultContext()
     vd_W = np.array([np.cos(theta), np.sin(theta), 0])
-
-    def theta_cost(q):
-        plant_ad.SetPositions(plant_context_ad, q)
-        G = plant_ad.GetFrameByName(shape_info.offset_frame.name())
-        X_WG = G.CalcPoseInWorld(plant_context_ad)
-        v_W = X_WG.rotation().matrix().dot(v)
-        return v_W.dot(vd_W)
-
-    cost = lambda q: weight * theta_cost(q)
-    prog.AddCost(cost, q)
+    # weight * (1 - cos(angle to -vd_W)) = weight * (1 + v_W . vd_W) for a unit v
+    ik.AddAngleBetweenVectorsCost(ik.plant.world_frame(), -vd_W, shape_info.offset_frame, v, weight)
 
 
 # TODO(ben): geometric center -> mass center
-def add_deviation_from_box_center_cost(prog, q, plant, p_WC, weight=1):
+def add_deviation_from_box_center_cost(ik, p_WC, weight=1):
     """
     Add a cost for the deviation of the y axis of the gripper
     (axis connecting fingers) from the box center
     """
-    plant_ad = plant.ToAutoDiffXd()
-    plant_context_ad = plant_ad.CreateDefaultContext()
-
-    def deviation_from_box_center_cost(q):
-        plant_ad.SetPositions(plant_context_ad, q)
-        hand_frame = plant_ad.GetFrameByName("panda_hand")
-        # C: center of box
-        # H: hand frame
-        # W: world frame
-        # M: point in between fingers
-        X_WH = hand_frame.CalcPoseInWorld(plant_context_ad)
-        R_WH = X_WH.rotation()
-        p_WH = X_WH.translation()
-        p_HM_H = np.array([0, 0, 0.1])
-        p_WM = p_WH + R_WH.multiply(p_HM_H)
-        # we do not care about z (as much?) TODO(ben): look into this
-        return ((p_WM - p_WC)[:-1]).dot((p_WM - p_WC)[:-1])
-
-    cost = lambda q: weight * deviation_from_box_center_cost(q)
-    prog.AddCost(cost, q)
-
-
-def add_deviation_from_cylinder_middle_cost(prog, q, plant, G, weight=1):
+    # C: center of box
+    # H: hand frame
+    # W: world frame
+    # M: point in between fingers
+    hand_frame = ik.plant.GetFrameByName(HAND_FRAME_NAME)
+    p_HM_H = np.array([0, 0, 0.1])
+    # we do not care about z (as much?) TODO(ben): look into this
+    C = weight * np.diag([1, 1, 0])
+    ik.AddPositionCost(ik.plant.world_frame(), p_WC, hand_frame, p_HM_H, C)
+
+
+def add_deviation_from_cylinder_middle_cost(ik, G, weight=1):
     """
     Add a cost for the deviation of the point at the
     middle of the fingers from the cylinder center
     """
-    plant_ad = plant.ToAutoDiffXd()
-    plant_context_ad = plant_ad.CreateDefaultContext()
-    G_ad = plant_ad.GetFrameByName(G.name())
-
-    def deviation_from_cylinder_middle_cost(q):
-        # H: hand frame
-        # G: cylinder frame
-        p_HC_H = [0, 0, HAND_HEIGHT]
-        plant_ad.SetPositions(plant_context_ad, q)
-        hand_frame = plant_ad.GetFrameByName(HAND_FRAME_NAME)
-        X_GH_G = hand_frame.CalcPose(plant_context_ad, G_ad)
-        R_GH = X_GH_G.rotation()
-        p_GH_G = X_GH_G.translation()
-        # distance from cylinder center to hand middle
-        p_GC_G = p_GH_G + R_GH.multiply(p_HC_H)
-        return p_GC_G.dot(p_GC_G)
-
-    cost = lambda q: weight * deviation_from_cylinder_middle_cost(q)
-    prog.AddCost(cost, q)
+    # H: hand frame
+    # G: cylinder frame
+    hand_frame = ik.plant.GetFrameByName(HAND_FRAME_NAME)
+    p_HC_H = [0, 0, HAND_HEIGHT]
+    ik.AddPositionCost(G, np.zeros(3), hand_frame, p_HC_H, weight * np.identity(3))
 
 
 def box_grasp_q(
@@ -244,11 +222,15 @@ def box_grasp_q(
     station_context,
     shape_info,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
+    panda_info=None,
 ):
     """
     Find a grasp configuration for the panda arm grasping
-    shape_info, given that it is  Box
+    shape_info, given that it is  Box. The grasps across each
+    axis of the box (with the hand either way round) are solved
+    as variants (see ik_executor.solve_variants), and the best
+    is returned
 
     Args:
         station: a PandaStation with welded fingers
@@ -262,6 +244,68 @@ def box_grasp_q(
         q_nominal: comfortable joint positions
 
         q_initial: initial guess for mathematical program
+
+        panda_info: the PandaInfo of the arm (defaults to station.get_panda())
+    Returns:
+        A tuple of the form
+        (grasp_q, cost)
+    """
+    from .ik_executor import (
+        STATION,
+        STATION_CONTEXT,
+        solve_variants,
+        station_panda,
+        station_shape,
+    )
+
+    plant = station.get_multibody_plant()
+    check_specs(plant, q_nominal, initial_guess)
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    panda_info = station_panda_info(station, panda_info)
+    X_WG = shape_info.offset_frame.CalcPoseInWorld(plant_context)
+    initial_guess = seed_above(station, station_context, X_WG.translation(), initial_guess, panda_info)
+
+    variants = []
+    for sign in [-1, 1]:
+        for axis in range(0, 3):
+            dim = box_dim_from_axis(axis, shape_info.shape)
+            if GRASP_WIDTH - dim < GRASP_MARGIN + COL_MARGIN:
+                continue  # don't try to grasp
+            variants.append(
+                (
+                    (STATION, STATION_CONTEXT, station_shape(shape_info), axis, sign),
+                    {
+                        "q_nominal": q_nominal,
+                        "initial_guess": initial_guess,
+                        "panda_info": station_panda(panda_info),
+                    },
+                )
+            )
+    return solve_variants(
+        station,
+        station_context,
+        box_axis_grasp_q,
+        variants,
+        panda=panda_info.panda,
+        accept="best",
+    )
+
+
+def box_axis_grasp_q(
+    station,
+    station_context,
+    shape_info,
+    axis,
+    sign,
+    q_nominal=Q_NOMINAL,
+    initial_guess=Q_NOMINAL,
+    panda_info=None,
+):
+    """
+    Find a grasp configuration for the panda arm grasping the Box
+    shape_info across `axis` of the box, with the hand's y axis
+    along `sign` times that axis (see box_grasp_q)
+
     Returns:
         A tuple of the form
         (grasp_q, cost)
@@ -273,68 +317,53 @@ def box_grasp_q(
     weights = weights / norm
 
     plant = station.get_multibody_plant()
-    check_specs(plant, q_nominal, initial_guess)
     plant_context = station.GetSubsystemContext(plant, station_context)
-    hand = station.get_hand()
+    panda_info = station_panda_info(station, panda_info)
+    hand = panda_info.hand
     H = plant.GetFrameByName(HAND_FRAME_NAME, hand)  # hand frame
     G = shape_info.offset_frame  # geometry frame
     X_WG = G.CalcPoseInWorld(plant_context)
 
-    qs = []
-    costs = []
-    for sign in [-1, 1]:
-        for axis in range(0, 3):
-            unit_v = np.zeros(3)
-            unit_v[axis] += 1
-            ik = InverseKinematics(plant, plant_context)
-            ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
-            dim = box_dim_from_axis(axis, shape_info.shape)
-            margin = GRASP_WIDTH - dim
-            if margin < GRASP_MARGIN + COL_MARGIN:
-                continue  # don't try to grasp
-            # Qu: upper corner of bounding box
-            # Ql: lower corner of bounding box
-            # G: geometry frame
-            p_GQl_G, p_GQu_G = get_bounding_box(shape_info.shape)
-            p_GQu_G[axis] += margin
-            p_GQl_G[axis] *= -1
-            ik.AddPositionConstraint(
-                H, [0, sign * GRASP_WIDTH / 2, HAND_HEIGHT], G, p_GQl_G, p_GQu_G
-            )
-            p_GQl_G, p_GQu_G = get_bounding_box(shape_info.shape)
-            p_GQu_G[axis] *= -1
-            p_GQl_G[axis] -= margin
-            ik.AddPositionConstraint(
-                H, [0, -sign * GRASP_WIDTH / 2, HAND_HEIGHT], G, p_GQl_G, p_GQu_G
-            )
-            ik.AddAngleBetweenVectorsConstraint(
-                H,
-                [0, sign, 0],
-                plant.world_frame(),
-                X_WG.rotation().col(axis),
-                0.0,
-                THETA_TOL,
-            )
-            prog = ik.prog()
-            q = ik.q()
-            prog.AddQuadraticErrorCost(
-                weights[0] * np.identity(len(q)), q_nominal, q
-            )
-            # these constraints are the slowest
-            add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
-            add_deviation_from_box_center_cost(
-                prog, q, plant, X_WG.translation(), weight=weights[2]
-            )
-            prog.SetInitialGuess(q, initial_guess)
-            result = Solve(prog)
-            cost = result.get_optimal_cost()
-            if not result.is_success():
-                cost = np.inf
-            qs.append(result.GetSolution(q))
-            costs.append(cost)
-    # return best result
-    indices = np.argsort(costs)
-    return qs[indices[0]], costs[indices[0]]
+    ik = ik_program(
+        plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+    )
+    dim = box_dim_from_axis(axis, shape_info.shape)
+    margin = GRASP_WIDTH - dim
+    # Qu: upper corner of bounding box
+    # Ql: lower corner of bounding box
+    # G: geometry frame
+    p_GQl_G, p_GQu_G = get_bounding_box(shape_info.shape)
+    p_GQu_G[axis] += margin
+    p_GQl_G[axis] *= -1
+    ik.AddPositionConstraint(
+        H, [0, sign * GRASP_WIDTH / 2, HAND_HEIGHT], G, p_GQl_G, p_GQu_G
+    )
+    p_GQl_G, p_GQu_G = get_bounding_box(shape_info.shape)
+    p_GQu_G[axis] *= -1
+    p_GQl_G[axis] -= margin
+    ik.AddPositionConstraint(
+        H, [0, -sign * GRASP_WIDTH / 2, HAND_HEIGHT], G, p_GQl_G, p_GQu_G
+    )
+    ik.AddAngleBetweenVectorsConstraint(
+        H,
+        [0, sign, 0],
+        plant.world_frame(),
+        X_WG.rotation().col(axis),
+        0.0,
+        THETA_TOL,
+    )
+    prog = ik.prog()
+    q = ik.q()
+    add_deviation_from_vertical_cost(ik, weight=weights[1])
+    add_deviation_from_box_center_cost(
+        ik, X_WG.translation(), weight=weights[2]
+    )
+    prog.SetInitialGuess(q, initial_guess)
+    result = Solve(prog)
+    cost = result.get_optimal_cost()
+    if not result.is_success():
+        cost = np.inf
+    return result.GetSolution(q), cost
 
 
 def cylinder_grasp_q(
@@ -342,7 +371,8 @@ def cylinder_grasp_q(
     station_context,
     shape_info,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
+    panda_info=None,
 ):
     """
     Find a grasp configuration for the panda arm grasping
@@ -360,6 +390,8 @@ def cylinder_grasp_q(
         q_nominal: comfortable joint positions
 
         q_initial: initial guess for mathematical program
+
+        panda_info: the PandaInfo of the arm (defaults to station.get_panda())
     Returns:
         A tuple of the form
         (grasp_q, cost)
@@ -374,20 +406,23 @@ def cylinder_grasp_q(
     plant = station.get_multibody_plant()
     check_specs(plant, q_nominal, initial_guess)
     plant_context = station.GetSubsystemContext(plant, station_context)
-    hand = station.get_hand()
+    panda_info = station_panda_info(station, panda_info)
+    hand = panda_info.hand
     H = plant.GetFrameByName(HAND_FRAME_NAME, hand)
 
     cylinder = shape_info.shape
     G = shape_info.offset_frame
     X_WG = G.CalcPoseInWorld(plant_context)
+    initial_guess = seed_above(station, station_context, X_WG.translation(), initial_guess, panda_info)
 
     if cylinder.radius() < 0.04:
         lower_z_bound = min(GRASP_MARGIN, -cylinder.length() / 2 + FINGER_WIDTH / 2)
         upper_z_bound = max(GRASP_MARGIN, cylinder.length() / 2 - FINGER_WIDTH / 2)
         margin = GRASP_WIDTH - cylinder.radius() * 2
         p_tol = min(cylinder.radius() / np.sqrt(2), margin / (2 * np.sqrt(2)))
-        ik = InverseKinematics(plant, plant_context)
-        ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+        ik = ik_program(
+            plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+        )
         ik.AddPositionConstraint(
             H,
             [0, 0, HAND_HEIGHT],
@@ -400,9 +435,8 @@ def cylinder_grasp_q(
         )
         prog = ik.prog()
         q = ik.q()
-        add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
-        add_deviation_from_cylinder_middle_cost(prog, q, plant, G, weight=weights[2])
-        prog.AddQuadraticErrorCost(weights[0] * np.identity(len(q)), q_nominal, q)
+        add_deviation_from_vertical_cost(ik, weight=weights[1])
+        add_deviation_from_cylinder_middle_cost(ik, G, weight=weights[2])
         prog.SetInitialGuess(q, initial_guess)
         result = Solve(prog)
         cost = result.get_optimal_cost()
@@ -415,8 +449,9 @@ def cylinder_grasp_q(
             radius = cylinder.radius()
             lower_xy_bound = min(-radius + FINGER_WIDTH / 2, -GRASP_MARGIN)
             upper_xy_bound = max(radius - FINGER_WIDTH / 2, GRASP_MARGIN)
-            ik = InverseKinematics(plant, plant_context)
-            ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+            ik = ik_program(
+                plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+            )
             ik.AddPositionConstraint(
                 H,
                 [0, sign * GRASP_WIDTH / 2, HAND_HEIGHT],
@@ -441,11 +476,10 @@ def cylinder_grasp_q(
             )
             prog = ik.prog()
             q = ik.q()
-            add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
+            add_deviation_from_vertical_cost(ik, weight=weights[1])
             add_deviation_from_cylinder_middle_cost(
-                prog, q, plant, G, weight=weights[2]
+                ik, G, weight=weights[2]
             )
-            prog.AddQuadraticErrorCost(weights[0] * np.identity(len(q)), q_nominal, q)
             prog.SetInitialGuess(q, initial_guess)
             result = Solve(prog)
             cost = result.get_optimal_cost()
@@ -460,7 +494,8 @@ def sphere_grasp_q(
     station_context,
     shape_info,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
+    panda_info=None,
 ):
     """
     Find a grasp configuration for the panda arm grasping
@@ -478,6 +513,8 @@ def sphere_grasp_q(
         q_nominal: comfortable joint positions
 
         q_initial: initial guess for mathematical program
+
+        panda_info: the PandaInfo of the arm (defaults to station.get_panda())
     Returns:
         A tuple of the form
         (grasp_q, cost)
@@ -491,11 +528,19 @@ def sphere_grasp_q(
     plant = station.get_multibody_plant()
     check_specs(plant, q_nominal, initial_guess)
     plant_context = station.GetSubsystemContext(plant, station_context)
-    hand = station.get_hand()
+    panda_info = station_panda_info(station, panda_info)
+    hand = panda_info.hand
     H = plant.GetFrameByName(HAND_FRAME_NAME, hand)
 
     sphere = shape_info.shape
     G = shape_info.offset_frame
+    initial_guess = seed_above(
+        station,
+        station_context,
+        G.CalcPoseInWorld(plant_context).translation(),
+        initial_guess,
+        panda_info,
+    )
     margin = GRASP_WIDTH - sphere.radius() - COL_MARGIN
     p_tol = min(
         [
@@ -505,8 +550,9 @@ def sphere_grasp_q(
         ]
     )
 
-    ik = InverseKinematics(plant, plant_context)
-    ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+    ik = ik_program(
+        plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+    )
     ik.AddPositionConstraint(
         H,
         [0, 0, HAND_HEIGHT],
@@ -516,8 +562,7 @@ def sphere_grasp_q(
     )
     prog = ik.prog()
     q = ik.q()
-    prog.AddQuadraticErrorCost(weights[0] * np.identity(len(q)), q_nominal, q)
-    add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
+    add_deviation_from_vertical_cost(ik, weight=weights[1])
     prog.SetInitialGuess(q, initial_guess)
     result = Solve(prog)
     cost = result.get_optimal_cost()
@@ -595,7 +640,7 @@ def X_WH_to_q(
     station,
     station_context,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
     panda_info = None
 ):
     """
@@ -605,7 +650,8 @@ def X_WH_to_q(
 
     Optional Args:
         q_nominal: comfortable joint positions
-        intial_guess: the initial guess for the solution
+        intial_guess: the initial guess for the solution (defaults to
+        the nearest solution in the IK seed database, see ik_seeds)
 
     Returns:
         q: joint positions (np.array)
@@ -619,9 +665,12 @@ def X_WH_to_q(
     if panda_info is None:
         hand = station.get_hand()
         panda = station.get_panda()
+        panda_info = station_panda_info(station)
     else:
         hand = panda_info.hand
         panda = panda_info.panda
+    if initial_guess is None:
+        initial_guess = ik_seed(station, station_context, panda_info, X_WH, Q_NOMINAL)
 
     plant.SetPositions(plant_context, panda, q_nominal)
     q_nominal = plant.GetPositions(plant_context)
@@ -631,7 +680,7 @@ def X_WH_to_q(
 
     H = plant.GetFrameByName(HAND_FRAME_NAME, hand)
     W = plant.world_frame()
-    ik = InverseKinematics(plant, plant_context)
+    ik = ik_program(plant, plant_context, q_nominal, min_distance=MIN_DISTANCE)
     ik.AddPositionConstraint(
         H,
         np.zeros(3),
@@ -640,15 +689,15 @@ def X_WH_to_q(
         X_WH.translation() + GRASP_MARGIN * np.ones(3),
     )
     ik.AddOrientationConstraint(H, RotationMatrix(), W, X_WH.rotation(), THETA_TOL)
-    ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
     q = ik.q()
     prog = ik.prog()
-    prog.AddQuadraticErrorCost(np.identity(len(q)), q_nominal, q)
     prog.SetInitialGuess(q, initial_guess)
     result = Solve(prog)
     cost = result.get_optimal_cost()
     if not result.is_success():
         cost = np.inf
+    else:
+        learn_ik_solution(station, station_context, panda_info, plant.GetPositions(plant_context, panda))
     return plant.GetPositions(plant_context, panda), cost
 
 
@@ -830,8 +879,9 @@ def sphere_place_q(
     holding_shape_info,
     surface,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
     randomize_position=True,
+    panda_info=None,
 ):
     """
     Return the joint config to place shape holding_shape_info on target_shape_info,
@@ -843,6 +893,8 @@ def sphere_place_q(
         holding_shape_info: the info of the shape that the robot is holding
         (assumed to be a sphere)
         target_shape_info: the info of the shape that we want to place on
+        panda_info: the PandaInfo of the arm, for the IK seed
+        (defaults to station.get_panda())
 
     Returns:
         q: (np.array) the 7dof joint config
@@ -863,6 +915,7 @@ def sphere_place_q(
 
     p_SB = np.random.uniform(surface.bb_min, surface.bb_max)
     p_WB = p_SB + surface.shape_info.offset_frame.CalcPoseInWorld(plant_context).translation()
+    initial_guess = seed_above(station, station_context, p_WB, initial_guess, panda_info)
     for i in range(len(surface.bb_min)):
         if np.isclose(surface.bb_min[i], surface.bb_max[i] * -1):
             surface.bb_min[i] = surface.bb_min[i] + sphere.radius()
@@ -872,16 +925,16 @@ def sphere_place_q(
             surface.bb_max[i] = surface.bb_max[i] + sign * sphere.radius()
             surface.bb_min[i] = surface.bb_min[i] + sign * sphere.radius()
 
-    ik = InverseKinematics(plant, plant_context)
-    ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+    ik = ik_program(
+        plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+    )
     ik.AddPositionConstraint(H, np.zeros(3), P, surface.bb_min, surface.bb_max)
 
     prog = ik.prog()
     q = ik.q()
-    add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
+    add_deviation_from_vertical_cost(ik, weight=weights[1])
     if randomize_position:
-        add_deviation_from_point_cost(prog, q, holding_shape_info, p_WB[:2], plant)
-    prog.AddQuadraticErrorCost(weights[0] * np.identity(len(q)), q_nominal, q)
+        add_deviation_from_point_cost(ik, holding_shape_info, p_WB[:2])
     prog.SetInitialGuess(q, initial_guess)
     result = Solve(prog)
     cost = result.get_optimal_cost()
@@ -895,8 +948,9 @@ def cylinder_place_q(
     holding_shape_info,
     surface,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
     randomize_position=True,
+    panda_info=None,
 ):
     """
     Return the joint config to place shape holding_shape_info on target_shape_info,
@@ -908,6 +962,8 @@ def cylinder_place_q(
         holding_shape_info: the info of the shape that the robot is holding
         (assumed to be a cylinder)
         target_shape_info: the info of the shape that we want to place on
+        panda_info: the PandaInfo of the arm, for the IK seed
+        (defaults to station.get_panda())
 
     Returns:
         q: (np.array) the 7dof joint config
@@ -930,9 +986,11 @@ def cylinder_place_q(
     costs = []
     p_SB = np.random.uniform(surface.bb_min, surface.bb_max)
     p_WB = p_SB + surface.shape_info.offset_frame.CalcPoseInWorld(plant_context).translation()
+    initial_guess = seed_above(station, station_context, p_WB, initial_guess, panda_info)
     for sign in [-1, 1]:
-        ik = InverseKinematics(plant, plant_context)
-        ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+        ik = ik_program(
+            plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+        )
         corners = extract_cylinder_corners(cylinder, sign)
         for corner in corners:
             ik.AddPositionConstraint(H, corner, P, surface.bb_min, surface.bb_max)
@@ -943,12 +1001,11 @@ def cylinder_place_q(
         )
         prog = ik.prog()
         q = ik.q()
-        add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
+        add_deviation_from_vertical_cost(ik, weight=weights[1])
         if randomize_position:
             add_deviation_from_point_cost(
-                prog, q, holding_shape_info, p_WB[:2], plant
+                ik, holding_shape_info, p_WB[:2]
             )
-        prog.AddQuadraticErrorCost(weights[0] * np.identity(len(q)), q_nominal, q)
         prog.SetInitialGuess(q, initial_guess)
         result = Solve(prog)
         cost = result.get_optimal_cost()
@@ -995,9 +1052,10 @@ def box_place_q(
     holding_shape_info,
     surface,
     q_nominal=Q_NOMINAL,
-    initial_guess=Q_NOMINAL,
+    initial_guess=None,
     randomize_position=True,
     randomize_theta=True,
+    panda_info=None,
 ):
     """
     Return the joint config to place shape holding_shape_info on target_shape_info,
@@ -1009,6 +1067,8 @@ def box_place_q(
         holding_shape_info: the info of the shape that the robot is holding
         (assumed to be a box)
         target_shape_info: the info of the shape that we want to place on
+        panda_info: the PandaInfo of the arm, for the IK seed
+        (defaults to station.get_panda())
     Returns:
         q: (np.array) the 7dof joint config
         cost: the cost of the solution (is np.inf if no solution can be found)
@@ -1033,11 +1093,13 @@ def box_place_q(
     qs = []
     p_SB = np.random.uniform(surface.bb_min, surface.bb_max)
     p_WB = p_SB + surface.shape_info.offset_frame.CalcPoseInWorld(plant_context).translation()
+    initial_guess = seed_above(station, station_context, p_WB, initial_guess, panda_info)
     theta = np.random.uniform(0, 2 * np.pi)
     for sign in [-1, 1]:
         for axis in range(0, 3):
-            ik = InverseKinematics(plant, plant_context)
-            ik.AddMinimumDistanceConstraint(COL_MARGIN, CONSIDER_MARGIN)
+            ik = ik_program(
+                plant, plant_context, q_nominal, weights[0], min_distance=MIN_DISTANCE
+            )
             # corners of face must lie in bounding box
             corners = extract_box_corners(box, axis, sign)
             for corner in corners:
@@ -1052,25 +1114,20 @@ def box_place_q(
             )
             prog = ik.prog()
             q = ik.q()
-            add_deviation_from_vertical_cost(prog, q, plant, weight=weights[1])
+            add_deviation_from_vertical_cost(ik, weight=weights[1])
             if randomize_position:
                 add_deviation_from_point_cost(
-                    prog, q, holding_shape_info, p_WB[:2], plant
+                    ik, holding_shape_info, p_WB[:2]
                 )
             if randomize_theta:
                 v = np.zeros(3)
                 v[axis - 1] = 1  # perpendicular to n (ie. along the surface)
                 add_theta_cost(
-                    prog,
-                    q,
+                    ik,
                     holding_shape_info,
                     v,
                     theta,
-                    plant,
                 )
-            prog.AddQuadraticErrorCost(
-                weights[0] * np.identity(len(q)), q_nominal, q
-            )
             prog.SetInitialGuess(q, initial_guess)
             result = Solve(prog)
             cost = result.get_optimal_cost()
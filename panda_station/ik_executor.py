@@ -0,0 +1,260 @@
+"""
+This module contains an executor for independent inverse kinematics
+problems (different seeds, or variants of the same query): they are solved
+in a pool of worker processes, each with its own copies of the stations,
+and the first (or best) feasible solution found within a time budget is
+accepted.
+"""
+import atexit
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+from .planning_utils import (
+    ProblemInfo,
+    StationPool,
+    get_station_state,
+    random_normal_q,
+    set_station_state,
+)
+from .planner_racing import PlannerRace
+from .utils import Colors
+
+# the IKExecutor used by solve_variants
+IK_EXECUTOR = None
+
+# worker process state (see init_worker)
+WORKER = {}
+
+
+class StationArg:
+    """
+    A placeholder for an argument that lives in the station an IK problem
+    is solved in (the station itself, its context, an object, a shape
+    or a panda),
+    so that the problem can be sent to a worker with its own copy of it
+    """
+
+    def __init__(self, kind, name=None):
+        self.kind = kind
+        self.name = name
+
+    def resolve(self, station, station_context):
+        if self.kind == "station":
+            return station
+        if self.kind == "context":
+            return station_context
+        if self.kind == "object":
+            return station.object_infos[self.name][0]
+        if self.kind == "shape":
+            # shapes are known by the unique name of their frame
+            for object_info, _ in station.object_infos.values():
+                for shape_info in object_info.query_shape_infos():
+                    if shape_info.offset_frame.name() == self.name:
+                        return shape_info
+            raise ValueError(f"Unknown shape {self.name}")
+        if self.kind == "panda":
+            return station.panda_infos[self.name]
+        raise ValueError(f"Unknown station argument {self.kind}")
+
+
+STATION = StationArg("station")
+STATION_CONTEXT = StationArg("context")
+
+
+def station_object(object_info):
+    return StationArg("object", object_info.name)
+
+
+def station_shape(shape_info):
+    return StationArg("shape", shape_info.offset_frame.name())
+
+
+def station_panda(panda_info):
+    return StationArg("panda", panda_info.panda_name)
+
+
+def resolve_args(station, station_context, args, kwargs):
+    resolve = lambda a: a.resolve(station, station_context) if isinstance(a, StationArg) else a
+    return (
+        [resolve(a) for a in args],
+        {k: resolve(v) for k, v in kwargs.items()},
+    )
+
+
+def is_accepted(i, results, accept):
+    """
+    Returns True if the variant i (with a feasible solution) can be accepted
+    given the results so far ({index: (q, cost)}):
+    "first" accepts any feasible solution, "ordered" only once all the
+    variants before it have failed, and "best" never accepts early
+    """
+    if accept == "first":
+        return True
+    if accept == "ordered":
+        return all(j in results for j in range(i))
+    return False
+
+
+def choose(results, accept):
+    """
+    Returns the (q, cost) chosen from results ({index: (q, cost)}):
+    the cheapest feasible one for "best", otherwise the first feasible one
+    in the order of the variants (or, if there is none, the last result)
+    """
+    if len(results) == 0:
+        return None, np.inf
+    feasible = [i for i in sorted(results) if np.isfinite(results[i][1])]
+    if accept == "best" and feasible:
+        return results[min(feasible, key=lambda i: results[i][1])]
+    if feasible:
+        return results[feasible[0]]
+    return results[max(results)]
+
+
+def init_worker(problem_file, cancelled):
+    WORKER["stations"] = StationPool(ProblemInfo(problem_file))
+    WORKER["cancelled"] = cancelled
+
+
+def solve_in_worker(query_id, i, name, arm_name, state, func, args, kwargs):
+    """
+    Solve one variant of an IK query in this worker's copy of the station,
+    after setting it to `state` (see planning_utils.get_station_state)
+    """
+    if WORKER["cancelled"].value >= query_id:
+        return i, (None, np.inf)
+    station, station_context = WORKER["stations"].get(name, arm_name)
+    set_station_state(station, station_context, state)
+    args, kwargs = resolve_args(station, station_context, args, kwargs)
+    return i, func(*args, **kwargs)
+
+
+class IKExecutor:
+    """
+    Solves the variants of an IK query in a pool of worker processes
+    that each build their own copies of the stations from the problem file
+    (like the PlannerRace). Variants still queued when a solution is
+    accepted are skipped.
+    """
+
+    def __init__(self, problem_file, processes=None, timeout=5.0):
+        """
+        Construct an IKExecutor
+
+        Args:
+            problem_file: the .yaml problem file the stations were built from
+            processes: number of worker processes (defaults to the number of cpus)
+            timeout: default time budget (s) for each query
+        """
+        self.timeout = timeout
+        context = multiprocessing.get_context("spawn")
+        self.cancelled = context.Value("i", -1)
+        self.pool = context.Pool(
+            processes,
+            initializer=init_worker,
+            initargs=(problem_file, self.cancelled),
+        )
+        self.query_id = 0
+        self.num_queries = 0
+        self.num_early = 0
+
+    def solve(self, station, station_context, func, variants, panda=None, accept="first", timeout=None):
+        """
+        Solve the variants [(args, kwargs)] of func, which returns (q, cost),
+        in copies of station in its current state. StationArgs in args and
+        kwargs are replaced by their counterparts in the worker's station.
+        Returns the (q, cost) chosen by `accept` (see is_accepted and choose).
+        Variants that raise count as infeasible, unless they all raise
+        """
+        if panda is None:
+            panda = station.get_panda()
+        self.query_id += 1
+        self.num_queries += 1
+        name, arm_name = PlannerRace.station_key(station, panda)
+        state = get_station_state(station, station_context)
+        results = queue.Queue()
+        for i, (args, kwargs) in enumerate(variants):
+            self.pool.apply_async(
+                solve_in_worker,
+                (self.query_id, i, name, arm_name, state, func, args, kwargs),
+                callback=results.put,
+                error_callback=lambda e, i=i: results.put((i, e)),
+            )
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        solutions = {}
+        errors = {}
+        while len(solutions) < len(variants):
+            try:
+                i, solution = results.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if isinstance(solution, Exception):
+                print(
+                    f"{Colors.RED}IK variant {i} of {getattr(func, '__name__', func)} "
+                    f"failed: {solution!r}{Colors.RESET}"
+                )
+                errors[i] = solution
+                solution = (None, np.inf)
+            solutions[i] = solution
+            done = [j for j in solutions if np.isfinite(solutions[j][1])]
+            if any(is_accepted(j, solutions, accept) for j in done):
+                if len(solutions) < len(variants):
+                    self.num_early += 1
+                break
+        # skip the variants of this query that have not started
+        self.cancelled.value = self.query_id
+        if len(variants) > 0 and len(errors) == len(variants):
+            raise RuntimeError(
+                f"All {len(variants)} IK variants of {getattr(func, '__name__', func)} failed"
+            ) from errors[0]
+        return choose(solutions, accept)
+
+    def close(self):
+        self.pool.terminate()
+
+
+def start_ik_executor(problem_file, **kwargs):
+    """
+    Start the IKExecutor used by solve_variants.
+    kwargs are passed to IKExecutor
+    """
+    global IK_EXECUTOR
+    if IK_EXECUTOR is not None:
+        IK_EXECUTOR.close()
+    IK_EXECUTOR = IKExecutor(problem_file, **kwargs)
+    atexit.register(IK_EXECUTOR.close)
+    return IK_EXECUTOR
+
+
+def solve_variants(station, station_context, func, variants, panda=None, accept="first", timeout=None):
+    """
+    Solve the variants of an IK query with the IKExecutor if it was started,
+    otherwise one after another in station (stopping as soon as one is
+    accepted, or when the time budget runs out).
+    See IKExecutor.solve
+    """
+    if IK_EXECUTOR is not None:
+        return IK_EXECUTOR.solve(
+            station, station_context, func, variants, panda=panda, accept=accept, timeout=timeout
+        )
+    deadline = None if timeout is None else time.time() + timeout
+    solutions = {}
+    for i, (args, kwargs) in enumerate(variants):
+        if deadline is not None and time.time() > deadline and solutions:
+            break
+        args, kwargs = resolve_args(station, station_context, args, kwargs)
+        solutions[i] = func(*args, **kwargs)
+        if np.isfinite(solutions[i][1]) and is_accepted(i, solutions, accept):
+            break
+    return choose(solutions, accept)
+
+
+def seed_variants(station, args, kwargs, q_initial, num_seeds, seed_kwarg="q_initial"):
+    """
+    Returns the variants of the call func(*args, **kwargs) seeded with
+    q_initial and num_seeds - 1 random configurations around it
+    """
+    seeds = [q_initial] + [random_normal_q(station, q_initial) for _ in range(num_seeds - 1)]
+    return [(args, {**kwargs, seed_kwarg: seed}) for seed in seeds]
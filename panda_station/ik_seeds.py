@@ -0,0 +1,142 @@
+"""
+This module contains a warm start service for the panda's inverse
+kinematics: a database of (hand pose -> q) samples, relative to the arm's
+base, searched with a KD-tree over SE(3) features. It is seeded with
+random forward kinematics samples and learns from every successful solve.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+HAND_FRAME_NAME = "panda_hand"
+
+# {quantized X_WB: IKSeedDatabase}
+SEED_DATABASES = {}
+
+
+def pose_feature(X_BH, rotation_weight=0.1):
+    """
+    Feature vector of the hand pose X_BH (relative to the arm's base):
+    its translation, and the first two columns of its rotation scaled by
+    rotation_weight (m per unit of chordal distance)
+    """
+    R = X_BH.rotation().matrix()
+    return np.concatenate((X_BH.translation(), rotation_weight * R[:, 0], rotation_weight * R[:, 1]))
+
+
+class IKSeedDatabase:
+    """
+    Joint configurations of one panda arm indexed by the pose of its hand
+    relative to the arm's base
+    """
+
+    def __init__(self, rotation_weight=0.1, rebuild_fraction=0.1):
+        """
+        Construct an IKSeedDatabase
+
+        Args:
+            rotation_weight: the weight of rotation in the pose features
+            (see pose_feature)
+            rebuild_fraction: the KD-tree is rebuilt once the samples added
+            since it was built are this fraction of the database
+            (until then they are searched exhaustively)
+        """
+        self.rotation_weight = rotation_weight
+        self.rebuild_fraction = rebuild_fraction
+        self.features = np.empty((0, 9))
+        self.qs = np.empty((0, 7))
+        self.tree = None
+        self.num_learned = 0
+
+    def __len__(self):
+        return len(self.qs)
+
+    def add(self, X_BH, q):
+        self.extend([X_BH], [q])
+
+    def extend(self, X_BHs, qs):
+        features = [pose_feature(X_BH, self.rotation_weight) for X_BH in X_BHs]
+        self.features = np.vstack([self.features] + features)
+        self.qs = np.vstack((self.qs, np.asarray(qs)))
+        num_tree = 0 if self.tree is None else self.tree.n
+        if len(self.qs) - num_tree > max(32, self.rebuild_fraction * len(self.qs)):
+            self.tree = cKDTree(self.features)
+
+    def nearest(self, X_BH):
+        """
+        Returns the configuration whose hand pose is closest to X_BH,
+        or None if the database is empty
+        """
+        if len(self.qs) == 0:
+            return None
+        feature = pose_feature(X_BH, self.rotation_weight)
+        best, best_dist = None, np.inf
+        num_tree = 0
+        if self.tree is not None:
+            num_tree = self.tree.n
+            best_dist, best = self.tree.query(feature)
+        if num_tree < len(self.qs):
+            dists = np.linalg.norm(self.features[num_tree:] - feature, axis=1)
+            i = np.argmin(dists)
+            if dists[i] < best_dist:
+                best = num_tree + i
+        return self.qs[best].copy()
+
+
+def hand_pose_in_base(station, station_context, panda_info, q):
+    """
+    Returns X_BH, the pose of the hand of panda_info relative to its base
+    in configuration q (the arm is moved back to where it was)
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    H = plant.GetFrameByName(HAND_FRAME_NAME, panda_info.hand)
+    q_current = plant.GetPositions(plant_context, panda_info.panda)
+    plant.SetPositions(plant_context, panda_info.panda, q)
+    X_WH = H.CalcPoseInWorld(plant_context)
+    plant.SetPositions(plant_context, panda_info.panda, q_current)
+    return panda_info.X_WB.inverse().multiply(X_WH)
+
+
+def database_key(panda_info, resolution=1e-4):
+    X = panda_info.X_WB.GetAsMatrix4()
+    return tuple(np.round(X / resolution).astype(int).flatten())
+
+
+def get_seed_database(station, station_context, panda_info, num_samples=1000, seed=0):
+    """
+    Returns the IKSeedDatabase for an arm with the base pose of panda_info,
+    filling it with num_samples random forward kinematics samples first if
+    it is new
+    """
+    key = database_key(panda_info)
+    database = SEED_DATABASES.get(key)
+    if database is None:
+        database = IKSeedDatabase()
+        plant = station.get_multibody_plant()
+        lower = plant.GetPositionsFromArray(panda_info.panda, plant.GetPositionLowerLimits())
+        upper = plant.GetPositionsFromArray(panda_info.panda, plant.GetPositionUpperLimits())
+        qs = np.random.default_rng(seed).uniform(lower, upper, size=(num_samples, len(lower)))
+        database.extend(
+            [hand_pose_in_base(station, station_context, panda_info, q) for q in qs], qs
+        )
+        SEED_DATABASES[key] = database
+    return database
+
+
+def ik_seed(station, station_context, panda_info, X_WH, default):
+    """
+    Returns the configuration of the arm panda_info whose hand pose is
+    closest to X_WH, or default if there is none
+    """
+    database = get_seed_database(station, station_context, panda_info)
+    q = database.nearest(panda_info.X_WB.inverse().multiply(X_WH))
+    return default if q is None else q
+
+
+def learn_ik_solution(station, station_context, panda_info, q):
+    """
+    Add the successful IK solution q of the arm panda_info to its database
+    """
+    database = get_seed_database(station, station_context, panda_info)
+    database.add(hand_pose_in_base(station, station_context, panda_info, q), q)
+    database.num_learned += 1
@@ -0,0 +1,133 @@
+"""
+This module contains reusable inverse kinematics programs: the parts of
+an IK problem that do not depend on the target (the decision variables,
+the minimum distance constraint and the cost of deviating from a nominal
+configuration) are built once per plant context, and each solve only adds
+its target constraints to a copy of the program.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from pydrake.all import (
+    AngleBetweenVectorsConstraint,
+    AngleBetweenVectorsCost,
+    InverseKinematics,
+    OrientationConstraint,
+    PositionConstraint,
+    PositionCost,
+)
+
+# templates are kept for the most recently used contexts (each holds on to
+# its context): {(id(plant_context), min_distance): IKTemplate}
+MAX_TEMPLATES = 32
+IK_TEMPLATES = OrderedDict()
+
+
+class IKTemplate:
+    """
+    An InverseKinematics program for a plant in a given context, with
+    (optionally) a minimum distance constraint and a quadratic cost on the
+    deviation from a nominal configuration, that is reused across solves
+    """
+
+    def __init__(self, plant, plant_context, min_distance=None):
+        """
+        Construct an IKTemplate
+
+        Args:
+            plant: the MultibodyPlant
+            plant_context: the Context for plant, which is read when solving
+            (so the template stays valid as the poses in it change)
+            min_distance: None, or a tuple (collision margin, consider margin)
+            for the minimum distance constraint
+        """
+        self.plant = plant
+        self.plant_context = plant_context
+        self.ik = InverseKinematics(plant, plant_context)
+        if min_distance is not None:
+            self.ik.AddMinimumDistanceConstraint(*min_distance)
+        self.q = self.ik.q()
+        n = len(self.q)
+        self.nominal_cost = self.ik.prog().AddQuadraticErrorCost(
+            np.identity(n), np.zeros(n), self.q
+        )
+
+    def program(self, q_nominal, nominal_weight=1.0):
+        """
+        Returns an IKProgram: a copy of this template's program, with the cost
+        weight * |q - q_nominal|^2, to which the target constraints are added
+        """
+        W = nominal_weight * np.identity(len(self.q))
+        q_nominal = np.asarray(q_nominal, dtype=float)
+        # (q - q_n)^T W (q - q_n) = 0.5 q^T (2W) q - 2 q_n^T W q + q_n^T W q_n
+        self.nominal_cost.evaluator().UpdateCoefficients(
+            2 * W, -2 * W.dot(q_nominal), q_nominal.dot(W).dot(q_nominal)
+        )
+        return IKProgram(self, self.ik.prog().Clone())
+
+
+class IKProgram:
+    """
+    One solve of an IKTemplate, with the same interface as InverseKinematics
+    for the constraints and costs the grasping and placing functions use
+    """
+
+    def __init__(self, template, prog):
+        self.template = template
+        self.plant = template.plant
+        self.plant_context = template.plant_context
+        self._prog = prog
+
+    def prog(self):
+        return self._prog
+
+    def q(self):
+        return self.template.q
+
+    def AddPositionConstraint(self, frameB, p_BQ, frameA, p_AQ_lower, p_AQ_upper):
+        constraint = PositionConstraint(
+            self.plant, frameA, p_AQ_lower, p_AQ_upper, frameB, p_BQ, self.plant_context
+        )
+        return self._prog.AddConstraint(constraint, self.q())
+
+    def AddOrientationConstraint(self, frameAbar, R_AbarA, frameBbar, R_BbarB, theta_bound):
+        constraint = OrientationConstraint(
+            self.plant, frameAbar, R_AbarA, frameBbar, R_BbarB, theta_bound, self.plant_context
+        )
+        return self._prog.AddConstraint(constraint, self.q())
+
+    def AddAngleBetweenVectorsConstraint(
+        self, frameA, na_A, frameB, nb_B, angle_lower, angle_upper
+    ):
+        constraint = AngleBetweenVectorsConstraint(
+            self.plant, frameA, na_A, frameB, nb_B, angle_lower, angle_upper, self.plant_context
+        )
+        return self._prog.AddConstraint(constraint, self.q())
+
+
+    def AddPositionCost(self, frameA, p_AP, frameB, p_BQ, C):
+        cost = PositionCost(self.plant, frameA, p_AP, frameB, p_BQ, C, self.plant_context)
+        return self._prog.AddCost(cost, self.q())
+
+    def AddAngleBetweenVectorsCost(self, frameA, a_A, frameB, b_B, c):
+        cost = AngleBetweenVectorsCost(
+            self.plant, frameA, a_A, frameB, b_B, c, self.plant_context
+        )
+        return self._prog.AddCost(cost, self.q())
+
+
+def ik_program(plant, plant_context, q_nominal, nominal_weight=1.0, min_distance=None):
+    """
+    Returns an IKProgram for plant in plant_context, built from a cached
+    IKTemplate (see IKTemplate.program)
+    """
+    key = (id(plant_context), min_distance)
+    template = IK_TEMPLATES.get(key)
+    if template is None or template.plant_context is not plant_context:
+        template = IKTemplate(plant, plant_context, min_distance=min_distance)
+        IK_TEMPLATES[key] = template
+    IK_TEMPLATES.move_to_end(key)
+    while len(IK_TEMPLATES) > MAX_TEMPLATES:
+        IK_TEMPLATES.popitem(last=False)
+    return template.program(q_nominal, nominal_weight=nominal_weight)
+
@@ -0,0 +1,196 @@
+"""
+This module contains a cache of motion planning results, so that
+trajectories between (nearly) the same configurations in the same
+scene are only planned once.
+"""
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from .collision_checking import RESOLUTION, CollisionChecker
+from .planning_utils import get_station_state
+from .stream_utils import find_traj
+from .utils import Colors
+
+# find_traj keyword arguments that change its result
+RESULT_KWARGS = ("ignore_endpoint_collisions", "use_min_clearance", "interpolate", "simplify")
+
+
+def quantize(array, resolution):
+    return tuple(np.round(np.asarray(array, dtype=float) / resolution).astype(int).flatten())
+
+
+class MotionCache:
+    """
+    A LRU cache of the trajectories found by find_traj, keyed by the
+    problem file, the station, the (quantized) poses of all objects and
+    other arms in it (ie. the fluents it was updated with) and the
+    (quantized) start and goal configurations.
+    Trajectories loaded from disk are collision checked again the first
+    time they are used.
+    """
+
+    def __init__(
+        self,
+        max_size=10000,
+        q_resolution=1e-4,
+        pose_resolution=1e-4,
+        path=None,
+        problem_file=None,
+    ):
+        """
+        Construct a MotionCache
+
+        Args:
+            max_size: the maximum number of trajectories kept
+            q_resolution: configurations closer than this (rad) share an entry
+            pose_resolution: object poses closer than this share an entry
+            path: an optional .pkl file to load the cache from and
+            save it to (see save)
+            problem_file: the .yaml problem file the stations were made
+            from, so that a cache saved for one problem is not used
+            for another
+        """
+        self.max_size = max_size
+        self.q_resolution = q_resolution
+        self.pose_resolution = pose_resolution
+        self.path = path
+        self.problem = None
+        if problem_file is not None:
+            with open(problem_file, "rb") as stream:
+                self.problem = hashlib.sha1(stream.read()).hexdigest()
+        self.cache = OrderedDict()
+        # the keys loaded from disk that have not been checked yet
+        self.unchecked = set()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.isfile(path):
+            self.load(path)
+
+    def key(self, station, station_context, panda, q_start, q_goal, **kwargs):
+        frame_poses, panda_qs, held_objects, inactive_objects = get_station_state(
+            station, station_context
+        )
+        plant = station.get_multibody_plant()
+        scene = tuple(
+            (name, quantize(X, self.pose_resolution))
+            for name, X in sorted(frame_poses.items())
+            if name not in inactive_objects
+        ) + tuple(
+            (panda_name, quantize(q, self.q_resolution))
+            for panda_name, q in sorted(panda_qs.items())
+            if station.panda_infos[panda_name].panda != panda
+        ) + tuple(
+            (panda_name, name, quantize(X_HO, self.pose_resolution))
+            for panda_name, (name, X_HO) in sorted(held_objects.items())
+        )
+        return (
+            self.problem,
+            station.get_name(),
+            plant.GetModelInstanceName(panda),
+            scene,
+            quantize(q_start, self.q_resolution),
+            quantize(q_goal, self.q_resolution),
+            tuple((k, kwargs.get(k)) for k in RESULT_KWARGS),
+        )
+
+    def get(self, key):
+        traj = self.cache.get(key)
+        if traj is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return traj
+
+    def put(self, key, traj):
+        self.cache[key] = traj
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.unchecked.discard(self.cache.popitem(last=False)[0])
+
+    def find_traj(self, station, station_context, q_start, q_goal, panda=None, **kwargs):
+        """
+        Like stream_utils.find_traj, but returns a cached trajectory if
+        one was already found for this query. Failures are not cached
+        """
+        if panda is None:
+            panda = station.get_panda()
+        key = self.key(station, station_context, panda, q_start, q_goal, **kwargs)
+        traj = self.get(key)
+        if traj is not None:
+            # the endpoints may differ from the cached ones by up to q_resolution
+            traj = traj.copy()
+            traj[0], traj[-1] = q_start, q_goal
+            if key in self.unchecked:
+                self.unchecked.discard(key)
+                if not self.is_valid(station, station_context, panda, traj, **kwargs):
+                    del self.cache[key]
+                    self.hits -= 1
+                    self.misses += 1
+                    traj = None
+        if traj is None:
+            traj = find_traj(station, station_context, q_start, q_goal, panda=panda, **kwargs)
+            if traj is not None:
+                self.put(key, traj)
+        return traj
+
+    def is_valid(self, station, station_context, panda, traj, **kwargs):
+        """
+        Collision check the cached trajectory traj (np.array) for a query
+        with the find_traj kwargs `kwargs`
+        """
+        ignore_qs = ()
+        if kwargs.get("ignore_endpoint_collisions"):
+            ignore_qs = (traj[0], traj[-1])
+        checker = CollisionChecker(
+            station,
+            station_context,
+            panda=panda,
+            ignore_qs=ignore_qs,
+            use_min_clearance=kwargs.get("use_min_clearance"),
+        )
+        limits = np.array(station.get_panda_joint_limits())
+        step = RESOLUTION * np.linalg.norm(limits[:, 1] - limits[:, 0])
+        return checker.is_valid_path(traj, step)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "size": len(self.cache),
+        }
+
+    def close(self):
+        """
+        Print (and return) the hit statistics, and save the cache
+        if it has a path
+        """
+        stats = self.stats()
+        print(
+            f"{Colors.BLUE}Motion cache: {stats['hits']} hits, "
+            f"{stats['misses']} misses ({100 * stats['hit_rate']:.1f}%){Colors.RESET}"
+        )
+        if self.path is not None:
+            self.save()
+        return stats
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        assert path is not None, "No path to save the motion cache to"
+        with open(path, "wb") as stream:
+            pickle.dump(self.cache, stream)
+
+    def load(self, path):
+        with open(path, "rb") as stream:
+            cache = pickle.load(stream)
+        self.cache.update(cache)
+        self.unchecked.update(cache)
+        print(f"{Colors.BLUE}Loaded {len(self.cache)} cached motions from {path}{Colors.RESET}")
+        while len(self.cache) > self.max_size:
+            self.unchecked.discard(self.cache.popitem(last=False)[0])
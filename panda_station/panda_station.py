@@ -1,6 +1,7 @@
 """
 A system used for TAMP experiments with the Franka Emika Panda arm and the Franka Emika Gripper
 """
+import weakref
 import numpy as np
 import pydrake.all
 from . import construction_utils
@@ -12,13 +13,28 @@ from .panda_hand_position_controller import (
 HAND_FRAME_NAME = "panda_hand"
 ARM_LINK_PREFIX = "panda_link"
 
+# parsed model directives, by path (see load_model_directives)
+MODEL_DIRECTIVES = {}
+
+
+def load_model_directives(path):
+    """
+    Load the model directives in the file `path`, parsing each file only
+    once, since every station built for a problem uses the same directive
+    """
+    if path not in MODEL_DIRECTIVES:
+        MODEL_DIRECTIVES[path] = pydrake.multibody.parsing.LoadModelDirectives(path)
+    return MODEL_DIRECTIVES[path]
+
 class PandaStation(pydrake.systems.framework.Diagram):
     """
     The PandaStation class
     TODO(agro): add cameras if nessecary
     """
 
-    def __init__(self, time_step=0.001, name = "panda_station", dummy = False):
+    def __init__(
+        self, time_step=0.001, name = "panda_station", dummy = False, robot_builder = None
+    ):
         """
         Construct a panda station
 
@@ -26,17 +42,30 @@ class PandaStation(pydrake.systems.framework.Diagram):
             time_step: simulation time step [float]
             name: the name of the station
             dummy: if True, none of the ports are connnected
+            robot_builder: if not None, a pydrake.planning.RobotDiagramBuilder
+            whose plant and scene graph the station is built into instead
+            (see collision_checking.NativeChecker). The station itself is
+            then never built; call robot_builder.Build() after finalize
         """
         pydrake.systems.framework.Diagram.__init__(self)
         self.time_step = time_step
         self.dummy = dummy
-        self.builder = pydrake.systems.framework.DiagramBuilder()
-        (
-            self.plant,
-            self.scene_graph,
-        ) = pydrake.multibody.plant.AddMultibodyPlantSceneGraph(
-            self.builder, time_step=self.time_step
-        )
+        self.robot_builder = robot_builder
+        if robot_builder is None:
+            self.builder = pydrake.systems.framework.DiagramBuilder()
+            (
+                self.plant,
+                self.scene_graph,
+            ) = pydrake.multibody.plant.AddMultibodyPlantSceneGraph(
+                self.builder, time_step=self.time_step
+            )
+        else:
+            self.builder = robot_builder.builder()
+            self.plant = robot_builder.plant()
+            self.scene_graph = robot_builder.scene_graph()
+        # if set, returns (RobotDiagram, PandaStation) for a copy of this
+        # station built with a RobotDiagramBuilder (see ProblemInfo.make_station)
+        self.make_robot_diagram = None
         # dict in the form: {object_name: (ObjectInfo, Xinit_WO)}
         self.object_infos = {}  # list of tuples (ObjectInfo, Xinit_WO)
         self.directive = None  # the directive used to setup the environment
@@ -47,6 +76,19 @@ class PandaStation(pydrake.systems.framework.Diagram):
         # (panda_model_index, hand_model_index, X_WB, name, weld_fingers)
         self.panda_infos = {}
         self.frame_groups = {}
+        # the per context state below is weakly keyed, so that it goes away
+        # with the context
+        # objects held at query time, per context (see hold):
+        # {station_context: {panda_name: [name, X_HO, filter_id]}}
+        self.held_objects = weakref.WeakKeyDictionary()
+        # objects excluded from collision queries, per context (see set_inactive_objects):
+        # {station_context: (names, filter_id)}
+        self.inactive_objects = weakref.WeakKeyDictionary()
+        # {names: (geometry ids, CollisionFilterDeclaration)}
+        self.inactive_declarations = {}
+        # the poses last set for the welded objects' frames, per context (see set_frame_pose):
+        # {station_context: {name: 4x4 X_PO}}
+        self.frame_poses = weakref.WeakKeyDictionary()
 
     def fix_collisions(self):
         """
@@ -179,13 +221,13 @@ class PandaStation(pydrake.systems.framework.Diagram):
         parser = pydrake.multibody.parsing.Parser(self.plant)
         construction_utils.add_package_paths(parser)
         pydrake.multibody.parsing.ProcessModelDirectives(
-            pydrake.multibody.parsing.LoadModelDirectives(self.directive),
+            load_model_directives(self.directive),
             self.plant,
             parser,
         )
         if names_and_links is not None:
             for name, link_name in names_and_links:
-                object_info = ObjectInfo(name)
+                object_info = ObjectInfo(name, directive=self.directive)
                 model = self.plant.GetModelInstanceByName(name)
                 body_indices = self.plant.GetBodyIndices(model)
                 for i in body_indices:
@@ -350,6 +392,187 @@ class PandaStation(pydrake.systems.framework.Diagram):
             joint_limits.append(joint.position_upper_limits()[0])
         return np.array(joint_limits)
 
+    def hold(self, station_context, name, panda_name, X_HO=None):
+        """
+        Make the welded object `name` held by the hand of the arm
+        `panda_name`, in station_context only. Its pose then follows the hand
+        (see update_held_objects) and it is collision checked against
+        everything but the hands, as if it was welded to the hand. This lets
+        one station with all objects welded to the world stand in for the
+        stations with an object welded to the hand.
+
+        Args:
+            station_context: the context for this station
+            name: the name of the held object
+            panda_name: the name of the arm holding it
+            X_HO: the pose of the object relative to the hand
+            (see set_grasp, defaults to 0.2 m in front of the hand)
+        """
+        self.release(station_context, panda_name)
+        if X_HO is None:
+            X_HO = pydrake.math.RigidTransform([0, 0, 0.2])
+        object_info = self.object_infos[name][0]
+        assert object_info.get_frame() is not None, f"{name} is not welded"
+        object_bodies = [info.get_body() for info in object_info.get_body_infos().values()]
+        object_set = self.plant.CollectRegisteredGeometries(object_bodies)
+        # everything welded to the world, like the other objects, which are
+        # filtered from colliding with each other
+        world = self.plant.GetBodiesWeldedTo(self.plant.world_body())
+        object_indices = set(body.index() for body in object_bodies)
+        environment_set = self.plant.CollectRegisteredGeometries(
+            [body for body in world if body.index() not in object_indices]
+        )
+        hand_bodies = []
+        for info in self.panda_infos.values():
+            hand_bodies += [self.plant.get_body(i) for i in self.plant.GetBodyIndices(info.hand)]
+        hand_set = self.plant.CollectRegisteredGeometries(hand_bodies)
+        declaration = (
+            pydrake.geometry.CollisionFilterDeclaration()
+            .AllowBetween(object_set, environment_set)
+            .ExcludeBetween(object_set, hand_set)
+        )
+        filter_id = self.collision_filter_manager(station_context).ApplyTransient(declaration)
+        held = self.held_objects.setdefault(station_context, {})
+        held[panda_name] = [name, X_HO, filter_id]
+        # the inactive objects' filter has to be applied after this one to win
+        inactive = self.get_inactive_objects(station_context)
+        if inactive:
+            self.set_inactive_objects(station_context, ())
+            self.set_inactive_objects(station_context, inactive)
+        self.update_held_objects(station_context)
+
+    def release(self, station_context, panda_name=None):
+        """
+        Undo hold for the object held by `panda_name` (or all held objects)
+        in station_context
+        """
+        held = self.held_objects.get(station_context)
+        if held is None:
+            return
+        manager = self.collision_filter_manager(station_context)
+        for name in list(held) if panda_name is None else [panda_name]:
+            if name in held:
+                manager.RemoveDeclaration(held.pop(name)[2])
+        if len(held) == 0:
+            del self.held_objects[station_context]
+
+    def inactive_declaration(self, names):
+        """
+        Returns (geometry ids, CollisionFilterDeclaration) excluding the
+        collision geometries of the objects `names` from all collision
+        queries, made once per set of names
+        """
+        names = frozenset(names)
+        if names not in self.inactive_declarations:
+            bodies = [
+                body_info.get_body()
+                for name in names
+                for body_info in self.object_infos[name][0].get_body_infos().values()
+            ]
+            ids = set()
+            for body in bodies:
+                ids.update(self.plant.GetCollisionGeometriesForBody(body))
+            all_bodies = [
+                self.plant.get_body(pydrake.multibody.tree.BodyIndex(i))
+                for i in range(self.plant.num_bodies())
+            ]
+            declaration = pydrake.geometry.CollisionFilterDeclaration().ExcludeBetween(
+                self.plant.CollectRegisteredGeometries(bodies),
+                self.plant.CollectRegisteredGeometries(all_bodies),
+            )
+            self.inactive_declarations[names] = (ids, declaration)
+        return self.inactive_declarations[names]
+
+    def set_inactive_objects(self, station_context, names):
+        """
+        Exclude the objects `names` from collision queries in
+        station_context (and include all others), so that queries only
+        consider the objects relevant to planning
+        """
+        names = frozenset(names)
+        entry = self.inactive_objects.get(station_context)
+        if entry is not None:
+            if entry[0] == names:
+                return
+            self.collision_filter_manager(station_context).RemoveDeclaration(entry[1])
+            del self.inactive_objects[station_context]
+        if len(names) == 0:
+            return
+        _, declaration = self.inactive_declaration(names)
+        filter_id = self.collision_filter_manager(station_context).ApplyTransient(declaration)
+        self.inactive_objects[station_context] = (names, filter_id)
+
+    def get_inactive_objects(self, station_context):
+        entry = self.inactive_objects.get(station_context)
+        return frozenset() if entry is None else entry[0]
+
+    def get_inactive_geometry_ids(self, station_context):
+        names = self.get_inactive_objects(station_context)
+        if len(names) == 0:
+            return set()
+        return self.inactive_declaration(names)[0]
+
+    def reset_context(self, station_context):
+        """
+        Release all held objects and activate all objects in station_context
+        """
+        self.release(station_context)
+        self.set_inactive_objects(station_context, ())
+
+    def collision_filter_manager(self, station_context):
+        scene_graph_context = self.GetSubsystemContext(self.scene_graph, station_context)
+        return self.scene_graph.collision_filter_manager(scene_graph_context)
+
+    def get_held_objects(self, station_context):
+        """
+        Returns {panda_name: (object name, X_HO)} for the objects held
+        in station_context
+        """
+        held = self.held_objects.get(station_context)
+        if held is None:
+            return {}
+        return {panda_name: (name, X_HO) for panda_name, (name, X_HO, _) in held.items()}
+
+    def set_grasp(self, station_context, name, X_HO):
+        """
+        Set the pose X_HO of the held object `name` relative to the hand
+        """
+        held = self.held_objects[station_context]
+        for info in held.values():
+            if info[0] == name:
+                info[1] = X_HO
+        self.update_held_objects(station_context)
+
+    def update_held_objects(self, station_context):
+        """
+        Move the held objects in station_context to their hands
+        (call this after the arms move)
+        """
+        held = self.held_objects.get(station_context)
+        if held is None:
+            return
+        plant_context = self.GetSubsystemContext(self.plant, station_context)
+        for panda_name, (name, X_HO, _) in held.items():
+            hand = self.plant.GetBodyByName(HAND_FRAME_NAME, self.panda_infos[panda_name].hand)
+            X_WH = self.plant.EvalBodyPoseInWorld(plant_context, hand)
+            self.set_frame_pose(station_context, name, X_WH.multiply(X_HO))
+
+    def set_frame_pose(self, station_context, name, X_PO):
+        """
+        Set the pose X_PO of the frame that the object `name` is welded to
+        (relative to its parent frame) in station_context, unless it is
+        already there, so that unchanged poses do not invalidate the
+        plant's cached kinematics. Returns True iff the pose changed
+        """
+        X = X_PO.GetAsMatrix4()
+        poses = self.frame_poses.setdefault(station_context, {})
+        if name in poses and np.array_equal(poses[name], X):
+            return False
+        plant_context = self.GetSubsystemContext(self.plant, station_context)
+        self.object_infos[name][0].get_frame().SetPoseInBodyFrame(plant_context, X_PO)
+        poses[name] = X
+        return True
+
     def finalize(self):
         """finalize the panda station"""
 
@@ -392,6 +615,10 @@ class PandaStation(pydrake.systems.framework.Diagram):
             main_body = object_info.main_body_info.get_body()
             self.plant.SetDefaultFreeBodyPose(main_body, Xinit_WO)
 
+        if self.robot_builder is not None:
+            # the RobotDiagramBuilder exports the ports itself
+            return
+
         if self.dummy:
             infos = []
         else:
@@ -579,7 +806,7 @@ class ObjectInfo:
     Class for storing all bodies associated with an object
     """
 
-    def __init__(self, name, welded_to_frame=None, path=None):
+    def __init__(self, name, welded_to_frame=None, path=None, directive=None):
         """
         Construct an ObjectInfo object
 
@@ -587,8 +814,11 @@ class ObjectInfo:
             welded_to_frame: the FixedOffsetFrame that the main body is welded
             to (optional)
             path: the absolute filepath used to find the model (optional)
+            directive: the directive the model was added from, if it was not
+            added from path (optional)
         """
         self.path = path
+        self.directive = directive
         self.main_body_info = None
         self.welded_to_frame = welded_to_frame
         self.body_infos = {}
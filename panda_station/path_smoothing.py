@@ -0,0 +1,193 @@
+"""
+This module contains the post-processing of motion plans: paths found by
+a planner are shortcut against the collision checker under a time budget,
+either inline or in a background thread after the raw path has been used.
+"""
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .collision_checking import CollisionChecker
+from .planning_utils import get_station_state, set_station_state
+
+# the PathSmoother used by find_traj(simplify = "async")
+PATH_SMOOTHER = None
+
+
+def path_length(qs):
+    return np.sum(np.linalg.norm(np.diff(qs, axis=0), axis=1))
+
+
+def point_on_path(qs, cumulative, s):
+    """
+    Return (i, q): the configuration q at arc length s along the path
+    through qs, which lies on the segment from qs[i] to qs[i + 1]
+    """
+    i = int(np.clip(np.searchsorted(cumulative, s, side="right") - 1, 0, len(qs) - 2))
+    length = cumulative[i + 1] - cumulative[i]
+    t = 0.0 if length == 0 else (s - cumulative[i]) / length
+    return i, qs[i] + t * (qs[i + 1] - qs[i])
+
+
+def remove_redundant(checker, qs, step):
+    """
+    Greedily connect each configuration in qs to the furthest one
+    it has a collision free straight line to
+    """
+    res = [qs[0]]
+    i = 0
+    while i < len(qs) - 1:
+        j = len(qs) - 1
+        while j > i + 1 and not checker.is_valid_motion(qs[i], qs[j], step):
+            j -= 1
+        res.append(qs[j])
+        i = j
+    return np.array(res)
+
+
+def shortcut_path(checker, qs, step, time_budget=0.1, max_attempts=200, seed=0):
+    """
+    Shorten the collision free path through the configurations qs (np.array)
+    by repeatedly replacing the part of it between two random points with a
+    straight line, if that line is collision free (see
+    CollisionChecker.is_valid_motion). Stops after max_attempts or when
+    time_budget (s) runs out, whichever comes first.
+    The endpoints of the path are kept
+    """
+    deadline = time.time() + time_budget
+    rng = np.random.default_rng(seed)
+    qs = remove_redundant(checker, np.asarray(qs, dtype=float), step)
+    for _ in range(max_attempts):
+        if len(qs) < 3 or time.time() > deadline:
+            break
+        cumulative = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(qs, axis=0), axis=1))))
+        s1, s2 = np.sort(rng.uniform(0, cumulative[-1], size=2))
+        i, q1 = point_on_path(qs, cumulative, s1)
+        j, q2 = point_on_path(qs, cumulative, s2)
+        # only worth checking if it skips a waypoint
+        if j <= i:
+            continue
+        if not checker.is_valid_motion(q1, q2, step):
+            continue
+        qs = np.vstack((qs[: i + 1], q1[None], q2[None], qs[j + 1 :]))
+    return remove_redundant(checker, qs, step)
+
+
+def densify(checker, qs, step):
+    """
+    Return the configurations along the path through qs spaced
+    at most `step` apart
+    """
+    res = [qs[0]]
+    for q1, q2 in zip(qs[:-1], qs[1:]):
+        res.extend(checker.interpolate(q1, q2, step)[1])
+    return np.array(res)
+
+
+class PathSmoother:
+    """
+    Shortcuts paths in a background thread, so that a stream can yield a
+    feasible path right away and the shortened one is used when the plan is
+    turned into a trajectory (see PlanToTrajectory.move). Each job checks
+    collisions in its own copy of the station's context, in the state the
+    station was in when the job was submitted.
+    """
+
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # id(raw path) -> (raw path, future)
+        self.jobs = {}
+        self.num_improved = 0
+
+    def smooth(self, station, state, panda, qs, step, ignore_qs, use_min_clearance, interpolate, **kwargs):
+        station_context = station.CreateDefaultContext()
+        set_station_state(station, station_context, state)
+        try:
+            checker = CollisionChecker(
+                station,
+                station_context,
+                panda=panda,
+                ignore_qs=ignore_qs,
+                use_min_clearance=use_min_clearance,
+            )
+            res = shortcut_path(checker, qs, step, **kwargs)
+            if path_length(res) < path_length(qs):
+                self.num_improved += 1
+            return densify(checker, res, step) if interpolate else res
+        finally:
+            station.reset_context(station_context)
+
+    def submit(
+        self,
+        station,
+        station_context,
+        panda,
+        qs,
+        step,
+        ignore_qs=(),
+        use_min_clearance=None,
+        interpolate=False,
+        qs_to_smooth=None,
+        **kwargs
+    ):
+        """
+        Start shortcutting the path qs (np.array), found for panda in
+        station in its current state. qs_to_smooth optionally gives the
+        waypoints of qs to start from (if qs is interpolated).
+        kwargs are passed to shortcut_path
+        """
+        state = get_station_state(station, station_context)
+        future = self.executor.submit(
+            self.smooth,
+            station,
+            state,
+            panda,
+            (qs if qs_to_smooth is None else qs_to_smooth).copy(),
+            step,
+            [np.asarray(q) for q in ignore_qs],
+            use_min_clearance,
+            interpolate,
+            **kwargs
+        )
+        self.jobs[id(qs)] = (qs, future)
+
+    def result(self, qs, timeout=None):
+        """
+        Returns the shortcut version of the path qs if it was submitted, and
+        its job finishes within timeout (s, None to wait for it),
+        otherwise qs itself
+        """
+        job = self.jobs.get(id(qs))
+        if job is None or job[0] is not qs:
+            return qs
+        try:
+            return job[1].result(timeout=timeout)
+        except Exception:
+            return qs
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def get_path_smoother():
+    """
+    Return the PathSmoother used by find_traj(simplify = "async"),
+    starting it if needed
+    """
+    global PATH_SMOOTHER
+    if PATH_SMOOTHER is None:
+        PATH_SMOOTHER = PathSmoother()
+        atexit.register(PATH_SMOOTHER.close)
+    return PATH_SMOOTHER
+
+
+def smoothed_path(qs, timeout=None):
+    """
+    Returns the shortcut version of qs if it was submitted to the
+    PathSmoother, otherwise qs itself
+    """
+    if PATH_SMOOTHER is None:
+        return qs
+    return PATH_SMOOTHER.result(qs, timeout=timeout)
@@ -1,4 +1,5 @@
 from panda_station.trajectory_generation import MotionGenerator
+from panda_station.path_smoothing import smoothed_path
 import numpy as np
 from pydrake.all import PiecewisePolynomial
 from enum import Enum
@@ -10,6 +11,7 @@ GRASP_TIME = 1.35
 #TODO(agro): pass in as argument
 Q_INITIAL =np.array([0.0, 0.1, 0, -1.2, 0, 1.6, 0])
 SPEED_FACTOR = 0.2
+GENERATOR_TIME_STEP = 1e-3
 DOF = 7
 
 class TrajType(Enum):
@@ -68,23 +70,21 @@ class PlanToTrajectory:
 
     @staticmethod
     def make_generator_panda_traj(qs, start_time):
-        panda_traj = []
-        times = []
-        res_qs = []
+        times = [np.array([start_time])]
+        res_qs = [np.asarray(qs[0]).reshape((1, DOF))]
         for q1, q2 in zip(qs[:-1], qs[1:]):
             gen = MotionGenerator(SPEED_FACTOR, q1, q2)
-            t = 0
-            while True:
-                times.append(t + start_time)
-                q, finished = gen(t)
-                res_qs.append(q.reshape((DOF, 1)))
-                if finished:
-                    break
-                t += 1e-3
-
-        qs = np.concatenate(res_qs, axis = 1)
-        times = np.array(times)
-        panda_traj = PiecewisePolynomial.FirstOrderHold(times, qs)
+            segment_times, segment_qs = gen.sample(GENERATOR_TIME_STEP)
+            # each segment starts where the last one ended
+            times.append(segment_times[1:] + times[-1][-1])
+            res_qs.append(segment_qs[1:])
+
+        times = np.concatenate(times)
+        qs = np.concatenate(res_qs)
+        if len(times) == 1:
+            times = np.append(times, start_time + GENERATOR_TIME_STEP)
+            qs = np.vstack((qs, qs))
+        panda_traj = PiecewisePolynomial.FirstOrderHold(times, qs.T)
         return panda_traj, times
 
     def make_panda_traj(self, qs, start_time):
@@ -143,6 +143,8 @@ class PlanToTrajectory:
         panda_traj, hand_traj = self.get_trajs(panda_name)
         _, last_hand_q = self.get_curr_q(panda_name)
         start_time = self.get_curr_time(panda_name)
+        # use the shortcut path if it was smoothed in the background
+        traj = smoothed_path(traj)
         panda_traj, times = self.make_panda_traj(traj, start_time)
         hand_traj = self.make_hand_traj(
             last_hand_q[0][0], last_hand_q[0][0], times[0], times[-1]
@@ -253,7 +255,7 @@ class PlanToTrajectory:
                 if i == len(plan) - 1:
                     f.write(self.numpy_conf_to_str(args[-1]))
             else:
-                traj = args[-1]
+                traj = smoothed_path(args[-1])
                 for q in traj:
                     f.write(self.numpy_conf_to_str(q))
         f.close()
@@ -0,0 +1,171 @@
+"""
+This module contains a motion planner that races several OMPL planners
+on the same query in a pool of worker processes, returning the first
+collision free trajectory found.
+"""
+import atexit
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+from .planning_utils import ProblemInfo, StationPool, get_station_state, set_station_state
+from .utils import Colors
+
+DEFAULT_RACE = ("rrtconnect", "lbkpiece1", "bitrrt")
+
+# the PlannerRace used by find_traj(planner = "race")
+PLANNER_RACE = None
+
+# worker process state (see init_worker)
+WORKER = {}
+
+
+def init_worker(problem_file, cancelled):
+    WORKER["stations"] = StationPool(ProblemInfo(problem_file))
+    WORKER["cancelled"] = cancelled
+
+
+def plan_in_worker(query_id, name, arm_name, state, q_start, q_goal, planner, max_time, interpolate):
+    """
+    Plan from q_start to q_goal with `planner` in this worker's copy of the
+    station, after setting it to `state` (see planning_utils.get_station_state)
+    """
+    from .stream_utils import find_traj
+
+    # the first query on each station in this worker builds it
+    station, station_context = WORKER["stations"].get(name, arm_name)
+    set_station_state(station, station_context, state)
+    cancelled = WORKER["cancelled"]
+    return planner, find_traj(
+        station,
+        station_context,
+        q_start,
+        q_goal,
+        panda=station.panda_infos[arm_name].panda,
+        interpolate=interpolate,
+        planner=planner,
+        max_time=max_time,
+        should_stop=lambda: cancelled.value >= query_id,
+    )
+
+
+class PlannerRace:
+    """
+    Races several planners on each motion planning query, in a pool of
+    worker processes that each build their own copies of the stations from
+    the problem file (the first query on each station in each worker pays
+    for building it). The first planner to find a trajectory wins and the
+    others are cancelled.
+    """
+
+    def __init__(
+        self, problem_file, planners=DEFAULT_RACE, timeout=10.0, processes=None
+    ):
+        """
+        Construct a PlannerRace
+
+        Args:
+            problem_file: the .yaml problem file the stations were built from
+            planners: the names of the planners to race (see find_traj)
+            timeout: hard time limit (s) for each query
+            processes: number of worker processes (defaults to one per planner)
+        """
+        self.planners = planners
+        self.timeout = timeout
+        # fork is not safe with the threads torch/drake may have started
+        context = multiprocessing.get_context("spawn")
+        self.cancelled = context.Value("i", -1)
+        self.pool = context.Pool(
+            processes or len(planners),
+            initializer=init_worker,
+            initargs=(problem_file, self.cancelled),
+        )
+        self.query_id = 0
+        self.wins = {planner: 0 for planner in planners}
+        self.timeouts = 0
+
+    @staticmethod
+    def station_key(station, panda):
+        """
+        Returns the (name, arm_name) needed to rebuild station in a worker
+        """
+        arm_name = None
+        for panda_name, panda_info in station.panda_infos.items():
+            if panda_info.panda == panda:
+                arm_name = panda_name
+        name = station.get_name()
+        if name != "move_free":
+            # find the arm whose hand the object is welded to
+            frame = station.object_infos[name][0].get_frame()
+            model = frame.body().model_instance()
+            for panda_name, panda_info in station.panda_infos.items():
+                if panda_info.hand == model:
+                    return name, panda_name
+        return name, arm_name
+
+    def find_traj(self, station, station_context, q_start, q_goal, panda=None, interpolate=False):
+        """
+        Race the planners from q_start to q_goal in (a copy of) station.
+        Returns the first trajectory found, or None if none is found
+        within the timeout
+        """
+        if panda is None:
+            panda = station.get_panda()
+        self.query_id += 1
+        name, arm_name = self.station_key(station, panda)
+        state = get_station_state(station, station_context)
+        results = queue.Queue()
+        for planner in self.planners:
+            self.pool.apply_async(
+                plan_in_worker,
+                (
+                    self.query_id,
+                    name,
+                    arm_name,
+                    state,
+                    np.asarray(q_start),
+                    np.asarray(q_goal),
+                    planner,
+                    self.timeout,
+                    interpolate,
+                ),
+                callback=results.put,
+                error_callback=lambda e: results.put((None, None)),
+            )
+        deadline = time.time() + self.timeout
+        traj = None
+        for _ in self.planners:
+            try:
+                planner, traj = results.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                self.timeouts += 1
+                print(f"{Colors.RED}Planner race timed out{Colors.RESET}")
+                break
+            if traj is not None:
+                self.wins[planner] += 1
+                break
+        # stop the planners still running on this query
+        self.cancelled.value = self.query_id
+        return traj
+
+    def close(self):
+        self.pool.terminate()
+
+
+def start_planner_race(problem_file, **kwargs):
+    """
+    Start the PlannerRace used by find_traj(planner = "race").
+    kwargs are passed to PlannerRace
+    """
+    global PLANNER_RACE
+    if PLANNER_RACE is not None:
+        PLANNER_RACE.close()
+    PLANNER_RACE = PlannerRace(problem_file, **kwargs)
+    atexit.register(PLANNER_RACE.close)
+    return PLANNER_RACE
+
+
+def get_planner_race():
+    assert PLANNER_RACE is not None, "Call start_planner_race before planning with planner = \"race\""
+    return PLANNER_RACE
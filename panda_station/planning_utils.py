@@ -5,6 +5,10 @@ with PDDL and the streams (generators)
 This module contains convenience classes ObjectInfo
 BodyInfo and ShapeInfo. Objects are made of bodies which are made of shapes
 """
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import yaml
 import numpy as np
 from pydrake.all import (
@@ -22,6 +26,7 @@ from .grasping_and_placing import (
     is_graspable, 
     is_safe_to_place
 )
+from .shape_analysis import graspable_shapes, placeable_shapes, target_surfaces
 
 
 class ProblemInfo:
@@ -100,6 +105,7 @@ class ProblemInfo:
         dummy = False,
         time_step = 1e-3,
         blocked = False,
+        robot_builder = None,
     ):
         """
         Makes a PandaStation based on this problem instance.
@@ -109,10 +115,24 @@ class ProblemInfo:
             weld_to_world: the names of objects to weld to the world
             weld_to_hand: the name of the object to weld to hand
             X_PO: override the rigid transform of this object wrt it's parent
+            robot_builder: build the station into this RobotDiagramBuilder
+            (see make_robot_diagram)
         Returns:
             the newly created PandaStation
         """
-        station = PandaStation(name=name, dummy = dummy, time_step = time_step)
+        station = PandaStation(
+            name=name, dummy = dummy, time_step = time_step, robot_builder = robot_builder
+        )
+        mirror_kwargs = dict(
+            weld_to_hand=weld_to_hand,
+            weld_fingers=weld_fingers,
+            arm_name=arm_name,
+            name=name,
+            X_PO=X_PO,
+            planning=planning,
+            time_step=time_step,
+            blocked=blocked,
+        )
         directive = self.directive
         if planning:
             directive = self.planning_directive
@@ -164,8 +184,31 @@ class ProblemInfo:
             )
 
         station.finalize()
+        if robot_builder is None:
+            station.make_robot_diagram = lambda: self.make_robot_diagram(
+                weld_to_world, **mirror_kwargs
+            )
         return station
 
+    def make_robot_diagram(self, *args, time_step=1e-3, **kwargs):
+        """
+        Makes the station make_station(*args, **kwargs) would, but built
+        into a pydrake.planning.RobotDiagramBuilder for collision checking
+        (see collision_checking.NativeChecker)
+
+        Returns:
+            (RobotDiagram, PandaStation) where the PandaStation holds the
+            construction info (object_infos, panda_infos, ...) for the
+            plant of the RobotDiagram
+        """
+        from pydrake.planning import RobotDiagramBuilder
+
+        robot_builder = RobotDiagramBuilder(time_step=time_step)
+        station = self.make_station(
+            *args, time_step=time_step, robot_builder=robot_builder, **kwargs
+        )
+        return robot_builder.Build(), station
+
     def make_main_station(self, time_step = 1e-4):
         """
         Make the main station for TAMP: a station with no objects welded
@@ -290,6 +333,158 @@ class ProblemInfo:
         return res
 
 
+class StationPool:
+    """
+    The planning stations of a problem, each with its own Context:
+    "move_free", and one holding station per (object, arm), which is only
+    built the first time it is needed (optionally ahead of time, in
+    background threads, see prefetch).
+
+    With single_plant, the holding "stations" are instead contexts of the
+    move_free station in which the object is held (see PandaStation.hold),
+    so no station is built per object.
+
+    Each station also has a pool of spare Contexts (see checkout), so that
+    streams can keep their own state and run concurrently.
+    """
+
+    def __init__(self, problem_info, stations=None, max_workers=1, single_plant=False):
+        """
+        Construct a StationPool
+
+        Args:
+            problem_info: the ProblemInfo to build stations from
+            stations: optional dict {name: station} of already built
+            stations (eg. "main", "move_free") to add to the pool
+            max_workers: number of threads used by prefetch
+            single_plant: if True, hold objects in the move_free station
+            rather than building holding stations
+        """
+        self.problem_info = problem_info
+        self.max_workers = max_workers
+        self.single_plant = single_plant
+        self.executor = None
+        self.lock = threading.Lock()
+        # (name, arm_name) -> (station, station_context) or Future
+        self.stations = {}
+        # (name, arm_name) -> [station_context] not checked out (see checkout)
+        self.free_contexts = {}
+        if stations is not None:
+            for name, station in stations.items():
+                self.stations[(name, None)] = (station, station.CreateDefaultContext())
+
+    def key(self, name, arm_name=None):
+        if name in ("main", "move_free", "blocked") or name not in self.problem_info.objects:
+            return name, None
+        if arm_name is None:
+            arm_name = list(self.problem_info.arms.values())[0]["panda_name"]
+        return name, arm_name
+
+    def build(self, name, arm_name):
+        if name == "move_free":
+            station = self.problem_info.make_move_free_station()
+        elif name == "blocked":
+            station = self.problem_info.make_blocked_free_station()
+        elif self.single_plant:
+            station = self.get("move_free")[0]
+            station_context = station.CreateDefaultContext()
+            station.hold(station_context, name, arm_name)
+            return station, station_context
+        else:
+            station = self.problem_info.make_holding_station(name, arm_name=arm_name)
+        return station, station.CreateDefaultContext()
+
+    def get(self, name, arm_name=None):
+        """
+        Returns (station, station_context) for the station named `name`
+        ("move_free" or an object held by the arm `arm_name`, which
+        defaults to the first arm), building it if needed
+        """
+        key = self.key(name, arm_name)
+        with self.lock:
+            entry = self.stations.get(key)
+            if entry is None:
+                entry = self.stations[key] = Future()
+                entry.set_running_or_notify_cancel()
+                building = True
+            else:
+                building = False
+        if building:
+            try:
+                entry.set_result(self.build(*key))
+            except Exception as e:
+                entry.set_exception(e)
+                with self.lock:
+                    del self.stations[key]
+                raise
+        if isinstance(entry, Future):
+            entry = entry.result()
+            with self.lock:
+                self.stations[key] = entry
+        return entry
+
+    def __getitem__(self, name):
+        return self.get(name)[0]
+
+    def checkout(self, name, arm_name=None):
+        """
+        Returns (station, station_context) like get, but with a Context
+        that no one else uses until it is returned with checkin
+        """
+        key = self.key(name, arm_name)
+        station = self.get(*key)[0]
+        with self.lock:
+            free = self.free_contexts.get(key)
+            station_context = free.pop() if free else None
+        if station_context is None:
+            station_context = station.CreateDefaultContext()
+            if self.single_plant and key[1] is not None:
+                station.hold(station_context, *key)
+        return station, station_context
+
+    def checkin(self, name, arm_name, station_context):
+        """
+        Return a Context from checkout to the pool
+        """
+        key = self.key(name, arm_name)
+        with self.lock:
+            self.free_contexts.setdefault(key, []).append(station_context)
+
+    @contextmanager
+    def context(self, name, arm_name=None):
+        """
+        Context manager for checkout and checkin:
+
+        with station_pool.context("move_free") as (station, station_context):
+            ...
+        """
+        station, station_context = self.checkout(name, arm_name)
+        try:
+            yield station, station_context
+        finally:
+            self.checkin(name, arm_name, station_context)
+
+    def prefetch(self, names=None, arm_names=None):
+        """
+        Start building the stations for the objects `names` (defaults to
+        all objects), held by each arm in `arm_names` (defaults to all
+        arms), in background threads
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        if names is None:
+            names = list(self.problem_info.objects)
+        if arm_names is None:
+            arm_names = [arm["panda_name"] for arm in self.problem_info.arms.values()]
+        for name in names:
+            for arm_name in arm_names:
+                self.executor.submit(self.get, name, arm_name)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
 def parse_start_poses(station, station_context):
     """
     Parses the information in PandaStation `station` to obtain the start
@@ -378,7 +573,68 @@ def update_arm(station, station_context, panda_name, q):
     plant = station.get_multibody_plant()
     plant_context = station.GetSubsystemContext(plant, station_context)
     panda = station.panda_infos[panda_name].panda
+    if np.array_equal(plant.GetPositions(plant_context, panda), q):
+        return
     plant.SetPositions(plant_context, panda, q)
+    station.update_held_objects(station_context)
+
+def get_station_state(station, station_context):
+    """
+    Returns the state that update_station and update_arm set:
+    a tuple (frame_poses, panda_qs, held_objects, inactive_objects) where
+    frame_poses maps the names of all welded objects to the 4x4 pose of
+    their frame (relative to the body they are welded to), panda_qs maps
+    each arm name to its configuration, held_objects maps arm names to
+    (name, 4x4 X_HO) for the objects they hold (see PandaStation.hold) and
+    inactive_objects is the set of objects left out of collision queries
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    held_objects = {
+        panda_name: (name, X_HO.GetAsMatrix4())
+        for panda_name, (name, X_HO) in station.get_held_objects(station_context).items()
+    }
+    held_names = set(name for name, _ in held_objects.values())
+    frame_poses = {}
+    for name, (object_info, _) in station.object_infos.items():
+        frame = object_info.get_frame()
+        if frame is not None and name not in held_names:
+            frame_poses[name] = frame.CalcPoseInBodyFrame(plant_context).GetAsMatrix4()
+    panda_qs = {
+        panda_name: plant.GetPositions(plant_context, panda_info.panda)
+        for panda_name, panda_info in station.panda_infos.items()
+    }
+    inactive_objects = station.get_inactive_objects(station_context)
+    return frame_poses, panda_qs, held_objects, inactive_objects
+
+def set_station_state(station, station_context, state):
+    """
+    Set the station to a state returned by get_station_state
+    (possibly of another station built from the same problem)
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    frame_poses, panda_qs, held_objects, inactive_objects = state
+    # only what differs from the current state is changed
+    held = station.get_held_objects(station_context)
+    held_changed = held.keys() != held_objects.keys() or any(
+        held[panda_name][0] != name or not np.array_equal(held[panda_name][1].GetAsMatrix4(), X_HO)
+        for panda_name, (name, X_HO) in held_objects.items()
+    )
+    if held_changed:
+        station.release(station_context)
+    for name, X in frame_poses.items():
+        station.set_frame_pose(station_context, name, RigidTransform(X))
+    for panda_name, q in panda_qs.items():
+        panda = station.panda_infos[panda_name].panda
+        if not np.array_equal(plant.GetPositions(plant_context, panda), q):
+            plant.SetPositions(plant_context, panda, q)
+    if held_changed:
+        for panda_name, (name, X_HO) in held_objects.items():
+            station.hold(station_context, name, panda_name, RigidTransform(X_HO))
+    else:
+        station.update_held_objects(station_context)
+    station.set_inactive_objects(station_context, inactive_objects)
 
 def update_station(station, station_context, pose_fluents, set_to_inf=[]):
     """
@@ -395,38 +651,63 @@ def update_station(station, station_context, pose_fluents, set_to_inf=[]):
         [('atpose', object_info_name, X_WO), ..., ('atgraspose', object_info_name, X_WH)]
         X* can be either Drake's RigidTransform or a RigidTransformWrapper
 
-        set_to_inf: A list of object names whose poses will be set to
-        infinity (far away) so they are not considerd in planning
+        set_to_inf: A list of object names which, unless their poses are
+        in pose_fluents, are excluded from collision queries so they are not
+        considerd in planning (see PandaStation.set_inactive_objects).
+        If None, this applies to all objects
     Returns:
         None, but updates the welded station provided in welded_station
     """
-    plant = station.get_multibody_plant()
-    plant_context = station.GetSubsystemContext(plant, station_context)
+    held_names = set(name for name, _ in station.get_held_objects(station_context).values())
     set_pose = []
     for _, name, X_PO in pose_fluents:
         if isinstance(X_PO, RigidTransformWrapper):
             X_PO = X_PO.get_rt()
         set_pose.append(name)
+        if name in held_names:
+            # X_PO is the grasp, relative to the hand
+            station.set_grasp(station_context, name, X_PO)
+            continue
         object_info = station.object_infos[name][0]
         offset_frame = object_info.get_frame()
         assert (
             offset_frame is not None
         ), "you are trying to set the pose of a free object"
-        offset_frame.SetPoseInBodyFrame(plant_context, X_PO)
+        # frames already at X_PO are left alone
+        station.set_frame_pose(station_context, name, X_PO)
 
 
-    X_WO = RigidTransform(RotationMatrix(), [10, 0, 0])
+    inactive = []
     for object_info, Xinit_WO in list(station.object_infos.values()):
         if object_info.get_name() in set_pose:  # its pose has been set
             continue
         if Xinit_WO is None:  # it is not a manipuland
             continue
+        if object_info.get_name() in held_names:
+            continue
         if (set_to_inf is not None) and object_info.get_name() not in set_to_inf:
             continue
-        offset_frame = object_info.get_frame()
-        offset_frame.SetPoseInBodyFrame(plant_context, X_WO)
-        # spacing of 5 m should be far enough
-        X_WO.set_translation(X_WO.translation() + np.array([5, 0, 0]))
+        inactive.append(object_info.get_name())
+    # rather than moving them out of the way, leave them out of collision queries
+    station.set_inactive_objects(station_context, inactive)
+
+
+@contextmanager
+def updated_station(station, station_context, pose_fluents, set_to_inf=[]):
+    """
+    Context manager for update_station: the station is updated for the
+    body of the with statement, then put back in the state it was in
+    (changing only what differs, see set_station_state)
+
+    with updated_station(station, station_context, fluents):
+        ...
+    """
+    state = get_station_state(station, station_context)
+    update_station(station, station_context, pose_fluents, set_to_inf=set_to_inf)
+    try:
+        yield station, station_context
+    finally:
+        set_station_state(station, station_context, state)
 
 
 def update_graspable_shapes(object_info):
@@ -436,7 +717,7 @@ def update_graspable_shapes(object_info):
     """
     if len(object_info.graspable_shapes) > 0:
         return object_info.graspable_shapes
-    shapes = object_info.query_shape_infos(is_graspable)
+    shapes = graspable_shapes(object_info)
     object_info.graspable_shapes = shapes
     return shapes
 
@@ -447,7 +728,7 @@ def update_placeable_shapes(object_info):
     """
     if len(object_info.placeable_shapes) > 0:
         return object_info.placeable_shapes
-    shapes = object_info.query_shape_infos(is_placeable)
+    shapes = placeable_shapes(object_info)
     object_info.placeable_shapes = shapes
     return shapes
 
@@ -459,16 +740,9 @@ def update_surfaces(object_info, link_name, station, station_context):
     """
     if link_name in object_info.surfaces:
         return object_info.surfaces[link_name]
-    for body_info in object_info.get_body_infos().values():
-        if link_name != body_info.get_name():
-            continue
-        object_info.surfaces[link_name] = []
-        for shape_info in body_info.get_shape_infos():
-            is_safe, surface = is_safe_to_place(shape_info, station, station_context)
-            if not is_safe:
-                continue
-            object_info.surfaces[link_name].append(surface)
-
+    object_info.surfaces[link_name] = target_surfaces(
+        object_info, link_name, station, station_context
+    )
     return object_info.surfaces[link_name]
 
 def random_q(station):
@@ -493,6 +767,20 @@ def random_normal_q(station, q_nominal):
     )
     return np.clip(rand_q, lower, upper)
 
+def backup_variants(grasp_q, dist, panda_info = None):
+    """
+    Return the variants (see ik_executor.solve_variants) of backing up from
+    grasp_q by `dist`, then 1 cm less at a time
+    """
+    from .ik_executor import STATION, STATION_CONTEXT, station_panda
+
+    arm = None if panda_info is None else station_panda(panda_info)
+    dists = dist - 0.01 * np.arange(int(np.ceil(round(dist / 0.01, 6))))
+    return [
+        ((grasp_q, STATION, STATION_CONTEXT), {"d": d, "panda_info": arm})
+        for d in dists
+    ]
+
 # TODO(agro): this currently only supports one panda
 def pre_and_post_grasps(station, station_context, grasp_q, dist = 0.07, panda_info = None):
     """
@@ -501,31 +789,21 @@ def pre_and_post_grasps(station, station_context, grasp_q, dist = 0.07, panda_in
     grasp_q. `dist` is the optimal distance between the pre/post grasp
     end effector poses and the grasp end effector pose
     """
+    from .ik_executor import solve_variants
+
+    panda = None if panda_info is None else panda_info.panda
+    variants = backup_variants(grasp_q, dist, panda_info = panda_info)
     pregrasp_q, postgrasp_q = grasp_q.copy(), grasp_q.copy()
-    set_pregrasp = False
-    set_postgrasp = False
-    while (dist > 0) and not (set_pregrasp and set_postgrasp):
-        q, cost = backup_on_hand_z(
-            grasp_q, 
-            station, 
-            station_context, 
-            d = dist,
-            panda_info = panda_info
-        )
-        if np.isfinite(cost) and not set_pregrasp:
-            pregrasp_q = q
-            set_pregrasp = True
-        q, cost = backup_on_world_z(
-            grasp_q, 
-            station, 
-            station_context, 
-            d = dist,
-            panda_info = panda_info
-        )
-        if np.isfinite(cost) and not set_postgrasp:
-            postgrasp_q = q
-            set_postgrasp = True
-        dist -= 0.01
+    q, cost = solve_variants(
+        station, station_context, backup_on_hand_z, variants, panda = panda, accept = "ordered"
+    )
+    if np.isfinite(cost):
+        pregrasp_q = q
+    q, cost = solve_variants(
+        station, station_context, backup_on_world_z, variants, panda = panda, accept = "ordered"
+    )
+    if np.isfinite(cost):
+        postgrasp_q = q
     return pregrasp_q, postgrasp_q
 
 def find_pregrasp(station, station_context, grasp_q, dist = 0.07, panda_info = None):
@@ -535,15 +813,15 @@ def find_pregrasp(station, station_context, grasp_q, dist = 0.07, panda_info = N
     grasp_q. `dist` is the optimal distance between the pre/post grasp
     end effector poses and the grasp end effector pose
     """
-    while (dist > 0):
-        q, cost = backup_on_hand_z(
-            grasp_q, 
-            station, 
-            station_context, 
-            d = dist,
-            panda_info = panda_info
-        )
-        if np.isfinite(cost):
-            return q
-        dist -= 0.01
+    from .ik_executor import solve_variants
+
+    panda = None if panda_info is None else panda_info.panda
+    q, cost = solve_variants(
+        station,
+        station_context,
+        backup_on_hand_z,
+        backup_variants(grasp_q, dist, panda_info = panda_info),
+        panda = panda,
+        accept = "ordered"
+    )
     return q
\ No newline at end of file
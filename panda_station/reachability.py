@@ -0,0 +1,282 @@
+"""
+This module contains reachability maps for the panda arm: the hand poses
+around an arm's base are voxelized (position, and the direction the hand
+points in), and each voxel records whether forward kinematics samples
+reached it and how often IK succeeded there. Maps are cached on disk per
+robot model and base pose, and queries are array lookups.
+"""
+import os
+
+import numpy as np
+from pydrake.all import RotationMatrix, Solve
+
+from .grasping_and_placing import GRASP_MARGIN, HAND_FRAME_NAME, Q_NOMINAL, THETA_TOL
+from .ik_templates import ik_program
+
+REACHABILITY_DIR = os.path.expanduser("~/.cache/panda_station/reachability")
+
+# the directions the hand's z axis can point in: +x, -x, +y, -y, +z, -z
+DIRECTIONS = np.array(
+    [[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]]
+)
+DOWN = 5
+
+# {path: ReachabilityMap} (see map_path)
+REACHABILITY_MAPS = {}
+
+
+def direction_bins(z_B):
+    """
+    Returns the index into DIRECTIONS closest to each of the directions z_B (N, 3)
+    """
+    return np.argmax(z_B.dot(DIRECTIONS.T), axis=1)
+
+
+class ReachabilityMap:
+    """
+    A voxel grid of hand poses relative to the base of a panda arm
+    """
+
+    def __init__(self, resolution=0.05, lower=(-0.9, -0.9, -0.4), upper=(0.9, 0.9, 1.3)):
+        """
+        Construct an empty ReachabilityMap
+
+        Args:
+            resolution: the voxel size (m)
+            lower, upper: the corners of the box covered by the grid,
+            in the base frame
+        """
+        self.resolution = resolution
+        self.lower = np.array(lower, dtype=float)
+        self.shape = tuple(np.ceil((np.array(upper) - self.lower) / resolution).astype(int)) + (
+            len(DIRECTIONS),
+        )
+        # forward kinematics samples in each voxel
+        self.hits = np.zeros(self.shape, dtype=np.int32)
+        # hits and the voxels next to them
+        self.reachable = np.zeros(self.shape, dtype=bool)
+        self.attempts = np.zeros(self.shape, dtype=np.int32)
+        self.successes = np.zeros(self.shape, dtype=np.int32)
+
+    def voxels(self, p_B, z_B):
+        """
+        Returns (indices (N, 4), inside (N,)) of the voxels of the hand
+        positions p_B (N, 3) pointing in the directions z_B (N, 3)
+        """
+        index = np.floor((p_B - self.lower) / self.resolution).astype(int)
+        inside = np.all((index >= 0) & (index < np.array(self.shape[:3])), axis=1)
+        index = np.clip(index, 0, np.array(self.shape[:3]) - 1)
+        return np.column_stack((index, direction_bins(z_B))), inside
+
+    def add_samples(self, p_B, z_B):
+        """
+        Add the forward kinematics samples with hand positions p_B (N, 3)
+        and hand z axes z_B (N, 3)
+        """
+        index, inside = self.voxels(p_B, z_B)
+        np.add.at(self.hits, tuple(index[inside].T), 1)
+        # a voxel next to a hit is likely reachable too
+        hit = self.hits > 0
+        reachable = hit.copy()
+        for axis in range(3):
+            head, tail = [slice(None)] * 4, [slice(None)] * 4
+            head[axis], tail[axis] = slice(None, -1), slice(1, None)
+            reachable[tuple(head)] |= hit[tuple(tail)]
+            reachable[tuple(tail)] |= hit[tuple(head)]
+        self.reachable = reachable
+
+    def record(self, p_B, z_B, success):
+        """
+        Record the outcome of IK for the hand pose(s) (p_B, z_B)
+        """
+        index, inside = self.voxels(np.atleast_2d(p_B), np.atleast_2d(z_B))
+        index = tuple(index[inside].T)
+        np.add.at(self.attempts, index, 1)
+        if success:
+            np.add.at(self.successes, index, 1)
+
+    def success_rates(self, p_B, z_B):
+        """
+        Returns the estimated IK success rate (N,) for the hand positions
+        p_B (N, 3) pointing in the directions z_B (N, 3): the measured rate
+        where IK was attempted, otherwise 1 if the voxel is reachable and 0 if not
+        """
+        index, inside = self.voxels(np.atleast_2d(p_B), np.atleast_2d(z_B))
+        index = tuple(index.T)
+        attempts = self.attempts[index]
+        rates = np.where(
+            attempts > 0,
+            self.successes[index] / np.maximum(attempts, 1),
+            self.reachable[index].astype(float),
+        )
+        return np.where(inside, rates, 0.0)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first, since runs in parallel may save the same map
+        temp_path = f"{path}.{os.getpid()}"
+        with open(temp_path, "wb") as stream:
+            self.save_to(stream)
+        os.replace(temp_path, path)
+
+    def save_to(self, stream):
+        np.savez_compressed(
+            stream,
+            resolution=self.resolution,
+            lower=self.lower,
+            hits=self.hits,
+            reachable=self.reachable,
+            attempts=self.attempts,
+            successes=self.successes,
+        )
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        res = ReachabilityMap(resolution=float(data["resolution"]))
+        res.lower = data["lower"]
+        res.hits = data["hits"]
+        res.shape = res.hits.shape
+        res.reachable = data["reachable"]
+        res.attempts = data["attempts"]
+        res.successes = data["successes"]
+        return res
+
+
+class ArmReachability:
+    """
+    A ReachabilityMap for an arm with base pose X_WB, queried with world poses
+    """
+
+    def __init__(self, reachability_map, X_WB, path=None):
+        self.map = reachability_map
+        self.X_WB = X_WB
+        self.X_BW = X_WB.inverse()
+        self.path = path
+
+    def to_base(self, p_W, z_W):
+        R_BW = self.X_BW.rotation().matrix()
+        return p_W.dot(R_BW.T) + self.X_BW.translation(), z_W.dot(R_BW.T)
+
+    def success_rates(self, p_W, z_W=None):
+        """
+        Returns the estimated IK success rates of the hand at the world
+        positions p_W (N, 3) pointing in the directions z_W (N, 3),
+        (defaults to pointing down)
+        """
+        p_W = np.atleast_2d(p_W)
+        if z_W is None:
+            z_W = np.repeat(DIRECTIONS[DOWN][None], len(p_W), axis=0)
+        return self.map.success_rates(*self.to_base(p_W, np.atleast_2d(z_W)))
+
+    def success_rate(self, X_WH):
+        return self.success_rates(X_WH.translation(), X_WH.rotation().col(2))[0]
+
+    def record(self, X_WH, success):
+        self.map.record(*self.to_base(X_WH.translation()[None], X_WH.rotation().col(2)[None]), success)
+
+    def save(self):
+        if self.path is not None:
+            self.map.save(self.path)
+
+
+def map_path(X_WB, model="panda", directory=REACHABILITY_DIR, resolution=1e-3):
+    """
+    The file the reachability map of the robot `model` with base pose X_WB
+    is cached in
+    """
+    X = np.round(X_WB.GetAsMatrix4()[:3] / resolution).astype(int)
+    name = "_".join(str(x) for x in X.flatten())
+    return os.path.join(directory, model, f"{name}.npz")
+
+
+def solve_hand_pose(station, station_context, panda_info, X_WH):
+    """
+    Returns True if IK (ignoring collisions) finds a configuration with
+    the hand at X_WH, seeded from Q_NOMINAL like the streams
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    plant.SetPositions(plant_context, panda_info.panda, Q_NOMINAL)
+    q_nominal = plant.GetPositions(plant_context)
+    H = plant.GetFrameByName(HAND_FRAME_NAME, panda_info.hand)
+    W = plant.world_frame()
+    ik = ik_program(plant, plant_context, q_nominal)
+    ik.AddPositionConstraint(
+        H,
+        np.zeros(3),
+        W,
+        X_WH.translation() - GRASP_MARGIN * np.ones(3),
+        X_WH.translation() + GRASP_MARGIN * np.ones(3),
+    )
+    ik.AddOrientationConstraint(H, RotationMatrix(), W, X_WH.rotation(), THETA_TOL)
+    prog = ik.prog()
+    prog.SetInitialGuess(ik.q(), q_nominal)
+    return Solve(prog).is_success()
+
+
+def build_reachability_map(
+    station, station_context, panda_info, num_samples=100000, num_ik_trials=1000, seed=0, **kwargs
+):
+    """
+    Build the ReachabilityMap of panda_info from num_samples random forward
+    kinematics samples, then estimate IK success rates from num_ik_trials
+    solves at perturbed sample poses. The arm is moved back to where it was.
+    kwargs are passed to ReachabilityMap
+    """
+    plant = station.get_multibody_plant()
+    plant_context = station.GetSubsystemContext(plant, station_context)
+    H = plant.GetFrameByName(HAND_FRAME_NAME, panda_info.hand)
+    q_current = plant.GetPositions(plant_context, panda_info.panda)
+    X_BW = panda_info.X_WB.inverse()
+    lower = plant.GetPositionsFromArray(panda_info.panda, plant.GetPositionLowerLimits())
+    upper = plant.GetPositionsFromArray(panda_info.panda, plant.GetPositionUpperLimits())
+    rng = np.random.default_rng(seed)
+    p_B, z_B = np.zeros((num_samples, 3)), np.zeros((num_samples, 3))
+    for i, q in enumerate(rng.uniform(lower, upper, size=(num_samples, len(lower)))):
+        plant.SetPositions(plant_context, panda_info.panda, q)
+        X_BH = X_BW.multiply(H.CalcPoseInWorld(plant_context))
+        p_B[i] = X_BH.translation()
+        z_B[i] = X_BH.rotation().col(2)
+    res = ReachabilityMap(**kwargs)
+    res.add_samples(p_B, z_B)
+
+    for q in rng.uniform(lower, upper, size=(num_ik_trials, len(lower))):
+        plant.SetPositions(plant_context, panda_info.panda, q)
+        X_WH = H.CalcPoseInWorld(plant_context)
+        X_WH.set_translation(X_WH.translation() + rng.uniform(-0.5, 0.5, 3) * res.resolution)
+        success = solve_hand_pose(station, station_context, panda_info, X_WH)
+        X_BH = X_BW.multiply(X_WH)
+        res.record(X_BH.translation(), X_BH.rotation().col(2), success)
+    plant.SetPositions(plant_context, panda_info.panda, q_current)
+    return res
+
+
+def get_reachability(station, station_context, panda_info, model="panda", directory=REACHABILITY_DIR, **kwargs):
+    """
+    Returns the ArmReachability of panda_info, loading its map from disk or
+    building (and saving) it if there is none.
+    kwargs are passed to build_reachability_map
+    """
+    path = map_path(panda_info.X_WB, model=model, directory=directory)
+    if path not in REACHABILITY_MAPS:
+        if os.path.isfile(path):
+            REACHABILITY_MAPS[path] = ReachabilityMap.load(path)
+        else:
+            REACHABILITY_MAPS[path] = build_reachability_map(station, station_context, panda_info, **kwargs)
+            REACHABILITY_MAPS[path].save(path)
+    return ArmReachability(REACHABILITY_MAPS[path], panda_info.X_WB, path=path)
+
+
+def load_reachability(X_WB, model="panda", directory=REACHABILITY_DIR):
+    """
+    Returns the ArmReachability of an arm with base pose X_WB if its map
+    was built before, otherwise None (for use without a station, e.g. by
+    the problem generators)
+    """
+    path = map_path(X_WB, model=model, directory=directory)
+    if path not in REACHABILITY_MAPS:
+        if not os.path.isfile(path):
+            return None
+        REACHABILITY_MAPS[path] = ReachabilityMap.load(path)
+    return ArmReachability(REACHABILITY_MAPS[path], X_WB, path=path)
@@ -0,0 +1,426 @@
+"""
+This module contains a persistent, lazily validated probabilistic roadmap
+(LazyPRM) for answering repeated motion planning queries in the same station.
+"""
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from .clearance import arm_bodies, covering_spheres, shape_bounds
+from .collision_checking import NUM_Q, RESOLUTION, CollisionChecker
+from .path_smoothing import densify, remove_redundant
+
+# roadmaps are kept alive as long as their station:
+# {station: {panda: Roadmap}} (see get_roadmap)
+ROADMAPS = weakref.WeakKeyDictionary()
+
+
+def boxes_intersect(lower, upper, box_lower, box_upper):
+    """
+    Returns whether each of the boxes (lower, upper) (N, 3) intersects any
+    of the boxes (box_lower, box_upper) (M, 3)
+    """
+    return np.any(
+        np.all(
+            (lower[:, None] <= box_upper[None]) & (upper[:, None] >= box_lower[None]),
+            axis=2,
+        ),
+        axis=1,
+    )
+
+
+class Roadmap:
+    """
+    A roadmap for one panda arm in one PandaStation. The graph persists
+    across queries (in any Context of the station), and collision checking
+    results for nodes and edges are cached until an object that could
+    touch the arm there moves (see update_scene).
+    The roadmap only holds a weak reference to its station.
+    """
+
+    def __init__(
+        self,
+        station,
+        station_context,
+        panda=None,
+        num_samples=1000,
+        max_samples=5000,
+        k=10,
+        margin=0.02,
+        seed=0,
+    ):
+        """
+        Construct a Roadmap
+
+        Args:
+            station: PandaStation
+            station_context: a Context for station (used to sample the
+            initial nodes)
+            panda: the panda model instance (defaults to station.get_panda())
+            num_samples: the number of configurations sampled initially
+            (and each time the roadmap is grown)
+            max_samples: the roadmap is not grown beyond this many nodes
+            k: each node is connected to its k nearest neighbours
+            margin: padding (m) of the bounding boxes of the arm and the
+            objects used to decide which cached collision checks a moved
+            object invalidates
+            seed: seed for sampling configurations
+        """
+        self.station_ref = weakref.ref(station)
+        self.plant, scene_graph = station.get_plant_and_scene_graph()
+        self.panda = station.get_panda() if panda is None else panda
+        self.inspector = scene_graph.model_inspector()
+        limits = np.array(station.get_panda_joint_limits())
+        self.lower, self.upper = limits[:, 0], limits[:, 1]
+        self.step = RESOLUTION * np.linalg.norm(self.upper - self.lower)
+        self.num_samples = num_samples
+        self.max_samples = max_samples
+        self.k = k
+        self.margin = margin
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+        # spheres containing the geometry of the arm, in the frames of its bodies
+        self.bodies = arm_bodies(self.plant, self.panda)
+        self.sphere_centers, self.sphere_radii = [], []
+        for body in self.bodies:
+            for geom_id in self.plant.GetCollisionGeometriesForBody(body):
+                c, r = covering_spheres(self.inspector.GetShape(geom_id))
+                X_BG = self.inspector.GetPoseInFrame(geom_id)
+                self.sphere_centers.append((body, (X_BG.rotation().matrix() @ c.T).T + X_BG.translation()))
+                self.sphere_radii.append(r)
+        self.radii = np.concatenate(self.sphere_radii)
+        self.reach = None
+        # (lower, upper) corners of the geometry of each object, in its bodies' frames
+        self.object_corners = {}
+
+        self.qs = np.empty((0, NUM_Q))
+        # axis aligned bounds of the arm's geometry at each node, (lower, upper)
+        self.boxes = np.empty((0, 6))
+        self.neighbors = []
+        self.node_valid = {}
+        self.edge_valid = {}
+        self.objects = None
+        self.attached = None
+        self.stats = {"queries": 0, "solved": 0, "direct": 0, "invalidated": 0}
+        plant_context = station.GetSubsystemContext(self.plant, station_context)
+        self.add_nodes(plant_context, self.sample(num_samples))
+
+    @property
+    def station(self):
+        return self.station_ref()
+
+    def sample(self, n):
+        return self.rng.uniform(self.lower, self.upper, size=(n, NUM_Q))
+
+    def arm_box(self, plant_context, q):
+        """
+        Returns the axis aligned bounds (lower, upper) of the arm's geometry
+        in configuration q
+        """
+        self.plant.SetPositions(plant_context, self.panda, q)
+        centers = []
+        for body, c in self.sphere_centers:
+            X_WB = self.plant.EvalBodyPoseInWorld(plant_context, body)
+            centers.append((X_WB.rotation().matrix() @ c.T).T + X_WB.translation())
+        centers = np.vstack(centers)
+        lower = (centers - self.radii[:, None]).min(axis=0) - self.margin
+        upper = (centers + self.radii[:, None]).max(axis=0) + self.margin
+        return np.concatenate((lower, upper))
+
+    def arm_reach(self, plant_context):
+        """
+        Returns a bound on the distance from any of the arm's joints to any
+        point of its geometry, which does not depend on the configuration:
+        the length of the chain of body origins plus the furthest extent
+        of the geometry from its body's origin
+        """
+        origins = [
+            self.plant.EvalBodyPoseInWorld(plant_context, self.plant.get_body(i)).translation()
+            for i in self.plant.GetBodyIndices(self.panda)
+        ]
+        length = sum(np.linalg.norm(b - a) for a, b in zip(origins[:-1], origins[1:]))
+        extent = max(
+            np.max(np.linalg.norm(c, axis=1) + r)
+            for (_, c), r in zip(self.sphere_centers, self.sphere_radii)
+        )
+        return length + extent
+
+    def add_nodes(self, plant_context, qs):
+        """
+        Add the configurations qs to the roadmap, connecting each to its
+        k nearest neighbours. Returns their node indices
+        """
+        if self.reach is None:
+            self.reach = self.arm_reach(plant_context)
+        start = len(self.qs)
+        self.qs = np.vstack((self.qs, qs))
+        self.boxes = np.vstack([self.boxes] + [self.arm_box(plant_context, q)[None] for q in qs])
+        indices = list(range(start, len(self.qs)))
+        for i in indices:
+            self.neighbors.append({})
+        dists = np.linalg.norm(self.qs[None, :] - self.qs[indices][:, None], axis=2)
+        for row, i in enumerate(indices):
+            dists[row, i] = np.inf
+            for j in np.argsort(dists[row])[: self.k]:
+                if np.isinf(dists[row, j]):
+                    break
+                self.neighbors[i][j] = dists[row, j]
+                self.neighbors[j][i] = dists[row, j]
+        return indices
+
+    def remove_nodes(self, indices):
+        """
+        Remove the nodes `indices`, which must be the last ones added
+        """
+        first = min(indices)
+        assert sorted(indices) == list(range(first, len(self.qs)))
+        for i in indices:
+            for j in self.neighbors[i]:
+                if j < first:
+                    del self.neighbors[j][i]
+            self.node_valid.pop(i, None)
+        for key in [key for key in self.edge_valid if key[1] >= first]:
+            del self.edge_valid[key]
+        del self.neighbors[first:]
+        self.qs = self.qs[:first]
+        self.boxes = self.boxes[:first]
+
+    def object_box(self, plant_context, name):
+        """
+        Returns the axis aligned bounds (lower, upper) of the geometry of
+        the object `name`, or the whole space if it can not be bounded
+        """
+        if name not in self.object_corners:
+            corners = []
+            object_info = self.station.object_infos[name][0]
+            for body_info in object_info.get_body_infos().values():
+                body = body_info.get_body()
+                for geom_id in self.plant.GetCollisionGeometriesForBody(body):
+                    bounds = shape_bounds(self.inspector.GetShape(geom_id))
+                    if bounds is None:
+                        corners = None
+                        break
+                    X_BG = self.inspector.GetPoseInFrame(geom_id)
+                    points = np.array(list(itertools.product(*zip(*bounds))))
+                    corners.append((body, (X_BG.rotation().matrix() @ points.T).T + X_BG.translation()))
+                if corners is None:
+                    break
+            self.object_corners[name] = corners
+        corners = self.object_corners[name]
+        if corners is None:
+            return np.full(3, -np.inf), np.full(3, np.inf)
+        if len(corners) == 0:
+            return None
+        points = []
+        for body, c in corners:
+            X_WB = self.plant.EvalBodyPoseInWorld(plant_context, body)
+            points.append((X_WB.rotation().matrix() @ c.T).T + X_WB.translation())
+        points = np.vstack(points)
+        return points.min(axis=0) - self.margin, points.max(axis=0) + self.margin
+
+    def scene(self, station_context):
+        """
+        Returns the world poses of the bodies of the objects that are
+        collision checked against the arm (with the bounds of their
+        geometry), and everything that moves with (or independently of)
+        the arm and is not localized in space (held objects, other arms)
+        """
+        plant_context = self.station.GetSubsystemContext(self.plant, station_context)
+        objects, attached = {}, []
+        held_objects = self.station.get_held_objects(station_context)
+        held_names = set(name for name, _ in held_objects.values())
+        inactive = self.station.get_inactive_objects(station_context)
+        for panda_name, (name, X_HO) in sorted(held_objects.items()):
+            attached.append(X_HO.GetAsMatrix4())
+        for name, (object_info, _) in self.station.object_infos.items():
+            if name in held_names or name in inactive:
+                continue
+            bodies = [body_info.get_body() for body_info in object_info.get_body_infos().values()]
+            poses = np.array(
+                [self.plant.EvalBodyPoseInWorld(plant_context, body).GetAsMatrix4() for body in bodies]
+            )
+            objects[name] = (poses, self.object_box(plant_context, name))
+        for panda_info in self.station.panda_infos.values():
+            if panda_info.panda != self.panda:
+                attached.append(self.plant.GetPositions(plant_context, panda_info.panda))
+        return objects, attached
+
+    def update_scene(self, station_context):
+        """
+        Forget the cached collision checks that may have been changed by
+        objects moving since the last query. Held objects are not part of
+        the arm's bounds, so nothing is kept while an object is held
+        """
+        objects, attached = self.scene(station_context)
+        holding = len(self.station.get_held_objects(station_context)) > 0
+        if self.objects is None:
+            pass
+        elif holding or len(attached) != len(self.attached) or not all(
+            a.shape == b.shape and np.allclose(a, b) for a, b in zip(attached, self.attached)
+        ):
+            self.stats["invalidated"] += len(self.node_valid) + len(self.edge_valid)
+            self.node_valid.clear()
+            self.edge_valid.clear()
+        else:
+            boxes = []
+            for name in set(objects) | set(self.objects):
+                old, new = self.objects.get(name), objects.get(name)
+                if old is not None and new is not None and np.allclose(old[0], new[0]):
+                    continue
+                boxes += [entry[1] for entry in (old, new) if entry is not None and entry[1] is not None]
+            if boxes:
+                self.invalidate_near(np.array([lo for lo, _ in boxes]), np.array([hi for _, hi in boxes]))
+        self.objects, self.attached = objects, attached
+
+    def invalidate_near(self, box_lower, box_upper):
+        """
+        Forget the cached collision checks of the nodes whose arm geometry,
+        and of the edges whose swept arm geometry, may intersect any of the
+        boxes (box_lower, box_upper) (M, 3)
+        """
+        lower, upper = self.boxes[:, :3], self.boxes[:, 3:]
+        for i in np.flatnonzero(boxes_intersect(lower, upper, box_lower, box_upper)):
+            if self.node_valid.pop(i, None) is not None:
+                self.stats["invalidated"] += 1
+        if len(self.edge_valid) == 0:
+            return
+        edges = list(self.edge_valid)
+        ij = np.array(edges)
+        # along a straight line in joint space, no point of the arm moves
+        # further than |dq|_1 * reach, so the arm stays within half of that
+        # of where it is at one of the endpoints
+        sweep = 0.5 * self.reach * np.abs(self.qs[ij[:, 0]] - self.qs[ij[:, 1]]).sum(axis=1)
+        lo = np.minimum(lower[ij[:, 0]], lower[ij[:, 1]]) - sweep[:, None]
+        hi = np.maximum(upper[ij[:, 0]], upper[ij[:, 1]]) + sweep[:, None]
+        for e in np.flatnonzero(boxes_intersect(lo, hi, box_lower, box_upper)):
+            del self.edge_valid[edges[e]]
+            self.stats["invalidated"] += 1
+
+    def shortest_path(self, start, goal):
+        """
+        A* search over the nodes and edges not known to be in collision
+        """
+        h = lambda i: np.linalg.norm(self.qs[i] - self.qs[goal])
+        queue = [(h(start), 0.0, start)]
+        costs = {start: 0.0}
+        parents = {start: None}
+        while queue:
+            _, cost, i = heapq.heappop(queue)
+            if i == goal:
+                path = []
+                while i is not None:
+                    path.append(i)
+                    i = parents[i]
+                return path[::-1]
+            if cost > costs[i]:
+                continue
+            for j, length in self.neighbors[i].items():
+                if self.node_valid.get(j) is False:
+                    continue
+                if self.edge_valid.get((min(i, j), max(i, j))) is False:
+                    continue
+                new_cost = cost + length
+                if new_cost < costs.get(j, np.inf):
+                    costs[j] = new_cost
+                    parents[j] = i
+                    heapq.heappush(queue, (new_cost + h(j), new_cost, j))
+        return None
+
+    def validate(self, checker, path):
+        """
+        Lazily collision check the nodes, then the edges, of `path`
+        """
+        for i in path:
+            if i not in self.node_valid:
+                self.node_valid[i] = checker.is_valid(self.qs[i])
+            if not self.node_valid[i]:
+                return False
+        for i, j in zip(path[:-1], path[1:]):
+            key = (min(i, j), max(i, j))
+            if key not in self.edge_valid:
+                self.edge_valid[key] = (
+                    checker.is_valid_motion(self.qs[i], self.qs[j], self.step)
+                )
+            if not self.edge_valid[key]:
+                return False
+        return True
+
+    def query(
+        self,
+        station_context,
+        q_start,
+        q_goal,
+        interpolate=False,
+        max_time=None,
+        should_stop=None,
+    ):
+        """
+        Find a collision free path from q_start to q_goal (np.array) in
+        station_context, giving up after max_time (s) or once should_stop()
+        returns True. Returns the path as an array of configurations, or None
+        """
+        with self.lock:
+            return self._query(station_context, q_start, q_goal, interpolate, max_time, should_stop)
+
+    def _query(self, station_context, q_start, q_goal, interpolate, max_time, should_stop):
+        start_time = time.time()
+        self.stats["queries"] += 1
+        q_start, q_goal = np.asarray(q_start, dtype=float), np.asarray(q_goal, dtype=float)
+        # made for each query, so that it sees the objects held now
+        checker = CollisionChecker(self.station, station_context, panda=self.panda)
+        plant_context = checker.plant_context
+        self.update_scene(station_context)
+        if not (checker.is_valid(q_start) and checker.is_valid(q_goal)):
+            return None
+        if checker.is_valid_motion(q_start, q_goal, self.step):
+            self.stats["solved"] += 1
+            self.stats["direct"] += 1
+            return self.interpolate(checker, np.array([q_start, q_goal]), interpolate)
+        # the start and goal are only in the roadmap for this query
+        endpoints = self.add_nodes(plant_context, np.array([q_start, q_goal]))
+        try:
+            while True:
+                if max_time is not None and time.time() - start_time > max_time:
+                    return None
+                if should_stop is not None and should_stop():
+                    return None
+                start, goal = endpoints
+                self.node_valid[start] = self.node_valid[goal] = True
+                path = self.shortest_path(start, goal)
+                if path is None:
+                    if len(self.qs) - len(endpoints) >= self.max_samples:
+                        return None
+                    self.remove_nodes(endpoints)
+                    num_samples = min(self.num_samples, self.max_samples - len(self.qs))
+                    self.add_nodes(plant_context, self.sample(num_samples))
+                    endpoints = self.add_nodes(plant_context, np.array([q_start, q_goal]))
+                    continue
+                if self.validate(checker, path):
+                    qs = self.qs[path]
+                    break
+        finally:
+            self.remove_nodes(endpoints)
+        self.stats["solved"] += 1
+        return self.interpolate(checker, remove_redundant(checker, qs, self.step), interpolate)
+
+    def interpolate(self, checker, qs, interpolate):
+        return densify(checker, qs, self.step) if interpolate else qs
+
+
+def get_roadmap(station, station_context, panda=None, **kwargs):
+    """
+    Return the persistent Roadmap for the panda in station (making it if
+    it does not exist yet). kwargs are passed to Roadmap on construction
+    """
+    if panda is None:
+        panda = station.get_panda()
+    roadmaps = ROADMAPS.setdefault(station, {})
+    key = int(panda)
+    if key not in roadmaps:
+        roadmaps[key] = Roadmap(station, station_context, panda=panda, **kwargs)
+    return roadmaps[key]
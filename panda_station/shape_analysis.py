@@ -0,0 +1,171 @@
+"""
+This module contains a cache of the analysis of the objects' shapes: which
+shapes can be grasped or placed, and the surfaces that objects can be placed
+on. It depends only on a model's geometry (and for surfaces, on its
+orientation relative to world z), so it is computed once per model file and
+link, shared by the ObjectInfos of every station, and saved across runs.
+"""
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from .grasping_and_placing import TargetSurface, is_graspable, is_placeable, is_safe_to_place
+
+SHAPE_ANALYSIS_PATH = os.path.expanduser("~/.cache/panda_station/shape_analysis.pkl")
+
+
+def quantize(array, resolution):
+    return tuple(np.round(np.asarray(array, dtype=float) / resolution).astype(int).flatten())
+
+
+class ShapeAnalysisCache:
+    """
+    Results of the shape analysis, keyed by the model they were computed
+    for (see model_key). New results are saved to path as they are found
+    """
+
+    def __init__(self, path=SHAPE_ANALYSIS_PATH):
+        self.path = path
+        self.results = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.results = {}
+        if self.path is not None and os.path.isfile(self.path):
+            try:
+                with open(self.path, "rb") as stream:
+                    self.results.update(pickle.load(stream))
+            except (EOFError, pickle.UnpicklingError):
+                # another process was writing it
+                pass
+
+    def save(self, key, result):
+        """
+        Add key: result to the file, keeping the results other processes
+        saved since it was loaded
+        """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        results = dict(self.results)
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "rb") as stream:
+                    results.update(pickle.load(stream))
+            except (EOFError, pickle.UnpicklingError):
+                pass
+        results[key] = result
+        temp_path = f"{self.path}.{os.getpid()}"
+        with open(temp_path, "wb") as stream:
+            pickle.dump(results, stream)
+        os.replace(temp_path, self.path)
+
+    def get(self, key, compute):
+        """
+        Returns the result for key, calling compute() to find
+        (and save) it if there is none
+        """
+        with self.lock:
+            if self.results is None:
+                self.load()
+            if key in self.results:
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+            result = compute()
+            self.results[key] = result
+            self.save(key, result)
+            return result
+
+
+SHAPE_ANALYSIS = ShapeAnalysisCache()
+
+
+def model_key(object_info):
+    """
+    Returns the key of the geometry of object_info: its model file and when
+    it was last modified (or for objects added from a directive, the
+    directive and the object's name), or None if it is not known
+    """
+    if object_info.get_path() is not None:
+        source, name = object_info.get_path(), None
+    elif object_info.directive is not None:
+        source, name = object_info.directive, object_info.get_name()
+    else:
+        return None
+    if not os.path.isfile(source):
+        return None
+    return (source, os.path.getmtime(source), name)
+
+
+def shape_indices(object_info, criteria_func):
+    """
+    Returns [(body name, index)] of the ShapeInfos of object_info that
+    satisfy criteria_func (see ObjectInfo.query_shape_infos)
+    """
+    return [
+        (body_info.get_name(), i)
+        for body_info in object_info.get_body_infos().values()
+        for i, shape_info in enumerate(body_info.get_shape_infos())
+        if criteria_func(shape_info)
+    ]
+
+
+def shapes_from_indices(object_info, indices):
+    bodies = {body_info.get_name(): body_info for body_info in object_info.get_body_infos().values()}
+    return [bodies[name].get_shape_infos()[i] for name, i in indices]
+
+
+def analyze_shapes(object_info, criteria_func):
+    """
+    Returns the ShapeInfos of object_info that satisfy criteria_func,
+    a function of the shape only (eg. is_graspable or is_placeable)
+    """
+    key = model_key(object_info)
+    if key is None:
+        return object_info.query_shape_infos(criteria_func)
+    indices = SHAPE_ANALYSIS.get(
+        (criteria_func.__name__,) + key, lambda: shape_indices(object_info, criteria_func)
+    )
+    return shapes_from_indices(object_info, indices)
+
+
+def graspable_shapes(object_info):
+    return analyze_shapes(object_info, is_graspable)
+
+
+def placeable_shapes(object_info):
+    return analyze_shapes(object_info, is_placeable)
+
+
+def target_surfaces(object_info, link_name, station, station_context, resolution=1e-4):
+    """
+    Returns the TargetSurfaces of the shapes of the body link_name of
+    object_info that are safe to place objects on (see is_safe_to_place)
+    """
+    bodies = {body_info.get_name(): body_info for body_info in object_info.get_body_infos().values()}
+    shape_infos = bodies[link_name].get_shape_infos()
+
+    def compute():
+        surfaces = []
+        for i, shape_info in enumerate(shape_infos):
+            is_safe, surface = is_safe_to_place(shape_info, station, station_context)
+            if is_safe:
+                surfaces.append((i, surface.z, surface.bb_min, surface.bb_max))
+        return surfaces
+
+    key = model_key(object_info)
+    if key is None:
+        surfaces = compute()
+    else:
+        plant = station.get_multibody_plant()
+        plant_context = station.GetSubsystemContext(plant, station_context)
+        R_WB = plant.EvalBodyPoseInWorld(plant_context, bodies[link_name].get_body()).rotation()
+        surfaces = SHAPE_ANALYSIS.get(
+            ("surfaces",) + key + (link_name, quantize(R_WB.matrix(), resolution)), compute
+        )
+    return [TargetSurface(shape_infos[i], z, bb_min, bb_max) for i, z, bb_min, bb_max in surfaces]
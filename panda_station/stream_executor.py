@@ -0,0 +1,259 @@
+"""
+This module contains an executor for the streams of a PDDLStream problem:
+stream instances are evaluated in worker processes that each build their
+own copy of the problem's stream map (and so of its stations), so that
+several instances sample at once. Results are returned as futures, each
+instance computes its next result while the planner uses the current one,
+and the number of results in flight is bounded.
+"""
+import atexit
+import importlib
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+
+# the StreamExecutor started by start_stream_executor
+STREAM_EXECUTOR = None
+
+
+def load_factory(factory):
+    """
+    Returns the function named by factory, a string "module:function"
+    """
+    module_name, function_name = factory.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def stream_worker(factory, problem_file, factory_kwargs, tasks, results):
+    """
+    The loop of a worker process: build the stream map with
+    factory(problem_file, **factory_kwargs), then evaluate the stream
+    instances opened on `tasks` and put their results on `results`.
+    Instances of a variant (see StreamExecutor.wrap_stream_map) use a
+    stream map built with the variant's factory kwargs
+    """
+    make_stream_map = load_factory(factory)
+    # variant -> stream map
+    stream_maps = {None: make_stream_map(problem_file, **factory_kwargs)}
+    generators = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        instance_id, kind, payload = task
+        if kind == "open":
+            name, inputs, kwargs, variant, overrides = payload
+            if variant not in stream_maps:
+                variant_kwargs = dict(factory_kwargs, **overrides)
+                if variant_kwargs == factory_kwargs:
+                    stream_maps[variant] = stream_maps[None]
+                else:
+                    stream_maps[variant] = make_stream_map(problem_file, **variant_kwargs)
+            generators[instance_id] = (stream_maps[variant][name], inputs, kwargs, None)
+            continue
+        if kind == "close":
+            generators.pop(instance_id, None)
+            continue
+        # kind == "next", payload is the index of the result
+        try:
+            gen_fn, inputs, kwargs, generator = generators[instance_id]
+            if generator is None:
+                generator = iter(gen_fn(*inputs, **kwargs))
+                generators[instance_id] = (gen_fn, inputs, kwargs, generator)
+            results.put((instance_id, payload, "result", next(generator)))
+        except StopIteration:
+            generators.pop(instance_id, None)
+            results.put((instance_id, payload, "done", None))
+        except Exception as e:
+            generators.pop(instance_id, None)
+            results.put((instance_id, payload, "error", repr(e)))
+
+
+class StreamInstance:
+    """
+    A stream instance evaluated by a StreamExecutor in one of its workers
+    """
+
+    def __init__(self, executor, worker, instance_id):
+        self.executor = executor
+        self.worker = worker
+        self.instance_id = instance_id
+        self.requests = itertools.count()
+        self.closed = False
+
+    def next_future(self, block=True):
+        """
+        Request the next result of this instance. Returns a Future of
+        ("result", outputs) or ("done", None), or None if block is False and
+        the executor has too many results in flight
+        """
+        return self.executor.submit(self, block=block)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.executor.close_instance(self)
+
+
+class StreamExecutor:
+    """
+    Evaluates stream instances in worker processes, each with the stream
+    map built by a factory function (eg. experiments.blocks_world.run:make_stream_map).
+    An instance stays in the worker it was opened in, since its generator
+    lives there.
+    """
+
+    def __init__(self, factory, problem_file, processes=None, max_pending=None, **factory_kwargs):
+        """
+        Construct a StreamExecutor
+
+        Args:
+            factory: "module:function", where function(problem_file, **factory_kwargs)
+            returns a stream map
+            problem_file: the .yaml problem file the workers build their streams for
+            processes: number of worker processes (defaults to the number of cpus)
+            max_pending: the maximum number of results in flight
+            (defaults to twice the number of workers)
+        """
+        if processes is None:
+            processes = os.cpu_count()
+        if max_pending is None:
+            max_pending = 2 * processes
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(processes)]
+        self.workers = [
+            context.Process(
+                target=stream_worker,
+                args=(factory, problem_file, factory_kwargs, tasks, self.results),
+                daemon=True,
+            )
+            for tasks in self.tasks
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # (instance_id, request) -> Future
+        self.futures = {}
+        # the number of open instances in each worker
+        self.load = [0] * processes
+        self.instance_ids = itertools.count()
+        # the factory kwargs overridden by each variant (see wrap_stream_map)
+        self.variants = []
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+
+    def read_results(self):
+        while True:
+            try:
+                instance_id, request, kind, value = self.results.get()
+            except (EOFError, OSError):
+                return
+            with self.lock:
+                future = self.futures.pop((instance_id, request), None)
+            self.slots.release()
+            if future is None:
+                continue
+            if kind == "error":
+                future.set_exception(RuntimeError(value))
+            else:
+                future.set_result((kind, value))
+
+    def open(self, name, inputs, kwargs=None, variant=None):
+        """
+        Open an instance of the stream `name` with inputs (and kwargs, eg. fluents)
+        in the worker with the fewest open instances
+        """
+        with self.lock:
+            worker = min(range(len(self.load)), key=self.load.__getitem__)
+            self.load[worker] += 1
+        instance = StreamInstance(self, worker, next(self.instance_ids))
+        overrides = {} if variant is None else self.variants[variant]
+        self.tasks[worker].put(
+            (instance.instance_id, "open", (name, tuple(inputs), kwargs or {}, variant, overrides))
+        )
+        return instance
+
+    def submit(self, instance, block=True):
+        if not self.slots.acquire(blocking=block):
+            return None
+        future = Future()
+        request = next(instance.requests)
+        with self.lock:
+            self.futures[(instance.instance_id, request)] = future
+        self.tasks[instance.worker].put((instance.instance_id, "next", request))
+        return future
+
+    def close_instance(self, instance):
+        self.tasks[instance.worker].put((instance.instance_id, "close", None))
+        with self.lock:
+            self.load[instance.worker] -= 1
+
+    def stream(self, name, inputs, kwargs=None, variant=None):
+        """
+        Generator of the results of the stream instance name(*inputs, **kwargs),
+        with the next result computed while the current one is used
+        (unless too many results are in flight)
+        """
+        instance = self.open(name, inputs, kwargs, variant=variant)
+        try:
+            future = instance.next_future()
+            while True:
+                kind, value = future.result()
+                if kind == "done":
+                    return
+                ahead = instance.next_future(block=False)
+                yield value
+                future = ahead if ahead is not None else instance.next_future()
+        finally:
+            instance.close()
+
+    def gen_fn(self, name, variant=None):
+        return lambda *inputs, **kwargs: self.stream(name, inputs, kwargs, variant=variant)
+
+    def wrap_stream_map(self, stream_map, names=None, **factory_kwargs):
+        """
+        Returns stream_map with the streams `names` (defaults to all)
+        evaluated by this executor. Only pass generator streams
+        (from_gen_fn): the results of from_fn and from_test streams are
+        bounded to one call (see BoundedGenerator), which is lost in a worker.
+        factory_kwargs override the executor's factory kwargs in the stream
+        maps the workers evaluate these streams with (eg. planning_objects),
+        so that they match stream_map
+        """
+        variant = None
+        if factory_kwargs:
+            with self.lock:
+                if factory_kwargs in self.variants:
+                    variant = self.variants.index(factory_kwargs)
+                else:
+                    variant = len(self.variants)
+                    self.variants.append(factory_kwargs)
+        return {
+            name: self.gen_fn(name, variant=variant) if names is None or name in names else gen_fn
+            for name, gen_fn in stream_map.items()
+        }
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def start_stream_executor(factory, problem_file, **kwargs):
+    """
+    Start the StreamExecutor for problem_file.
+    kwargs are passed to StreamExecutor
+    """
+    global STREAM_EXECUTOR
+    if STREAM_EXECUTOR is not None:
+        STREAM_EXECUTOR.close()
+    STREAM_EXECUTOR = StreamExecutor(factory, problem_file, **kwargs)
+    atexit.register(STREAM_EXECUTOR.close)
+    return STREAM_EXECUTOR
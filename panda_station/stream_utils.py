@@ -23,18 +23,17 @@ from .grasping_and_placing import (
     box_place_q,
     cylinder_place_q,
 )
+from .collision_checking import (
+    NUM_Q,
+    RESOLUTION,
+    BatchMotionValidator,
+    CollisionChecker,
+    state_to_q,
+)
+from .path_smoothing import densify, get_path_smoother, shortcut_path
+from .planner_racing import get_planner_race
+from .roadmap import get_roadmap
 from .utils import *
-NUM_Q = 7
-
-
-def state_to_q(state):
-    """
-    Parses ompl RealVectorStateSpae::StateType into a numpy array
-    """
-    q = []
-    for i in range(NUM_Q):
-        q.append(state[i])
-    return np.array(q)
 
 
 def q_to_state(space, q):
@@ -48,6 +47,19 @@ def q_to_state(space, q):
 
 
 
+def make_lbkpiece1(si):
+    planner = og.LBKPIECE1(si)
+    planner.setBorderFraction(0.1)
+    return planner
+
+
+OMPL_PLANNERS = {
+    "lbkpiece1": make_lbkpiece1,
+    "rrtconnect": og.RRTConnect,
+    "bitrrt": og.BiTRRT,
+}
+
+
 def find_traj(
     station,
     station_context,
@@ -58,18 +70,66 @@ def find_traj(
     verbose = False,
     use_min_clearance = None,
     interpolate = False,  # return (approx) all q's on the trajectory used for collision checking
+    planner = "lbkpiece1",
+    max_time = None,
+    should_stop = None,
+    simplify = "ompl",
+    simplify_time = 0.1,
 ):
     """
     Find a collision free trajectory from the configurations
     q_start to q_end (np.array) for the panda arm in
     PandaStation station with Context station context
+
+    planner is one of:
+        "lbkpiece1", "rrtconnect", "bitrrt": plan from scratch with
+        the OMPL planner of that name
+        "roadmap": query a persistent roadmap kept for this station
+        (see roadmap.Roadmap)
+        "race": race several planners in a process pool
+        (see planner_racing.PlannerRace, start one with start_planner_race)
+
+    max_time is an optional time limit (s) for the OMPL planners and the
+    roadmap, and should_stop an optional function that returns True when
+    planning should be abandoned.
+
+    simplify is how the path found by an OMPL planner is post-processed:
+        "ompl": with OMPL's PathSimplifier
+        "shortcut": with path_smoothing.shortcut_path, within
+        simplify_time (s)
+        "async": the raw path is returned, and shortcut in the background
+        (see path_smoothing.PathSmoother), to be used once it is turned
+        into a trajectory
+        None: not at all
     """
-    plant, scene_graph = station.get_plant_and_scene_graph()
-    plant_context = station.GetSubsystemContext(plant, station_context)
-    scene_graph_context = station.GetSubsystemContext(scene_graph, station_context)
-    if panda is None:
-        panda = station.get_panda()
-    query_output_port = scene_graph.GetOutputPort("query")
+    if planner == "race":
+        return get_planner_race().find_traj(
+            station, station_context, q_start, q_goal, panda=panda, interpolate=interpolate
+        )
+    if planner == "roadmap":
+        assert not ignore_endpoint_collisions and use_min_clearance is None, (
+            "The roadmap planner does not support ignoring endpoint collisions or min clearance"
+        )
+        res = get_roadmap(station, station_context, panda=panda).query(
+            station_context,
+            q_start,
+            q_goal,
+            interpolate=interpolate,
+            max_time=max_time,
+            should_stop=should_stop,
+        )
+        if res is None and verbose:
+            print(f"{Colors.RED}FAILED TO FIND ROADMAP SOLUTION{Colors.RESET}")
+        return res
+    assert planner in OMPL_PLANNERS, f"Unknown planner {planner}"
+
+    checker = CollisionChecker(
+        station,
+        station_context,
+        panda=panda,
+        ignore_qs=(q_start, q_goal) if ignore_endpoint_collisions else (),
+        use_min_clearance=use_min_clearance,
+    )
 
     class MyStateValidityChecker(ob.StateValidityChecker):
         """
@@ -86,29 +146,7 @@ def find_traj(
             """
             Check if a state is valid
             """
-            q = state_to_q(state)
-            if ignore_endpoint_collisions and ((np.all(q == q_start)) or (np.all(q == q_goal))):
-                return True
-            if use_min_clearance is not None:
-                cl = self.clearance(state)
-                return cl < use_min_clearance
-            plant.SetPositions(plant_context, panda, q)
-            query_object = query_output_port.Eval(scene_graph_context)
-            return not query_object.HasCollisions()
-
-        @staticmethod
-        def clearance(state):
-            """
-            Compute min clearance if arm is in state `state`
-            """
-            q = state_to_q(state)
-            plant.SetPositions(plant_context, panda, q)
-            query_object = query_output_port.Eval(scene_graph_context)
-            sdps = query_object.ComputeSignedDistancePairwiseClosestPoints(1.0)
-            min_dist = np.inf
-            for sdp in sdps:
-                min_dist = min(sdp.distance, min_dist)
-            return min_dist
+            return checker.is_valid(state_to_q(state))
 
     joint_limits = station.get_panda_joint_limits()
     space = ob.RealVectorStateSpace(NUM_Q)
@@ -119,18 +157,20 @@ def find_traj(
 
     space.setBounds(bounds)
     si = ob.SpaceInformation(space)
-    checker = MyStateValidityChecker(si)
-    si.setStateValidityChecker(checker)
-    si.setStateValidityCheckingResolution(0.005) # half of default
+    validity_checker = MyStateValidityChecker(si)
+    si.setStateValidityChecker(validity_checker)
+    si.setStateValidityCheckingResolution(RESOLUTION) # half of default
+    # check whole motions at once, rather than one callback per state
+    si.setMotionValidator(BatchMotionValidator(si, checker))
     si.setup()
 
     start = q_to_state(space, q_start)
-    if not checker.isValid(start):
+    if not checker.is_valid(q_start):
         if verbose:
             print(f"{Colors.RED}INVALID OMPL START STATE {Colors.RESET}")
         return None
     goal = q_to_state(space, q_goal)
-    if not checker.isValid(goal):
+    if not checker.is_valid(q_goal):
         if verbose:
             print(f"{Colors.RED}INVALID OMPL GOAL STATE{Colors.RESET}")
         return None
@@ -138,25 +178,55 @@ def find_traj(
     pdef = ob.ProblemDefinition(si)
     pdef.setStartAndGoalStates(start, goal)
 
-    planner = og.LBKPIECE1(si)
+    planner = OMPL_PLANNERS[planner](si)
     planner.setProblemDefinition(pdef)
-    planner.setBorderFraction(0.1)
     planner.setup()
 
-    solved = planner.solve(ob.CostConvergenceTerminationCondition(pdef))
+    termination = ob.CostConvergenceTerminationCondition(pdef)
+    if max_time is not None:
+        termination = ob.plannerOrTerminationCondition(
+            termination, ob.timedPlannerTerminationCondition(max_time)
+        )
+    if should_stop is not None:
+        termination = ob.plannerOrTerminationCondition(
+            termination,
+            ob.PlannerTerminationCondition(ob.PlannerTerminationConditionFn(should_stop)),
+        )
+    solved = planner.solve(termination)
     if not solved:
         if verbose:
             print(f"{Colors.RED}FAILED TO FIND OMPL SOLUTION{Colors.RESET}")
         return None
 
-    simplifier = og.PathSimplifier(si)
     path = pdef.getSolutionPath()
-    simplifier.simplify(path, 10)
+    if simplify == "ompl":
+        simplifier = og.PathSimplifier(si)
+        simplifier.simplify(path, 10)
+    step = RESOLUTION * space.getMaximumExtent()
+
+    if simplify == "shortcut":
+        res = np.array([state_to_q(state) for state in path.getStates()])
+        res = shortcut_path(checker, res, step, time_budget=simplify_time)
+        return densify(checker, res, step) if interpolate else res
 
+    raw = np.array([state_to_q(state) for state in path.getStates()])
     if interpolate:
         path.interpolate()
 
     res = np.array([state_to_q(state) for state in path.getStates()])
+    if simplify == "async":
+        get_path_smoother().submit(
+            station,
+            station_context,
+            checker.panda,
+            res,
+            step,
+            ignore_qs=checker.ignore_qs,
+            use_min_clearance=use_min_clearance,
+            interpolate=interpolate,
+            qs_to_smooth=raw,
+            time_budget=simplify_time,
+        )
     return res
 
 def best_grasp_for_shapes(
@@ -40,73 +40,66 @@ class MotionGenerator:
         return res, motion_finished
 
     def calculate_desired_values(self):
-        t = self.time
-        delta_q_d = np.zeros(DOF)
-        sign_delta_q = np.sign(self.delta_q)
-        t_d = self.t2_sync - self.t1_sync
-        delta_t2_sync = self.tf_sync - self.t2_sync
-        joint_motion_finished = [False] * DOF
+        qs, finished = self.evaluate(self.time)
+        return qs[0] - self.q_start, finished[0]
 
-        for i in range(DOF):
-            if np.abs(self.delta_q[i]) < self.k_delta_q_motion_finished:
-                delta_q_d[i] = 0.0
-                joint_motion_finished[i] = True
-            else:
-                if t < self.t1_sync[i]:
-                    delta_q_d[i] = (
-                        (-1.0 / (self.t1_sync[i] ** 3.0))
-                        * self.dq_max_sync[i]
-                        * sign_delta_q[i]
-                        * (0.5 * t - self.t1_sync[i])
-                        * (t ** 3.0)
-                    )
-                elif (t >= self.t1_sync[i]) and (t < self.t2_sync[i]):
-                    delta_q_d[i] = (
-                        self.q1[i]
-                        + (t - self.t1_sync[i]) * self.dq_max_sync[i] * sign_delta_q[i]
-                    )
-                elif (t >= self.t2_sync[i]) and (t < self.tf_sync[i]):
-                    #print("HERE", i)
-                    # print("DEPENDS:")
-                    # print(self.delta_q[i])
-                    # print(delta_t2_sync[i])
-                    # print(self.t1_sync[i])
-                    # print(t_d[i])
-                    # print(self.dq_max_sync[i])
-                    # print(sign_delta_q[i])
-                    #print(1.0 / (delta_t2_sync[i] ** 3.0))
-                    #print(t - self.t1_sync[i] - 2.0 * delta_t2_sync[i] - t_d[i])
-                    #print((t - self.t1_sync[i] - t_d[i]) ** 3.0)
-                    #print(
-                        #2.0 * t
-                        #- 2.0 * self.t1_sync[i]
-                        #- delta_t2_sync[i]
-                        #- 2.0 * t_d[i]
-                    #)
-                    delta_q_d[i] = (
-                        self.delta_q[i]
-                        + 0.5
-                        * (
-                            1.0
-                            / (delta_t2_sync[i] ** 3.0)
-                            * (t - self.t1_sync[i] - 2.0 * delta_t2_sync[i] - t_d[i])
-                            * ((t - self.t1_sync[i] - t_d[i]) ** 3.0)
-                            + (
-                                2.0 * t
-                                - 2.0 * self.t1_sync[i]
-                                - delta_t2_sync[i]
-                                - 2.0 * t_d[i]
-                            )
-                        )
-                        * self.dq_max_sync[i]
-                        * sign_delta_q[i]
-                    )
-                    #print(delta_q_d[i])
-                else:
-                    delta_q_d[i] = self.delta_q[i]
-                    joint_motion_finished[i] = True
+    def evaluate(self, times):
+        """
+        Evaluate the motion at all times (s, scalar or np.array of
+        shape (N,)) at once. Returns (qs, finished) where qs has shape (N, DOF)
+        and finished[i] is True iff the motion is over at times[i]
+        """
+        t = np.atleast_1d(np.asarray(times, dtype=float))[:, None]
+        t1, t2, tf = self.t1_sync, self.t2_sync, self.tf_sync
+        t_d = t2 - t1
+        delta_t2_sync = tf - t2
+        dq = self.dq_max_sync * np.sign(self.delta_q)
+        moving = np.abs(self.delta_q) >= self.k_delta_q_motion_finished
+
+        # each joint follows a quartic, then a linear, then a quartic segment
+        with np.errstate(divide="ignore", invalid="ignore"):
+            accelerating = (-1.0 / (t1 ** 3.0)) * dq * (0.5 * t - t1) * (t ** 3.0)
+            cruising = self.q1 + (t - t1) * dq
+            decelerating = (
+                self.delta_q
+                + 0.5
+                * (
+                    1.0
+                    / (delta_t2_sync ** 3.0)
+                    * (t - t1 - 2.0 * delta_t2_sync - t_d)
+                    * ((t - t1 - t_d) ** 3.0)
+                    + (2.0 * t - 2.0 * t1 - delta_t2_sync - 2.0 * t_d)
+                )
+                * dq
+            )
+        delta_q_d = np.where(
+            t < t1,
+            accelerating,
+            np.where(t < t2, cruising, np.where(t < tf, decelerating, self.delta_q)),
+        )
+        delta_q_d = np.where(moving, delta_q_d, 0.0)
+        finished = np.all(~moving | (t >= tf), axis=1)
+        return self.q_start + delta_q_d, finished
+
+    def duration(self):
+        """
+        Returns the time (s) at which the motion is over
+        """
+        moving = np.abs(self.delta_q) >= self.k_delta_q_motion_finished
+        return np.max(self.tf_sync[moving], initial=0.0)
 
-        return delta_q_d, np.all(joint_motion_finished)
+    def sample(self, dt=1e-3):
+        """
+        Returns (times, qs): the motion sampled every dt seconds, from 0
+        to the first sample at which it is over
+        """
+        n = int(np.ceil(self.duration() / dt))
+        times = np.arange(n + 1) * dt
+        qs, finished = self.evaluate(times)
+        if not finished[-1]:
+            times = np.append(times, (n + 1) * dt)
+            qs = np.vstack((qs, self.q_start + self.delta_q))
+        return times, qs
 
     def calculate_syncronized_values(self):
         dq_max_reach = self.dq_max
@@ -185,11 +178,6 @@ if __name__ == "__main__":
         ]
     )
     gen = MotionGenerator(0.2, q_start, q_goal)
-    t = 0
-    while True:
-        q, finished = gen(t)
+    for t, q in zip(*gen.sample(1e-3)):
         print(np.round(t, 3))
         print(q)
-        if finished:
-            break
-        t += 1e-3